@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+Offline benchmarks for predict.py.
+
+Each GFS grid asked for is served by a synthetic stand-in for NOMADS (see
+synthetic_gfs.py) and taken through the same steps as a real prediction:
+finding the dataset (with an empty and then a warm discovery cache),
+fetching the window, writing the wind files and, if it has been built,
+running the predictor on them. Each grid is run in a fresh process so that
+its peak RSS is its own. The timings are written out as JSON, e.g.
+
+    $ ./benchmarks/benchmark.py --grid 1p00 --grid 0p25 -o before.json
+
+so that results from different versions can be compared.
+"""
+
+import datetime
+import time as timelib
+import sys
+import os
+import optparse
+import tempfile
+import shutil
+import subprocess
+import contextlib
+import concurrent.futures
+import multiprocessing
+import json
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT)
+
+import synthetic_gfs
+
+def main():
+    """
+    The main program routine.
+    """
+
+    parser = optparse.OptionParser()
+    parser.add_option('--grid', dest='grids', action='append',
+            help='benchmark GFS grid GRID, 1p00 or 0p25; may be given more than once [default: both]',
+            metavar='GRID', choices=sorted(synthetic_gfs.GRIDS))
+    parser.add_option('--times', dest='times', type='int', default=0,
+            help='number of forecast times in each dataset [default: as the real product]',
+            metavar='N')
+    parser.add_option('--levels', dest='levels', type='int', default=0,
+            help='number of pressure levels in each dataset [default: as the real product]',
+            metavar='N')
+    parser.add_option('--lats', dest='lats', type='int', default=0,
+            help='number of latitudes in each dataset [default: the global grid]',
+            metavar='N')
+    parser.add_option('--lons', dest='lons', type='int', default=0,
+            help='number of longitudes in each dataset [default: the global grid]',
+            metavar='N')
+    parser.add_option('--lat', dest='lat', type='float', default=52,
+            help='window centre latitude [default: %default]', metavar='DEGREES')
+    parser.add_option('--lon', dest='lon', type='float', default=0,
+            help='window centre longitude [default: %default]', metavar='DEGREES')
+    parser.add_option('--latdelta', dest='latdelta', type='float', default=5,
+            help='window radius in latitude [default: %default]', metavar='DEGREES')
+    parser.add_option('--londelta', dest='londelta', type='float', default=5,
+            help='window radius in longitude [default: %default]', metavar='DEGREES')
+    parser.add_option('-p', '--past', dest='past', type='int', default=3,
+            help='hours of winds before the launch [default: %default]', metavar='HOURS')
+    parser.add_option('-f', '--future', dest='future', type='int', default=9,
+            help='hours of winds after the launch [default: %default]', metavar='HOURS')
+    parser.add_option('--latency', dest='latency', type='float', default=0.05,
+            help='delay each DAP request by SECONDS to stand in for the network [default: %default]',
+            metavar='SECONDS')
+    parser.add_option('--discovery-workers', dest='discovery_workers', type='int', default=8,
+            help='as for predict.py [default: %default]', metavar='N')
+    parser.add_option('--fetch-workers', dest='fetch_workers', type='int', default=5,
+            help='as for predict.py [default: %default]', metavar='N')
+    parser.add_option('--fetch-time-chunk', dest='fetch_time_chunk', type='int', default=4,
+            help='as for predict.py [default: %default]', metavar='STEPS')
+    parser.add_option('--fetch-memory', dest='fetch_memory', type='int', default=256,
+            help='as for predict.py [default: %default]', metavar='MB')
+    parser.add_option('--text-wind', dest='text_wind', action='store_true',
+            help='write wind files in the old text format')
+    parser.add_option('--no-predictor', dest='predictor', action='store_false', default=True,
+            help='do not run the predictor even if it has been built')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int', default=1,
+            help='run each grid N times [default: %default]', metavar='N')
+    parser.add_option('-o', '--output', dest='output',
+            help='write the results to FILE rather than stdout', metavar='FILE')
+    (options, args) = parser.parse_args()
+
+    grids = options.grids or sorted(synthetic_gfs.GRIDS)
+    settings = dict(vars(options), grids=grids)
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for grid in grids:
+        for run in range(options.repeat):
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_benchmark, grid, settings).result()
+            result['run'] = run
+            results.append(result)
+            sys.stderr.write('%s run %i: %s\n' % (grid, run, ', '.join(
+                '%s %.3fs' % (phase, seconds)
+                for phase, seconds in result['seconds'].items()
+                if seconds is not None)))
+
+    report = {
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'version': source_version(),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'settings': settings,
+        'results': results,
+        }
+    report_text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report_text + '\n')
+    else:
+        print(report_text)
+
+def source_version():
+    """
+    Return the git commit of the tree being benchmarked, if there is one.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(grid, settings):
+    """
+    Run every phase against a synthetic dataset on grid, in a scratch
+    directory, and return the timings. This runs in a process of its own.
+    """
+
+    # predict.py has plenty to say on stdout; keep it out of the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        import predict
+        # The phases use threads, so import everything predict.py leaves
+        # to be imported lazily now.
+        predict.load_dependencies()
+
+        work_dir = tempfile.mkdtemp(prefix='predict-benchmark-')
+        try:
+            return run_phases(predict, grid, settings, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_phases(predict, grid, settings, work_dir):
+    predict.GFS_DISCOVERY_DIR = os.path.join(work_dir, 'discovery')
+    predict.GFS_CACHE_DIR = os.path.join(work_dir, 'cache')
+    predict.GFS_RESPONSE_CACHE_DIR = os.path.join(work_dir, 'responses')
+    os.makedirs(predict.GFS_CACHE_DIR)
+
+    # Launch a few hours from now, with cycles appearing on the stand-in
+    # about as late as they do on NOMADS.
+    now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    launch = now + datetime.timedelta(hours=6)
+    shape = dict((key, settings[key]) for key in ('times', 'levels', 'lats', 'lons')
+                 if settings[key])
+    server = synthetic_gfs.SyntheticNomads(
+        synthetic_gfs.latest_cycle_before(now, 5), grid, settings['latency'], **shape)
+    predict.dap_application = server
+
+    seconds = {}
+    requests = {}
+    hd = grid == '0p25'
+
+    start = timelib.time()
+    dataset, url = predict.dataset_for_time(launch, hd, settings['discovery_workers'])
+    seconds['discovery_cold'] = timelib.time() - start
+    requests['discovery_cold'] = server.requests
+
+    # Forget what this process has learnt, leaving only the discovery cache
+    # on disk, as for the next run of predict.py.
+    predict.discovery_entries.clear()
+    start = timelib.time()
+    dataset, url = predict.dataset_for_time(launch, hd, settings['discovery_workers'])
+    seconds['discovery_warm'] = timelib.time() - start
+    requests['discovery_warm'] = server.requests - requests['discovery_cold']
+
+    window = (settings['lat'], settings['latdelta'],
+              predict.canonicalise_longitude(settings['lon']), settings['londelta'])
+    mintime = launch - datetime.timedelta(hours=settings['past'])
+    maxtime = launch + datetime.timedelta(hours=settings['future'])
+    gfs_dir = os.path.join(work_dir, 'gfs')
+    os.makedirs(gfs_dir)
+    if settings['text_wind']:
+        gfs_filename = 'gfs_%(time)_%(lat)_%(lon)_%(latdelta)_%(londelta).dat'
+    else:
+        gfs_filename = 'gfs_%(time)_%(lat)_%(lon)_%(latdelta)_%(londelta).bin'
+
+    # Time the download on its own by timing the calls write_file makes to
+    # fetch_grids.
+    fetch_grids = predict.fetch_grids
+    fetch_seconds = []
+    def timed_fetch_grids(*args, **kwargs):
+        start = timelib.time()
+        try:
+            return fetch_grids(*args, **kwargs)
+        finally:
+            fetch_seconds.append(timelib.time() - start)
+    predict.fetch_grids = timed_fetch_grids
+
+    before = server.requests
+    start = timelib.time()
+    predict.write_file(os.path.join(gfs_dir, gfs_filename), dataset, window,
+                       mintime, maxtime, text=settings['text_wind'],
+                       workers=settings['fetch_workers'],
+                       time_chunk=settings['fetch_time_chunk'],
+                       memory=settings['fetch_memory'] * 1024 * 1024)
+    total = timelib.time() - start
+    predict.fetch_grids = fetch_grids
+    seconds['fetch'] = sum(fetch_seconds)
+    seconds['write'] = total - seconds['fetch']
+    requests['fetch'] = server.requests - before
+
+    wind_files = os.listdir(gfs_dir)
+    wind_bytes = sum(os.path.getsize(os.path.join(gfs_dir, name))
+                     for name in wind_files)
+
+    seconds['predictor'] = None
+    predictor_exit_code = None
+    pred_binary = os.path.join(ROOT, predict.pred_binary)
+    if settings['predictor'] and os.path.exists(pred_binary):
+        scenario_filename = os.path.join(work_dir, 'scenario.ini')
+        with open(scenario_filename, 'w') as f:
+            f.write(scenario(settings, launch))
+        start = timelib.time()
+        predictor_exit_code = subprocess.call(
+            [pred_binary, '-i', gfs_dir, '-o', os.path.join(work_dir, 'flight_path.csv'),
+             scenario_filename],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds['predictor'] = timelib.time() - start
+
+    return {
+        'grid': grid,
+        'dataset': url,
+        'seconds': seconds,
+        'requests': requests,
+        'bytes_served': server.bytes,
+        'wind_files': len(wind_files),
+        'wind_bytes': wind_bytes,
+        'predictor_exit_code': predictor_exit_code,
+        'peak_rss_kb': peak_rss_kb(resource.RUSAGE_SELF) if resource else None,
+        'predictor_peak_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN)
+                                 if resource and seconds['predictor'] else None,
+        }
+
+def peak_rss_kb(who):
+    """
+    Return the peak resident set size of who, a resource.RUSAGE_* value, in
+    kilobytes.
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes rather than kilobytes.
+        peak //= 1024
+    return peak
+
+def scenario(settings, launch):
+    """
+    Return a scenario.ini launching from the middle of the benchmark window
+    at datetime launch, as the web front end would write it.
+    """
+    return '\n'.join([
+        '[launch-site]',
+        'latitude = %s' % settings['lat'],
+        'altitude = 0',
+        'longitude = %s' % (settings['lon'] % 360),
+        '[atmosphere]',
+        'wind-error = 0',
+        '[altitude-model]',
+        'ascent-rate = 5',
+        'descent-rate = 5',
+        'burst-altitude = 30000',
+        '[launch-time]',
+        'hour = %i' % launch.hour,
+        'month = %i' % launch.month,
+        'second = %i' % launch.second,
+        'year = %i' % launch.year,
+        'day = %i' % launch.day,
+        'minute = %i' % launch.minute,
+        '[predictor]',
+        'lat-delta = %s' % settings['latdelta'],
+        'time-delta = %s' % settings['future'],
+        'lon-delta = %s' % settings['londelta'],
+        'software = gfs',
+        '']) + '\n'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+Check how long predict.py takes to import, which every run spends before it
+can so much as reject its arguments or find its prediction already running.
+predict.py is imported in a fresh interpreter a few times, and the check
+fails if the median time is over budget, e.g.
+
+    $ ./benchmarks/startup.py --budget 100
+
+The imports which took longest are listed, to show what to make lazy next.
+"""
+
+import sys
+import os
+import optparse
+import subprocess
+import statistics
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+
+# How long, in milliseconds, importing predict.py may take by default. The
+# tests hold it to this too.
+BUDGET = 100
+
+def main():
+    """
+    The main program routine.
+    """
+
+    parser = optparse.OptionParser()
+    parser.add_option('--budget', dest='budget', type='float', default=BUDGET,
+            help='fail if importing predict.py takes longer than MS milliseconds [default: %default]',
+            metavar='MS')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int', default=5,
+            help='import predict.py N times [default: %default]', metavar='N')
+    parser.add_option('--top', dest='top', type='int', default=5,
+            help='list the N slowest imports [default: %default]', metavar='N')
+    (options, args) = parser.parse_args()
+
+    runs = [import_times() for run in range(options.repeat)]
+    total = statistics.median(times['predict'] for times in runs) / 1000.
+    print('predict.py imports in %.1fms (median of %i), budget %.1fms' % \
+        (total, len(runs), options.budget))
+
+    slowest = sorted(runs[-1].items(), key=lambda item: -item[1])
+    for name, microseconds in slowest[1:options.top + 1]:
+        print('    %8.1fms %s' % (microseconds / 1000., name))
+
+    if total > options.budget:
+        print('Over budget.')
+        sys.exit(1)
+
+def import_times():
+    """
+    Import predict.py in a fresh interpreter and return the cumulative time,
+    in microseconds, each module imported along the way took, by name.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import predict'],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+
+    # -X importtime lists each module after those it imported, so predict's
+    # own imports are those between the previous top level module and it.
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            if name.strip() == 'predict':
+                times['predict'] = int(cumulative)
+                return times
+            times = {}
+            continue
+        times[name.strip()] = int(cumulative)
+    raise RuntimeError('predict was not imported:\n' + process.stderr)
+
+if __name__ == '__main__':
+    main()
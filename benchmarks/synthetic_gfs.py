@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# A synthetic stand-in for the NOMADS OPeNDAP server, for benchmarking
+# predict.py without touching the network.
+
+import datetime
+import math
+import re
+import threading
+import time as timelib
+
+import numpy
+import webob.exc
+
+from pydap.model import DatasetType, BaseType, GridType
+from pydap.handlers.lib import BaseHandler
+
+# Grid spacing in degrees and default number of levels and times for each of
+# the GFS products predict.py uses.
+GRIDS = {
+    '1p00': {'resolution': 1.0, 'levels': 41, 'times': 129},
+    '0p25': {'resolution': 0.25, 'levels': 41, 'times': 129},
+    }
+
+# The GFS pressure levels, in hPa.
+GFS_LEVELS = [1000, 975, 950, 925, 900, 850, 800, 750, 700, 650, 600, 550, 500,
+              450, 400, 350, 300, 250, 200, 150, 100, 70, 50, 40, 30, 20, 15,
+              10, 7, 5, 3, 2, 1, 0.7, 0.4, 0.2, 0.1, 0.07, 0.04, 0.02, 0.01]
+
+# Hours between forecast times, and between cycles.
+TIME_STEP = 3
+CYCLE_STEP = 6
+
+WIND_VARIABLES = ('hgtprs', 'ugrdprs', 'vgrdprs', 'tmpprs', 'vvelprs')
+
+def pressure_levels(count):
+    """
+    Return count pressure levels, in hPa, from the surface up.
+    """
+    if count <= len(GFS_LEVELS):
+        return numpy.array(GFS_LEVELS[:count], dtype=float)
+    return numpy.geomspace(1000, 0.01, count)
+
+def standard_height(pressure):
+    """
+    Return the height in metres of the pressure level in hPa in the
+    international standard atmosphere.
+    """
+    pressure = numpy.asarray(pressure, dtype=float)
+    troposphere = 44330.8 * (1 - (pressure / 1013.25) ** 0.190263)
+    stratosphere = 11000 + 6341.6 * numpy.log(226.32 / pressure)
+    return numpy.where(pressure > 226.32, troposphere, stratosphere)
+
+def gfs_time(time):
+    """
+    Convert a datetime into a GFS fractional timestamp, the inverse of
+    predict.timestamp_to_datetime.
+    """
+    midnight = datetime.datetime(time.year, time.month, time.day)
+    return time.toordinal() + 1 + (time - midnight).total_seconds() / 86400
+
+class SyntheticVariable(object):
+    """
+    An array-like GFS variable whose values are made up on demand, so that
+    even a full 0.25 degree dataset costs no memory until it is sliced.
+
+    Heights follow the standard atmosphere, and the winds, temperature and
+    vertical velocity vary smoothly in space and time.
+    """
+
+    def __init__(self, name, time, lev, lat, lon):
+        self.name = name
+        self.axes = (time, lev, lat, lon)
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.dtype = numpy.dtype('float32')
+        self.heights = standard_height(lev)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        indices = []
+        squeeze = []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                indices.append(numpy.arange(n)[k])
+            else:
+                indices.append(numpy.array([numpy.arange(n)[k]]))
+                squeeze.append(axis)
+
+        t, l, y, x = numpy.ix_(*indices)
+        hours = t * TIME_STEP
+        height = self.heights[l]
+        lat = numpy.radians(self.axes[2][y])
+        lon = numpy.radians(self.axes[3][x])
+
+        if self.name == 'hgtprs':
+            values = height + 100 * numpy.sin(lat) * numpy.cos(lon + 0.01 * hours)
+        elif self.name == 'ugrdprs':
+            values = 10 + 0.001 * height + 5 * numpy.cos(lat) * numpy.sin(lon + 0.02 * hours)
+        elif self.name == 'vgrdprs':
+            values = 5 * numpy.sin(2 * lon + 0.01 * hours) * numpy.cos(lat) + 0 * height
+        elif self.name == 'tmpprs':
+            values = 288.15 - 0.0065 * numpy.minimum(height, 11000) + 2 * numpy.cos(lat) + 0 * (lon + hours)
+        else:
+            values = 0.1 * numpy.sin(lon + lat + 0.05 * hours) + 0 * height
+
+        values = numpy.broadcast_to(values, tuple(len(i) for i in indices))
+        return numpy.squeeze(values, axis=tuple(squeeze)).astype(self.dtype)
+
+def synthetic_dataset(cycle, grid='1p00', times=None, levels=None,
+                      lats=None, lons=None):
+    """
+    Return a pydap dataset shaped like the GFS grid ('1p00' or '0p25') run at
+    the datetime cycle. times and levels default to those of the real
+    product, and lats and lons to its global grid.
+    """
+    spec = GRIDS[grid]
+    resolution = spec['resolution']
+    times = times or spec['times']
+    levels = levels or spec['levels']
+    lats = lats or int(round(180 / resolution)) + 1
+    lons = lons or int(round(360 / resolution))
+
+    axes = {
+        'time': numpy.array([gfs_time(cycle + datetime.timedelta(hours=TIME_STEP * i))
+                             for i in range(times)]),
+        'lev': pressure_levels(levels),
+        'lat': -90 + resolution * numpy.arange(lats),
+        'lon': resolution * numpy.arange(lons),
+        }
+
+    dataset = DatasetType('gfs_%s_%02iz' % (grid, cycle.hour))
+    for name, values in axes.items():
+        dataset[name] = BaseType(name, values, dimensions=(name,))
+    for name in WIND_VARIABLES:
+        grid_var = GridType(name)
+        grid_var[name] = BaseType(name,
+            SyntheticVariable(name, axes['time'], axes['lev'], axes['lat'], axes['lon']),
+            dimensions=('time', 'lev', 'lat', 'lon'))
+        for axis in ('time', 'lev', 'lat', 'lon'):
+            grid_var[axis] = BaseType(axis, axes[axis], dimensions=(axis,))
+        dataset[name] = grid_var
+    return dataset
+
+class SyntheticNomads(object):
+    """
+    A WSGI application answering DAP requests for any GFS cycle URL in the
+    form predict.possible_urls builds, with synthetic data.
+
+    Cycles later than latest_cycle have not been 'published' yet and get a
+    404, as on NOMADS. Each request is delayed by latency seconds to stand in
+    for the round trip to the real server. The number of requests answered
+    and bytes sent are counted in requests and bytes.
+    """
+
+    def __init__(self, latest_cycle, grid='1p00', latency=0.0, **shape):
+        self.latest_cycle = latest_cycle
+        self.grid = grid
+        self.latency = latency
+        self.shape = shape
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def __call__(self, environ, start_response):
+        if self.latency:
+            timelib.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+
+        match = re.search(r'/gfs(\d{8})/gfs_\w+_(\d\d)z\.\w+$', environ['PATH_INFO'])
+        if match is None:
+            return webob.exc.HTTPNotFound()(environ, start_response)
+        cycle = datetime.datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H')
+        if cycle > self.latest_cycle:
+            return webob.exc.HTTPNotFound()(environ, start_response)
+
+        with self.lock:
+            handler = self.handlers.get(cycle)
+            if handler is None:
+                handler = BaseHandler(synthetic_dataset(cycle, self.grid, **self.shape))
+                self.handlers[cycle] = handler
+
+        for chunk in handler(environ, start_response):
+            with self.lock:
+                self.bytes += len(chunk)
+            yield chunk
+
+def latest_cycle_before(time, delay):
+    """
+    Return the latest GFS cycle which would be published by datetime time,
+    given that cycles appear delay hours after their nominal time.
+    """
+    time -= datetime.timedelta(hours=delay)
+    return datetime.datetime(time.year, time.month, time.day,
+                             time.hour - time.hour % CYCLE_STEP)
@@ -1,4 +0,0 @@
-#!/bin/bash
-cd /tmp/pydap-cache
-ls /tmp/pydap-cache -1 | grep -v `date +"%Y%m%d"` | xargs rm -f
-
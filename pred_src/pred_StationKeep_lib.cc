@@ -0,0 +1,123 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <vector>
+
+#include "pred_StationKeep_lib.h"
+#include "pred_StationKeep.hh"
+#include "run_model_StationKeep.hh"
+
+#include "state/ALTAIR_state.hh"
+#include "state/ExternalEnvironState.hh"
+#include "state/BalloonAndPfoilState.hh"
+#include "state/GondolaAndPropState.hh"
+#include "state/OptSourcePayloadState.hh"
+
+// The globals pred_StationKeep.cc otherwise provides. No output files are
+// written: the positions are collected through position_hook instead.
+FILE* output = NULL;
+FILE* kml_file = NULL;
+
+const char* data_dir;
+int verbosity;
+
+// the track of the run in progress
+static std::vector<double> _track;
+
+static void
+_record_position(const double *position)
+{
+    _track.insert(_track.end(), position, position + POSITION_COLUMNS);
+}
+
+// altitude_model_get_altitude creates a fresh set of states at the start of
+// every run; free the last run's rather than leaking them.
+static void
+_free_altair_state()
+{
+    delete altairState->getExtEnv();
+    delete altairState->getBalAndPfoil();
+    delete altairState->getGondAndProp();
+    delete altairState->getOptSource();
+    altairState->setExtEnv(0);
+    altairState->setBalAndPfoil(0);
+    altairState->setGondAndProp(0);
+    altairState->setOptSource(0);
+}
+
+wind_file_cache_t*
+pred_wind_cache_new(const char* directory)
+{
+    return wind_file_cache_new(directory);
+}
+
+void
+pred_wind_cache_free(wind_file_cache_t* cache)
+{
+    if (cache)
+        wind_file_cache_free(cache);
+}
+
+int
+pred_run(wind_file_cache_t* cache,
+         float initial_lat, float initial_lng, float initial_alt,
+         long int initial_timestamp, float rmswinderror, int verbose,
+         double** track, unsigned int* n_positions)
+{
+    int r;
+
+    verbosity = verbose;
+    _track.clear();
+    position_hook = _record_position;
+
+    r = run_model(cache, initial_lat, initial_lng, initial_alt, initial_timestamp,
+                  rmswinderror);
+
+    position_hook = NULL;
+    _free_altair_state();
+
+    *n_positions = _track.size() / POSITION_COLUMNS;
+    *track = (double*) malloc(sizeof(double) * (_track.size() ? _track.size() : 1));
+    if (!*track) {
+        *n_positions = 0;
+        return 0;
+    }
+    memcpy(*track, _track.data(), sizeof(double) * _track.size());
+    _track.clear();
+
+    return r;
+}
+
+int
+pred_get_wind(wind_file_cache_t* cache, float lat, float lng, float alt,
+              long int timestamp, float* wind_u, float* wind_v, float* wind_var)
+{
+    float pres, temp, wind_z;
+
+    return get_wind(cache, lat, lng, alt, timestamp, wind_v, wind_u, wind_var,
+                    &pres, &temp, &wind_z);
+}
+
+void
+pred_track_free(double* track)
+{
+    free(track);
+}
+
+int
+pred_position_columns(void)
+{
+    return POSITION_COLUMNS;
+}
+
+// vim:sw=4:ts=4:et:cindent
@@ -0,0 +1,76 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#ifndef __PRED_STATIONKEEP_LIB_H__
+#define __PRED_STATIONKEEP_LIB_H__
+
+// The pred_StationKeep model as a shared library, so that a program (such
+// as predict.py, through ctypes) can scan a directory of wind files once and
+// then run as many scenarios against it as it likes without starting the
+// predictor for each. The model keeps its state in globals, so only one run
+// may be going on in a process at a time.
+
+#include "wind/wind_file_cache_ALTAIR.h"
+
+#ifdef __cplusplus
+extern "C" {
+#endif // __cplusplus
+
+//                      Scan 'data_dir' for wind files, as the predictor's -i option does.
+//                      Files are read the first time a run needs them and kept until the
+//                      cache is freed with pred_wind_cache_free. Returns NULL on failure.
+wind_file_cache_t      *pred_wind_cache_new    (const char               *data_dir);
+
+//                      Free 'cache' and every wind file read into it.
+void                    pred_wind_cache_free   (wind_file_cache_t        *cache);
+
+//                      Run the model for a launch from the given position and POSIX time
+//                      with the winds in 'cache', as pred_StationKeep does for a scenario.
+//                      The flight path is returned in *track, which is to be freed with
+//                      pred_track_free, as *n_positions rows of POSITION_COLUMNS values in
+//                      the order of the CSV output. Returns 1 if the run went to the end
+//                      and 0 if it stopped early, as when it ran out of winds; the track
+//                      so far is returned either way.
+int                     pred_run               (wind_file_cache_t        *cache,
+                                                float                     initial_lat,
+                                                float                     initial_lng,
+                                                float                     initial_alt,
+                                                long int                  initial_timestamp,
+                                                float                     rmswinderror,
+                                                int                       verbose,
+                                                double                  **track,
+                                                unsigned int             *n_positions);
+
+//                      Look up the wind in 'cache' at the given position and POSIX time, as
+//                      the model does at every step: interpolated in space within the wind
+//                      files either side of the time, and then in time between them. The
+//                      wind is returned in *wind_u and *wind_v, in m/s, and the variance of
+//                      its speed in *wind_var. Returns 1 if there were winds for the point
+//                      and 0 if not.
+int                     pred_get_wind          (wind_file_cache_t        *cache,
+                                                float                     lat,
+                                                float                     lng,
+                                                float                     alt,
+                                                long int                  timestamp,
+                                                float                    *wind_u,
+                                                float                    *wind_v,
+                                                float                    *wind_var);
+
+//                      Free a track returned by pred_run.
+void                    pred_track_free        (double                   *track);
+
+//                      Return POSITION_COLUMNS, so that callers can check they agree.
+int                     pred_position_columns  (void);
+
+#ifdef __cplusplus
+}
+#endif // __cplusplus
+
+#endif // __PRED_STATIONKEEP_LIB_H__
@@ -38,6 +38,8 @@ extern int verbosity;
 
 #define RADIUS_OF_EARTH 6371009.f
 
+void (*position_hook)(const double *position) = NULL;
+
 typedef struct model_state_s model_state_t;
 struct model_state_s
 {
@@ -326,6 +328,14 @@ void write_position(float lat, float lng, float alt, int timestamp) {
 //    fprintf(output, "%d,%g,%g,%g\n", timestamp, lat, lng, alt);
 //    fprintf(output, "%d,%g,%g,%g,%g\n", timestamp, lat, lng, alt, altairState->getGondAndProp()->getBatteryStoredEnergy());
     PropulsionUtils::getPropVelocityVector(&prop_u, &prop_v, &prop_z);
+    if (position_hook) {
+        const double position[POSITION_COLUMNS] = { (double)timestamp, lat, lng, alt, gondAndProp->getBatteryStoredEnergy(),
+            prop_u, prop_v, prop_z, (double)gondAndProp->getRPMMotor1(), (double)gondAndProp->getRPMMotor2(),
+            (double)gondAndProp->getRPMMotor3(), (double)gondAndProp->getRPMMotor4() };
+        position_hook(position);
+    }
+    if (!output)
+        return;
     fprintf(output, "%11d,%4.4f,%4.4f,%7.1f,%6.0f,%6.3f,%6.3f,%6.3f,%4d,%4d,%4d,%4d\n", timestamp, lat, lng, alt, gondAndProp->getBatteryStoredEnergy(),
             prop_u, prop_v, prop_z, gondAndProp->getRPMMotor1(), gondAndProp->getRPMMotor2(), gondAndProp->getRPMMotor3(), gondAndProp->getRPMMotor4());
 //    expPower = PropulsionUtils::getExpendedPower();
@@ -46,5 +46,13 @@ int get_wind(wind_file_cache_t* cache, float lat, float lng, float alt, long int
 // write a position entry into the output files
 void write_position(float lat, float lng, float alt, int timestamp);
 
+// the number of columns in each position entry in the CSV output
+#define POSITION_COLUMNS 12
+
+// if set, write_position also passes each position entry to this, as the
+// POSITION_COLUMNS values of the CSV output; with no output file set, this
+// is all it does. See pred_StationKeep_lib.cc.
+extern void (*position_hook)(const double *position);
+
 #endif // __RUN_MODEL_STATIONKEEP_HH__
 
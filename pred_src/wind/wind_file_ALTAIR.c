@@ -16,8 +16,10 @@
 #include <stdlib.h>
 #include <assert.h>
 #include <math.h>
+#include <string.h>
 
 #include "../util/getline.h"
+#include "wind_file_binary.h"
 
 extern int   verbosity;
 // const  float pressurelev[31] = { 100000.0, 97500.0, 95000.0, 92500.0, 90000.0, 85000.0, 80000.0, 75000.0, 
@@ -53,6 +55,10 @@ struct wind_file_s
 
         //                      A pointer to the actual data.
         float                  *data;
+
+        //                      For binary files, the file 'data' points
+        //                      into. NULL if 'data' was malloc-ed.
+        wind_file_binary_t     *binary;
 };
 
 // These exciting functions are all to do with the fact that 'left' and 'right'
@@ -205,6 +211,54 @@ _parse_values_line(const char* line, unsigned int n_values, float* values)
         return record_idx == n_values;
 }
 
+// Open a binary wind file. The axes are copied out of it but the data itself
+// is used in place.
+static wind_file_t*
+_wind_file_new_binary(const char* filepath)
+{
+        wind_file_binary_t* binary;
+        const float* values;
+        unsigned int i;
+        wind_file_t* self;
+
+        binary = wind_file_binary_open(filepath);
+        if(!binary)
+                return NULL;
+
+        self = (wind_file_t*)malloc(sizeof(wind_file_t));
+        self->binary = binary;
+        self->lat = binary->header->lat;
+        self->latrad = binary->header->latrad;
+        self->lon = binary->header->lon;
+        self->lonrad = binary->header->lonrad;
+        self->timestamp = binary->header->timestamp;
+        self->n_components = binary->header->n_components;
+
+        // copy out the axes
+        self->n_axes = binary->header->n_axes;
+        self->axes = (wind_file_axis_t**)calloc(self->n_axes, sizeof(wind_file_axis_t*));
+        values = binary->axis_values;
+        for(i=0; i<self->n_axes; ++i)
+        {
+                unsigned int n_values = binary->axis_lengths[i];
+                self->axes[i] = (wind_file_axis_t*)
+                        malloc(sizeof(wind_file_axis_t) + sizeof(float)*(n_values-1));
+                self->axes[i]->n_values = n_values;
+                memcpy(self->axes[i]->values, values, sizeof(float)*n_values);
+                values += n_values;
+        }
+
+        self->data = (float*)binary->data;
+
+        if(verbosity > 0)
+                fprintf(stderr, "INFO: Data is %i axis made up of "
+                                "(%lu records) x (%i components).\n",
+                                self->n_axes, (unsigned long)binary->n_records,
+                                self->n_components);
+
+        return self;
+}
+
 wind_file_t*
 wind_file_new(const char* filepath)
 {
@@ -213,10 +267,15 @@ wind_file_new(const char* filepath)
         size_t line_len;
         int num_lines, num_axes, num_components, i;
         wind_file_t* self;
+        wind_file_binary_header_t header;
 
         if(verbosity > 0)
                 fprintf(stderr, "INFO: Loading wind data from '%s'.\n", filepath);
 
+        // binary files are used in place rather than parsed.
+        if(wind_file_binary_read_header(filepath, &header))
+                return _wind_file_new_binary(filepath);
+
         file = fopen(filepath, "r");
         if(!file) {
                 perror("ERROR: Could not open file.");
@@ -235,6 +294,7 @@ wind_file_new(const char* filepath)
         self->n_axes = 0;
         self->axes = NULL;
         self->data = NULL;
+        self->binary = NULL;
 
         if(5 != sscanf(line, "%f,%f,%f,%f,%ld", 
                                 &self->lat, &self->latrad, 
@@ -428,7 +488,11 @@ wind_file_free(wind_file_t* file)
                 free(file->axes);
         }
 
-        if(file->data)
+        if(file->binary)
+        {
+                wind_file_binary_close(file->binary);
+        }
+        else if(file->data)
         {
                 free(file->data);
         }
@@ -526,6 +590,28 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
         // by default, return nothing in case of error.
         *windu = *windv = 0.f;
 
+        // the cached cell is only any use in a file with the same axes as the
+        // one it was found in, which a process running the model against more
+        // than one wind file cache need not be looking at
+        if(have_valid_latlon_cache)
+        {
+                if((left_lat_idx >= file->axes[1]->n_values) ||
+                   (right_lat_idx >= file->axes[1]->n_values) ||
+                   (left_lon_idx >= file->axes[2]->n_values) ||
+                   (right_lon_idx >= file->axes[2]->n_values) ||
+                   (have_valid_pressure_cache &&
+                    ((left_pr_idx >= file->axes[0]->n_values) ||
+                     (right_pr_idx >= file->axes[0]->n_values))) ||
+                   (file->axes[1]->values[left_lat_idx] != left_lat) ||
+                   (file->axes[1]->values[right_lat_idx] != right_lat) ||
+                   (file->axes[2]->values[left_lon_idx] != left_lon) ||
+                   (file->axes[2]->values[right_lon_idx] != right_lon))
+                {
+                        have_valid_latlon_cache = 0;
+                        have_valid_pressure_cache = 0;
+                }
+        }
+
         // see if the cache is indeed valid
         if(have_valid_latlon_cache)
         {
@@ -0,0 +1,245 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#include "wind_file_binary.h"
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+// Files are memory mapped on anything POSIX, Cygwin included. Elsewhere, as
+// in Visual Studio builds, they are read into memory instead.
+#if !defined(_WIN32) || defined(__CYGWIN__)
+#define WIND_FILE_BINARY_MMAP
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#endif
+
+// Return non-zero iff this machine stores multi-byte values little-endian,
+// which is the byte order binary wind files are written in.
+static int
+_host_is_little_endian(void)
+{
+        uint16_t one = 1;
+        return *((uint8_t*)&one) == 1;
+}
+
+// Return the contents of the file at 'filepath', setting *length to its size,
+// or NULL on failure. Free them with _free_contents.
+static void*
+_load_contents(const char* filepath, size_t* length)
+{
+#ifdef WIND_FILE_BINARY_MMAP
+        int fd;
+        struct stat stat_buf;
+        void* contents;
+
+        fd = open(filepath, O_RDONLY);
+        if(fd < 0) {
+                perror("ERROR: Could not open file.");
+                return NULL;
+        }
+
+        if(fstat(fd, &stat_buf) < 0) {
+                perror("ERROR: Could not stat file.");
+                close(fd);
+                return NULL;
+        }
+        *length = stat_buf.st_size;
+
+        if(*length < sizeof(wind_file_binary_header_t))
+        {
+                fprintf(stderr, "ERROR: EOF before binary header.\n");
+                close(fd);
+                return NULL;
+        }
+
+        contents = mmap(NULL, *length, PROT_READ, MAP_PRIVATE, fd, 0);
+
+        // the mapping stays valid after the descriptor is closed.
+        close(fd);
+
+        if(contents == MAP_FAILED) {
+                perror("ERROR: Could not map file.");
+                return NULL;
+        }
+        return contents;
+#else
+        FILE* file;
+        long file_length;
+        void* contents;
+
+        file = fopen(filepath, "rb");
+        if(!file) {
+                perror("ERROR: Could not open file.");
+                return NULL;
+        }
+
+        if((fseek(file, 0, SEEK_END) != 0) || ((file_length = ftell(file)) < 0))
+        {
+                perror("ERROR: Could not find length of file.");
+                fclose(file);
+                return NULL;
+        }
+        rewind(file);
+        *length = file_length;
+
+        if(*length < sizeof(wind_file_binary_header_t))
+        {
+                fprintf(stderr, "ERROR: EOF before binary header.\n");
+                fclose(file);
+                return NULL;
+        }
+
+        contents = malloc(*length);
+        if(!contents || (1 != fread(contents, *length, 1, file)))
+        {
+                fprintf(stderr, "ERROR: Could not read file.\n");
+                free(contents);
+                fclose(file);
+                return NULL;
+        }
+
+        fclose(file);
+        return contents;
+#endif
+}
+
+static void
+_free_contents(void* contents, size_t length)
+{
+#ifdef WIND_FILE_BINARY_MMAP
+        munmap(contents, length);
+#else
+        free(contents);
+#endif
+}
+
+int
+wind_file_binary_read_header(const char* filepath, wind_file_binary_header_t* header)
+{
+        FILE* file;
+        int is_binary;
+
+        file = fopen(filepath, "rb");
+        if(!file)
+                return 0;
+
+        is_binary = (1 == fread(header, sizeof(*header), 1, file)) &&
+                (0 == memcmp(header->magic, WIND_FILE_BINARY_MAGIC, WIND_FILE_BINARY_MAGIC_LEN));
+        fclose(file);
+
+        return is_binary;
+}
+
+wind_file_binary_t*
+wind_file_binary_open(const char* filepath)
+{
+        wind_file_binary_t* self;
+        size_t expected_len, n_axis_values;
+        const wind_file_binary_header_t* header;
+        unsigned int i;
+
+        if(!_host_is_little_endian())
+        {
+                fprintf(stderr, "ERROR: Binary wind files are only supported "
+                                "on little-endian machines.\n");
+                return NULL;
+        }
+
+        self = (wind_file_binary_t*)malloc(sizeof(wind_file_binary_t));
+        self->contents = _load_contents(filepath, &self->length);
+        if(!self->contents)
+        {
+                free(self);
+                return NULL;
+        }
+
+        header = self->header = (const wind_file_binary_header_t*)self->contents;
+        if(header->version != WIND_FILE_BINARY_VERSION)
+        {
+                fprintf(stderr, "ERROR: Unsupported binary wind file version %u.\n",
+                                header->version);
+                wind_file_binary_close(self);
+                return NULL;
+        }
+
+        if(header->n_axes != 3) 
+        {
+                fprintf(stderr, "ERROR: Expected 3 axes in file.\n");
+                wind_file_binary_close(self);
+                return NULL;
+        }
+
+        if(header->n_components != 5) 
+        {
+                fprintf(stderr, "ERROR: Expected 5 component data in file.\n");
+                wind_file_binary_close(self);
+                return NULL;
+        }
+
+        // work out how big the file should be from the axis lengths.
+        self->axis_lengths = (const uint32_t*)(header + 1);
+        expected_len = sizeof(wind_file_binary_header_t) + 
+                sizeof(uint32_t) * header->n_axes;
+        if(self->length < expected_len)
+        {
+                fprintf(stderr, "ERROR: EOF before axis value counts.\n");
+                wind_file_binary_close(self);
+                return NULL;
+        }
+
+        n_axis_values = 0;
+        self->n_records = 1;
+        for(i=0; i<header->n_axes; ++i)
+        {
+                if(self->axis_lengths[i] < 1) 
+                {
+                        fprintf(stderr, "ERROR: axis %i count is < 1.\n", i);
+                        wind_file_binary_close(self);
+                        return NULL;
+                }
+                n_axis_values += self->axis_lengths[i];
+                self->n_records *= self->axis_lengths[i];
+        }
+
+        expected_len += sizeof(float) * 
+                (n_axis_values + self->n_records * header->n_components);
+        if(self->length != expected_len)
+        {
+                fprintf(stderr, "ERROR: Binary wind file is %lu bytes, "
+                                "expected %lu. The file may be corrupt or truncated.\n",
+                                (unsigned long)self->length, (unsigned long)expected_len);
+                wind_file_binary_close(self);
+                return NULL;
+        }
+
+        // the axis values, and then the data is whatever follows.
+        self->axis_values = (const float*)(self->axis_lengths + header->n_axes);
+        self->data = self->axis_values + n_axis_values;
+
+        return self;
+}
+
+void
+wind_file_binary_close(wind_file_binary_t* file)
+{
+        if(!file)
+                return;
+
+        _free_contents(file->contents, file->length);
+        free(file);
+}
+
+// Data for God's own editor.
+// vim:sw=8:ts=8:et:cindent
@@ -0,0 +1,95 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#ifndef __WIND_FILE_BINARY_H__
+#define __WIND_FILE_BINARY_H__
+
+#include <stddef.h>
+#include <stdint.h>
+
+// Layout of the binary wind files written by predict.py. Everything is
+// little-endian. The file is:
+//
+//   - a wind_file_binary_header_t,
+//   - n_axes uint32 axis lengths (pressures, latitudes, longitudes),
+//   - the float32 values of each axis, one axis after another,
+//   - the float32 data in axis 3 major order, n_components per record.
+//
+// Every field is 4-byte aligned so the data can be used straight out of an
+// mmap(2)-ed file without being parsed or copied. The reader is shared by the
+// plain and ALTAIR wind readers; see wind_file_binary.c.
+
+#define WIND_FILE_BINARY_MAGIC          "CUSFWIND"
+#define WIND_FILE_BINARY_MAGIC_LEN      8
+#define WIND_FILE_BINARY_VERSION        1
+
+typedef struct wind_file_binary_header_s wind_file_binary_header_t;
+struct wind_file_binary_header_s
+{
+        char                    magic[WIND_FILE_BINARY_MAGIC_LEN];
+        uint32_t                version;
+        uint32_t                n_axes;
+        uint32_t                n_components;
+        uint32_t                reserved;
+
+        //                      Window centre and radius, as in the text header.
+        float                   lat, latrad;
+        float                   lon, lonrad;
+
+        //                      As POSIX timestamp.
+        int64_t                 timestamp;
+};
+
+// A binary wind file read by wind_file_binary_open. Everything points into
+// the file's contents, which are memory mapped where the platform allows and
+// read into memory otherwise.
+typedef struct wind_file_binary_s wind_file_binary_t;
+struct wind_file_binary_s
+{
+        const wind_file_binary_header_t        *header;
+
+        //                      The header's n_axes axis lengths, then the values of each
+        //                      axis one after another.
+        const uint32_t                         *axis_lengths;
+        const float                            *axis_values;
+
+        //                      n_records records of header->n_components values each.
+        const float                            *data;
+        size_t                                  n_records;
+
+        void                                   *contents;
+        size_t                                  length;
+};
+
+#ifdef __cplusplus
+extern "C" {
+#endif // __cplusplus
+
+//                      Read the header of the file at 'filepath' into *header. Returns
+//                      non-zero iff it is a binary wind file.
+int                     wind_file_binary_read_header   (const char                 *filepath,
+                                                        wind_file_binary_header_t  *header);
+
+//                      Open the binary wind file at 'filepath', checking that it holds the
+//                      3 axis, 5 component data the wind readers expect. Returns NULL on
+//                      failure.
+wind_file_binary_t     *wind_file_binary_open          (const char                 *filepath);
+
+//                      Close 'file', after which nothing it pointed to may be used.
+void                    wind_file_binary_close         (wind_file_binary_t         *file);
+
+#ifdef __cplusplus
+}
+#endif // __cplusplus
+
+#endif // __WIND_FILE_BINARY_H__
+
+// Data for God's own editor.
+// vim:sw=8:ts=8:et:cindent
@@ -27,6 +27,7 @@
 #include <math.h>
 
 #include "../util/getline.h"
+#include "wind_file_binary.h"
 
 extern int verbosity;
 
@@ -58,6 +59,18 @@ _parse_header(const char* filepath,
         FILE* file;
         char* line;
         size_t line_len;
+        wind_file_binary_header_t header;
+
+        // Is it a binary file? If so, the header is at the start.
+        if(wind_file_binary_read_header(filepath, &header))
+        {
+                *lat = header.lat;
+                *latrad = header.latrad;
+                *lon = header.lon;
+                *lonrad = header.lonrad;
+                *timestamp = header.timestamp;
+                return 1;
+        }
 
         // Can I open this file?
         file = fopen(filepath, "r");
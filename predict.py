@@ -15,11 +15,22 @@ import traceback
 import calendar
 import optparse
 import subprocess
-import statsd
 import tempfile
 import shutil
 import bisect
-import simplejson as json
+import concurrent.futures
+import contextlib
+import threading
+import configparser
+import copy
+import struct
+import zlib
+import gzip
+import array
+import hashlib
+import importlib.machinery
+import importlib.util
+from urllib.parse import urlsplit, urlunsplit
 
 # handle both predict.py's
 filepath = os.path.dirname(os.path.abspath(__file__))
@@ -29,6 +40,75 @@ else:
     sys.path.append(os.path.join(filepath, 'predict'))
     from py_variables import *
 
+def lazy_import(name):
+    """
+    Return the module name, which is only actually imported when one of its
+    attributes is first used, and make it an attribute of its package as the
+    import statement would.
+
+    This is not safe to trigger from several threads at once, so everything
+    imported this way is loaded by load_dependencies before any threads are
+    started.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    package, _, attribute = name.rpartition('.')
+    if package:
+        # Find the module without loading its package, as find_spec would.
+        parent_spec = object.__getattribute__(lazy_import(package), '__spec__')
+        spec = importlib.machinery.PathFinder.find_spec(name,
+                parent_spec.submodule_search_locations)
+    else:
+        spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    if package:
+        setattr(sys.modules[package], attribute, module)
+    lazy_modules.append(module)
+    return module
+
+def load_dependencies():
+    """
+    Finish importing everything imported by lazy_import. A lazily imported
+    module is not safe to load from two threads at once, so this is called
+    before starting any.
+    """
+    for module in lazy_modules:
+        # Any attribute will do.
+        getattr(module, '__file__', None)
+
+# The modules imported by lazy_import.
+lazy_modules = []
+
+class LazyStatsd(object):
+    """
+    Stands in for the statsd module, which is only imported, and set up with
+    settings, when one of its attributes is first used.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.module = None
+
+    def __getattr__(self, name):
+        if self.module is None:
+            import statsd
+            statsd.init_statsd(self.settings)
+            self.module = statsd
+        return getattr(self.module, name)
+
+# These take a good fraction of a second to import between them, which a run
+# which gets no further than checking its arguments, or finding that its
+# prediction is already running, need not spend.
+json = lazy_import('simplejson')
+requests = lazy_import('requests')
+numpy = lazy_import('numpy')
+predictor = lazy_import('predictor')
+statsd = LazyStatsd({'STATSD_BUCKET_PREFIX': 'habhub.predictor'})
+lazy_modules.append(statsd)
+
 # determine OS: darwin = Mac, other forms of win = Windows
 OS_IS_WINDOWS = False
 if 'win' in sys.platform.lower():
@@ -45,31 +125,12 @@ else:
     # probably Linux or Mac
     pred_binary = './pred_src/pred_StationKeep'
 
-statsd.init_statsd({'STATSD_BUCKET_PREFIX': 'habhub.predictor'})
-
 # We use Pydap from http://pydap.org/.
-import pydap.exceptions, pydap.client, pydap.lib
-pydap.lib.CACHE = "/tmp/pydap-cache/"
-
-# horrid, horrid monkey patching to force
-# otherwise broken caching from dods server
-# this is really, really hacky
-# 
-# import pydap.util.http
-# def fresh(response_headers, request_headers):
-#     cc = pydap.util.http.httplib2._parse_cache_control(response_headers)
-#     if cc.has_key('no-cache'):
-#         return 'STALE'
-#     return 'FRESH'
-# pydap.util.http.httplib2._entry_disposition = fresh
-
-import httplib2
-def fresh(response_headers, request_headers):
-    cc = httplib2._parse_cache_control(response_headers)
-    if cc.has_key('no-cache'):
-        return 'STALE'
-    return 'FRESH'
-httplib2._entry_disposition = fresh
+for module_name in ('pydap.exceptions', 'pydap.client', 'pydap.lib', 'pydap.model',
+                    'pydap.net', 'pydap.handlers.dap', 'pydap.parsers.das',
+                    'pydap.parsers.dds'):
+    lazy_import(module_name)
+pydap = sys.modules['pydap']
 
 # Output logger format
 log = logging.getLogger('main')
@@ -78,52 +139,356 @@ console = logging.StreamHandler()
 console.setFormatter(log_formatter)
 log.addHandler(console)
 
-progress_f = ''
-progress = {
+# The GFS variables written to each wind file, in wind file component order.
+WIND_VARIABLES = ('hgtprs', 'ugrdprs', 'vgrdprs', 'tmpprs', 'vvelprs')
+
+# Written wind files are kept here between runs, one directory per GFS cycle
+# and one below that per download window, so that later runs against the same
+# cycle and window can skip the download entirely.
+GFS_CACHE_DIR = os.path.join(ROOT_DIR, 'gfs', 'cache')
+
+# Cache entries used more recently than this are never evicted, since a
+# predictor run may still be reading them.
+GFS_CACHE_MIN_AGE = 15 * 60
+
+# The DAP responses received from NOMADS are kept here, compressed, in one
+# directory per GFS cycle, so that nothing need be downloaded twice. The least
+# recently used responses are evicted to keep the cache under
+# --response-cache-size, and a cycle's responses are dropped altogether once
+# it is older than GFS_RESPONSE_CACHE_MAX_CYCLE_AGE seconds, by when
+# possible_urls no longer offers it. If None, responses are not kept.
+GFS_RESPONSE_CACHE_DIR = os.path.join(ROOT_DIR, 'gfs', 'responses')
+GFS_RESPONSE_CACHE_MAX_CYCLE_AGE = 8 * 24 * 60 * 60
+
+# What was learnt about each candidate dataset (whether it exists, the times it
+# covers, its DDS and DAS and its coordinate values) is remembered here so that
+# later runs need not ask NOMADS again. A cycle which has not been published
+# yet is asked about again after GFS_DISCOVERY_MISSING_TTL seconds; a published
+# cycle does not change, so its entry is only refreshed once a day.
+GFS_DISCOVERY_DIR = os.path.join(ROOT_DIR, 'gfs', 'discovery')
+GFS_DISCOVERY_MISSING_TTL = 10 * 60
+GFS_DISCOVERY_AVAILABLE_TTL = 24 * 60 * 60
+
+# When only the pressure levels up to some altitude are downloaded, levels
+# are taken up to this many metres above it, and then one more.
+PRESSURE_LEVEL_MARGIN = 2000
+
+# The highest the station keeping predictor's balloon is expected to fly, in
+# metres, used to choose the pressure levels when the scenario gives no
+# max-altitude. The balloon is fixed in altitude_StationKeep.cc and bursts at
+# around 33.5km, whatever burst altitude the scenario asks for, and then
+# floats there until the winds run out. It climbs at about 5.5m/s; the
+# slowest rate it is taken to climb at when timing the flight is
+# STATION_KEEP_ASCENT_RATE.
+STATION_KEEP_CEILING = 38000
+STATION_KEEP_ASCENT_RATE = 5.0
+
+# Hours of winds downloaded before and after the launch when the time window
+# cannot be worked out from the scenario, which also gives the length of a
+# flight whose scenario does not say.
+DEFAULT_PAST = 3
+DEFAULT_FUTURE = 9
+
+# Seconds added to the estimated length of a flight when working out how much
+# wind data it needs, and how many times the download may be extended when
+# the predictor runs off the end of it anyway and the user did not choose
+# how long the flight should be.
+FLIGHT_TIME_MARGIN = 60 * 60
+WIND_WINDOW_EXTENSIONS = 3
+
+# A GFS request which fails with a server or network error is retried after
+# FETCH_RETRY_DELAY seconds, and after twice as long again each time it fails
+# after that, up to --fetch-retries times.
+FETCH_RETRY_DELAY = 2
+
+# Coordinate variables whose values are remembered along with each dataset.
+COORDINATE_VARIABLES = ('time', 'lev', 'lat', 'lon')
+
+# Each prediction directory holds a job registry entry recording whether, and
+# by which process, the prediction is being run. See claim_job.
+JOB_LOCK_FILE = 'job.lock'
+
+# How often, in seconds, the worker daemon looks for newly queued predictions.
+DAEMON_POLL_INTERVAL = 0.5
+
+# Predictions run by the worker daemon are given up after this many seconds,
+# as a standalone run is by --alarm; see start_deadline.
+JOB_TIMEOUT = 10 * 60
+
+# With --in-process, the wind files of up to this many GFS cache entries are
+# kept loaded into the predictor library between runs; see
+# in_process_wind_cache.
+IN_PROCESS_WIND_CACHES = 4
+
+# Binary wind file header; see pred_src/wind/wind_file_binary.h.
+WIND_FILE_BINARY_MAGIC = b'CUSFWIND'
+WIND_FILE_BINARY_VERSION = 1
+WIND_FILE_BINARY_HEADER = struct.Struct('<8sIIIIffffq')
+
+# The progress of each prediction is kept per thread, since the worker daemon
+# runs several predictions at once.
+job = threading.local()
+PROGRESS_DEFAULTS = {
     'run_time': '',
     'gfs_percent': 0,
     'gfs_timeremaining': '',
     'gfs_complete': False,
     'gfs_timestamp': '',
     'pred_running': False,
+    'pred_percent': 0,
     'pred_complete': False,
     'warnings': False,
+    'ensemble_members': 0,
+    'ensemble_complete': 0,
     'pred_output': [],
     'error': '',
     }
 
+# Updates to only these progress keys may be held back; see open_progress.
+PROGRESS_COALESCED_KEYS = ('gfs_percent', 'gfs_timeremaining', 'pred_percent',
+                           'ensemble_complete')
+
+# Standard deviations of the random changes made to each ensemble member's
+# scenario: seconds for the launch time, degrees for the launch latitude and
+# longitude, and metres for the launch altitude. These, and the wind error,
+# are all the station keeping predictor reads from the scenario; it works out
+# the ascent, burst and descent for itself.
+ENSEMBLE_SPREAD = {
+    'launch-time': 10 * 60,
+    'latitude': 0.01,
+    'longitude': 0.01,
+    'altitude': 50,
+    }
+
+# The least RMS wind error, in m/s, an ensemble member is run with. The
+# predictor adds random errors of this size to the winds at every step, so
+# members launched together still fly apart.
+ENSEMBLE_WIND_ERROR = 2.0
+
+# The ensemble landing density is counted on a grid of this many cells in
+# each of latitude and longitude, spanning the landings.
+ENSEMBLE_DENSITY_BINS = 20
+
+# The most points published in the partial flight path while the predictor
+# runs; see stream_flight_path.
+PARTIAL_TRACK_POINTS = 500
+
+# The simplified flight path in flight_path_summary.json keeps within this
+# many kilometres of the full one; see simplify_track.
+SIMPLIFIED_TRACK_TOLERANCE = 0.05
+
+def open_progress(filename, min_interval=0):
+    """
+    Start a new progress.json file for the prediction being run by this
+    thread.
+
+    Updates which only move the download progress on are written at most
+    once every min_interval seconds; any other update, such as the download
+    completing or the predictor starting, is written straight away along
+    with anything held back.
+    """
+    job.progress = dict(PROGRESS_DEFAULTS)
+    job.progress_filename = filename
+    job.progress_interval = min_interval
+    job.progress_written = 0
+    job.progress_pending = False
+    write_progress()
+
+def close_progress():
+    if progress_open() and job.progress_pending:
+        flush_progress()
+    job.progress_filename = None
+
+def progress_open():
+    """
+    Return whether this thread has a progress.json file open.
+    """
+    return bool(getattr(job, 'progress_filename', None))
+
 def update_progress(**kwargs):
-    global progress_f
-    global progress
+    if not progress_open():
+        return
     for arg in kwargs:
-        progress[arg] = kwargs[arg]
+        job.progress[arg] = kwargs[arg]
+
+    if set(kwargs) <= set(PROGRESS_COALESCED_KEYS) and \
+            timelib.time() - job.progress_written < job.progress_interval:
+        job.progress_pending = True
+        return
+    flush_progress()
+
+def flush_progress():
     try:
-        progress_f.truncate(0)
-        progress_f.seek(0)
-        progress_f.write(json.dumps(progress))
-        progress_f.flush()
-        os.fsync(progress_f.fileno())
-    except IOError:
+        write_progress()
+    except (IOError, OSError):
         global log
         log.error('Could not update progress file')
 
-@statsd.StatsdTimer.wrap('time')
-def main():
+def write_progress():
     """
-    The main program routine.
+    Replace progress.json with the current progress. The new contents are
+    written to a temporary file which is then renamed over the old one, so
+    the browser polling it never sees a partly written file.
+    """
+    replace_file(job.progress_filename, json.dumps(job.progress))
+    job.progress_written = timelib.time()
+    job.progress_pending = False
+
+def start_timings():
+    """
+    Start collecting the timings of the prediction being run by this thread.
+    """
+    job.timings = []
+
+def job_timings():
+    """
+    Return the list in which the timings of the prediction being run by this
+    thread are collected, for passing on to worker threads, or None.
+    """
+    return getattr(job, 'timings', None)
+
+class JobTimeout(Exception):
+    pass
+
+def start_deadline(seconds):
+    """
+    Give the prediction being run by this thread seconds seconds to finish,
+    or no limit if seconds is None or 0. Past its deadline, anything which
+    checks it with time_left raises JobTimeout.
+    """
+    job.deadline = timelib.time() + seconds if seconds else None
+
+def job_deadline():
+    """
+    Return the POSIX time by which the prediction being run by this thread
+    must finish, for passing on to worker threads, or None.
+    """
+    return getattr(job, 'deadline', None)
+
+def time_left(deadline):
+    """
+    Return how many seconds are left until deadline, as job_deadline returns
+    it, or None if there is no deadline. Raises JobTimeout if it has passed.
+    """
+    if deadline is None:
+        return None
+    left = deadline - timelib.time()
+    if left <= 0:
+        raise JobTimeout('The prediction ran past its deadline.')
+    return left
+
+def result_by(future, deadline):
+    """
+    Return the result of the concurrent.futures.Future future, raising
+    JobTimeout if it is not ready by deadline.
+    """
+    try:
+        return future.result(timeout=time_left(deadline))
+    except concurrent.futures.TimeoutError:
+        raise JobTimeout('The prediction ran past its deadline.')
+
+@contextlib.contextmanager
+def timed(phase, timings=None, **details):
+    """
+    Time the body of the with statement as phase, sending the time to statsd
+    and adding a record of it to timings, which defaults to this thread's
+    job_timings().
+
+    The record is a dict holding phase, details and the time taken in
+    seconds, and is given to the body to add to; a 'bytes' entry added there
+    is also counted in statsd as phase_bytes.
+    """
+    if timings is None:
+        timings = job_timings()
+    timing = dict(details, phase=phase)
+    start = timelib.time()
+    try:
+        yield timing
+    finally:
+        seconds = timelib.time() - start
+        timing['seconds'] = round(seconds, 4)
+        statsd.timing(phase, int(seconds * 1000))
+        if 'bytes' in timing:
+            statsd.increment(phase + '_bytes', timing['bytes'])
+        if timings is not None:
+            timings.append(timing)
+
+def write_timings(uuid_path):
+    """
+    Write the timings collected for the prediction being run by this thread
+    to timings.json in uuid_path: every record, in the order they finished,
+    and the count, total time and total bytes for each phase.
+    """
+    timings = list(job_timings() or [])
+    totals = {}
+    for timing in timings:
+        total = totals.setdefault(timing['phase'],
+                                  {'count': 0, 'seconds': 0, 'bytes': 0})
+        total['count'] += 1
+        total['seconds'] = round(total['seconds'] + timing['seconds'], 4)
+        total['bytes'] += timing.get('bytes', 0)
+
+    try:
+        replace_file(os.path.join(uuid_path, 'timings.json'),
+                     json.dumps({'totals': totals, 'phases': timings}))
+    except (IOError, OSError) as e:
+        log.error('Could not write timings: %s' % e)
+
+def replace_file(filename, contents):
     """
+    Atomically replace filename, which the web front end may be reading, with
+    a file holding contents, a string or bytes.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                     prefix='.' + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(contents, bytes) else 'w') as f:
+            f.write(contents)
+        os.chmod(temp_path, 0o664)
+        os.replace(temp_path, filename)
+    except:
+        os.remove(temp_path)
+        raise
 
-    statsd.increment('run')
+def option_parser():
+    """
+    Return the parser for our command line options.
+    """
 
-    # Set up our command line options
-    parser = optparse.OptionParser()
+    parser = optparse.OptionParser(
+        usage='%prog [options] uuid\n       %prog [options] --daemon\n       %prog [options] --prewarm')
     parser.add_option('-d', '--cd', dest='directory',
         help='change to, and run in, directory DIR',
         metavar='DIR')
     parser.add_option('--fork', dest='fork', action="store_true",
             help='detach the process and run in the background')
     parser.add_option('--alarm', dest='alarm', action="store_true",
-            help='setup an alarm for 10 minutes time to prevent hung processes')
+            help='setup an alarm for 10 minutes time to prevent hung processes (ignored with --daemon)')
+    parser.add_option('--daemon', dest='daemon', action="store_true",
+            help='stay resident, running the predictions whose UUIDs are queued in the queue directory')
+    parser.add_option('--queue', dest='queue_path',
+            help='with --daemon, directory in which prediction UUIDs are queued [default: %default]',
+            default='./predict/queue/', metavar='PATH')
+    parser.add_option('--workers', dest='workers',
+            help='with --daemon, run at most N predictions at once [default: %default]',
+            metavar='N', type='int', default=4)
+    parser.add_option('--job-timeout', dest='job_timeout',
+            help='with --daemon, give up any prediction still running after SECONDS seconds, 0 for no limit [default: %default]',
+            metavar='SECONDS', type='float', default=JOB_TIMEOUT)
+    parser.add_option('--prewarm', dest='prewarm', action="store_true",
+            help='download the newest GFS cycle\'s winds around each launch site into the GFS cache, then exit; with --daemon, keep doing so in the background')
+    parser.add_option('--sites', dest='sites_path',
+            help='with --prewarm, file listing the launch sites [default: %default]',
+            default='./predict/sites.json', metavar='FILE')
+    parser.add_option('--prewarm-interval', dest='prewarm_interval',
+            help='with --daemon --prewarm, look for a new GFS cycle every SECONDS seconds [default: %default]',
+            metavar='SECONDS', type='float', default=300)
+    parser.add_option('--prewarm-workers', dest='prewarm_workers',
+            help='with --prewarm, download the winds for at most N sites at once [default: %default]',
+            metavar='N', type='int', default=2)
+    parser.add_option('--prewarm-bandwidth', dest='prewarm_bandwidth',
+            help='with --prewarm, download at most an average of KB kilobytes a second, 0 for no limit [default: %default]',
+            metavar='KB', type='float', default=0)
     parser.add_option('--redirect', dest='redirect', default='/dev/null',
             help='if forking, file to send stdout/stderr to', metavar='FILE')
     parser.add_option('-t', '--timestamp', dest='timestamp',
@@ -133,18 +498,55 @@ def main():
     parser.add_option('-v', '--verbose', action='count', dest='verbose',
         help='be verbose. The more times this is specified the more verbose.', default=False)
     parser.add_option('-p', '--past', dest='past',
-        help='window of time to save data is at most HOURS hours in past [default: %default]',
+        help='window of time to save data is at most HOURS hours in past [default: worked out from the scenario]',
         metavar='HOURS',
-        type='int', default=3)
+        type='int')
     parser.add_option('-f', '--future', dest='future',
-        help='window of time to save data is at most HOURS hours in future [default: %default]',
+        help='window of time to save data is at least HOURS hours in future [default: worked out from the scenario]',
         metavar='HOURS',
-        type='int', default=9)
+        type='int')
     parser.add_option('--hd', dest='hd', action="store_true",
-            help='use higher definition GFS data (default: no)')
+            help='use higher definition GFS data; with --prewarm, warm it as well as the standard data (default: no)')
+    parser.add_option('--text-wind', dest='text_wind', action="store_true",
+            help='write wind files in the old text format rather than binary (default: no)')
+    parser.add_option('--discovery-workers', dest='discovery_workers',
+            help='probe at most N candidate GFS datasets at once [default: %default]',
+            metavar='N', type='int', default=8)
+    parser.add_option('--fetch-workers', dest='fetch_workers',
+            help='download at most N GFS slices at once [default: %default]',
+            metavar='N', type='int', default=5)
+    parser.add_option('--fetch-time-chunk', dest='fetch_time_chunk',
+            help='split each GFS variable into requests of at most STEPS time steps, 0 for no splitting [default: %default]',
+            metavar='STEPS', type='int', default=4)
+    parser.add_option('--fetch-retries', dest='fetch_retries',
+            help='retry a GFS request which fails with a server or network error at most N times [default: %default]',
+            metavar='N', type='int', default=4)
+    parser.add_option('--fetch-memory', dest='fetch_memory',
+            help='hold roughly at most MB megabytes of downloaded GFS data in memory at once, 0 for no limit [default: %default]',
+            metavar='MB', type='int', default=256)
+    parser.add_option('--max-altitude', dest='max_altitude',
+            help='download only the GFS pressure levels needed up to METRES metres, 0 for all of them [default: the max-altitude in the scenario\'s [predictor] section, or %i]' % STATION_KEEP_CEILING,
+            metavar='METRES', type='float')
+    parser.add_option('--gfs-cache-size', dest='gfs_cache_size',
+            help='keep at most MB megabytes of wind files in the GFS cache [default: %default]',
+            metavar='MB', type='int', default=2048)
+    parser.add_option('--response-cache-size', dest='response_cache_size',
+            help='keep at most MB megabytes of compressed DAP responses, 0 to keep none [default: %default]',
+            metavar='MB', type='int', default=1024)
     parser.add_option('--preds', dest='preds_path',
             help='path that contains uuid folders for predictions [default: %default]',
             default='./predict/preds/', metavar='PATH')
+    parser.add_option('--ensemble', dest='ensemble',
+            help='also run N randomly perturbed copies of the scenario and summarise their landings [default: %default]',
+            metavar='N', type='int', default=0)
+    parser.add_option('--ensemble-workers', dest='ensemble_workers',
+            help='run at most N ensemble members at once [default: number of CPUs]',
+            metavar='N', type='int', default=os.cpu_count() or 1)
+    parser.add_option('--in-process', dest='in_process', action="store_true",
+            help='run ensemble members in this process with the predictor library, if it has been built, rather than starting the predictor for each')
+    parser.add_option('--progress-interval', dest='progress_interval',
+            help='write download progress to progress.json at most once every SECONDS seconds [default: %default]',
+            metavar='SECONDS', type='float', default=1.0)
 #    parser.add_option('--preds', dest='preds_path',
 #            help='path that contains uuid folders for predictions [default: %default]',
 #            default='./preds/', metavar='PATH')
@@ -181,10 +583,21 @@ def main():
         #type='int', default=1)
     #parser.add_option_group(group)
 
-    (options, args) = parser.parse_args()
+    return parser
+
+def main():
+    """
+    The main program routine.
+    """
+
+    (options, args) = option_parser().parse_args()
 
     # Check we got a UUID in the arguments
-    if len(args) != 1:
+    if options.daemon or options.prewarm:
+        if args:
+            log.error('No positional arguments should be supplied with --daemon or --prewarm.')
+            sys.exit(1)
+    elif len(args) != 1:
         log.error('Exactly one positional argument should be supplied (uuid).')
         statsd.increment('error')
         sys.exit(1)
@@ -192,39 +605,115 @@ def main():
     if options.directory:
         os.chdir(options.directory)
 
+    if options.response_cache_size <= 0:
+        global GFS_RESPONSE_CACHE_DIR
+        GFS_RESPONSE_CACHE_DIR = None
+
     if options.fork:
         detach_process(options.redirect)
 
+    # How verbose are we being?
+    if options.verbose > 0:
+        log.setLevel(logging.INFO)
+    if options.verbose > 1:
+        log.setLevel(logging.DEBUG)
+    if options.verbose > 2:
+        logging.basicConfig(level=logging.INFO)
+    if options.verbose > 3:
+        logging.basicConfig(level=logging.DEBUG)
+
+    # The daemon and prewarming go on to use everything from several threads
+    # at once, which the lazy imports are not safe against.
+    if options.daemon or options.prewarm:
+        load_dependencies()
+
+    if options.daemon:
+        run_daemon(options)
+        return
+
+    if options.prewarm:
+        prewarm(options)
+        return
+
+    check_options(options)
+
     if options.alarm:
         setup_alarm()
 
-    uuid = args[0]
-    uuid_path = options.preds_path + "/" + uuid + "/"
+    run_prediction(args[0], options)
+
+def check_options(options):
+    """
+    Check the launch site and window sizes in options, exiting if they are
+    not usable. This is done before the prediction is claimed or anything
+    slow is imported.
+    """
 
-    # Check we're not already running with this UUID
-    for line in os.popen('ps xa'):
-        process = " ".join(line.split()[4:])
-        if process.find(uuid) > 0:
-            pid = int(line.split()[0])
-            if pid != os.getpid():
-                statsd.increment('duplicate')
-                log.error('A process is already running for this UUID, quitting.')
-                sys.exit(1)
+    # Check the latitude is in the right range.
+    if (options.lat < -90) | (options.lat > 90):
+        log.error('Latitude %s is outside of the range (-90,90).' % options.lat)
+        statsd.increment('error')
+        sys.exit(1)
 
-    # Make the UUID directory if non existant
-    if not os.path.exists(uuid_path):
-        os.mkdir(uuid_path, 0o770)
+    # Check the delta sizes are valid.
+    if (options.latdelta <= 0.5) | (options.londelta <= 0.5):
+        log.error('Latitiude and longitude deltas must be at least 0.5 degrees.')
+        statsd.increment('error')
+        sys.exit(1)
+
+    if options.londelta > 180:
+        log.error('Longitude window sizes greater than 180 degrees are meaningless.')
+        statsd.increment('error')
+        sys.exit(1)
+
+def run_prediction(uuid, options):
+    """
+    Download the winds for and run the prediction with the given UUID,
+    reporting progress in its progress.json.
+    """
+
+    with statsd.StatsdTimer('time'):
+        statsd.increment('run')
+
+        uuid_path = options.preds_path + "/" + uuid + "/"
+
+        # Make the UUID directory if non existant
+        if not os.path.exists(uuid_path):
+            os.mkdir(uuid_path, 0o770)
+
+        # Check we're not already running with this UUID
+        if not claim_job(uuid_path):
+            statsd.increment('duplicate')
+            log.error('A process is already running for this UUID, quitting.')
+            sys.exit(1)
+
+        state = 'error'
+        start_timings()
+        try:
+            with timed('job'):
+                predict_job(uuid_path, options)
+            state = 'done'
+        finally:
+            write_timings(uuid_path)
+            finish_job(uuid_path, state)
+
+def predict_job(uuid_path, options):
+    """
+    Download the winds for and run the prediction in uuid_path, which has
+    been claimed by claim_job.
+    """
+
+    # Before any thread is started; see load_dependencies.
+    load_dependencies()
 
     # Open the progress.json file for writing, creating it and closing again to flush
-    global progress_f
-    global progress
     try:
-        progress_f = open(uuid_path+"progress.json", "w+")
+        open_progress(uuid_path+"progress.json", options.progress_interval)
         update_progress(
             gfs_percent=0,
             gfs_timeremaining="Please wait...",
             run_time=str(int(timelib.time())))
-    except IOError:
+    except (IOError, OSError):
         log.error('Error opening progress.json file')
         statsd.increment('error')
         sys.exit(1)
@@ -235,37 +724,10 @@ def main():
         statsd.increment('error')
         sys.exit(1)
 
-    # Check the latitude is in the right range.
-    if (options.lat < -90) | (options.lat > 90):
-        log.error('Latitude %s is outside of the range (-90,90).')
-        statsd.increment('error')
-        sys.exit(1)
-
-    # Check the delta sizes are valid.
-    if (options.latdelta <= 0.5) | (options.londelta <= 0.5):
-        log.error('Latitiude and longitude deltas must be at least 0.5 degrees.')
-        statsd.increment('error')
-        sys.exit(1)
-
-    if options.londelta > 180:
-        log.error('Longitude window sizes greater than 180 degrees are meaningless.')
-        statsd.increment('error')
-        sys.exit(1)
-
     # We need to wrap the longitude into the right range.
     options.lon = canonicalise_longitude(options.lon)
 
-    # How verbose are we being?
-    if options.verbose > 0:
-        log.setLevel(logging.INFO)
-    if options.verbose > 1:
-        log.setLevel(logging.DEBUG)
-    if options.verbose > 2:
-        logging.basicConfig(level=logging.INFO)
-    if options.verbose > 3:
-        logging.basicConfig(level=logging.DEBUG)
-
-    log.debug('Using cache directory: %s' % pydap.lib.CACHE)
+    log.debug('Using cache directory: %s' % GFS_RESPONSE_CACHE_DIR)
 
     timestamp_to_find = options.timestamp
     time_to_find = datetime.datetime.utcfromtimestamp(timestamp_to_find)
@@ -274,7 +736,8 @@ def main():
 
     log.info('Looking for latest dataset which covers %s' % time_to_find.ctime())
     try:
-        dataset = dataset_for_time(time_to_find, options.hd)
+        dataset, dataset_url = dataset_for_time(time_to_find, options.hd, \
+                options.discovery_workers)
     except:
         log.error('Could not locate a dataset for the requested time.')
         statsd.increment('no_dataset')
@@ -308,18 +771,40 @@ def main():
             options.lat, options.latdelta, \
             options.lon, options.londelta)
 
-#    gfs_dir = "/var/www/cusf-standalone-predictor/gfs/"
-    gfs_dir = os.path.join(ROOT_DIR, "gfs")
-
-    gfs_dir = tempfile.mkdtemp(dir=gfs_dir)
-
-    gfs_filename = "gfs_%(time)_%(lat)_%(lon)_%(latdelta)_%(londelta).dat"
-    output_format = os.path.join(gfs_dir, gfs_filename)
-
-    write_file(output_format, dataset, \
-            window, \
-            time_to_find - datetime.timedelta(hours=options.past), \
-            time_to_find + datetime.timedelta(hours=options.future))
+    scenario = configparser.ConfigParser()
+    scenario.read(uuid_path + 'scenario.ini')
+
+    # Download just enough winds for the flight, unless told otherwise. The
+    # window is only extended below if its length was not chosen by the
+    # user, with -f or the time-delta from the web form.
+    extend_window = options.future is None and \
+        not scenario.has_option('predictor', 'time-delta')
+    past, future = scenario_time_window(scenario, options.ensemble)
+    if options.past is None:
+        options.past = past
+    if options.future is None:
+        options.future = future
+    log.info('Downloading winds for %s hours before and %s hours after the launch.' % \
+        (options.past, options.future))
+
+    mintime = time_to_find - datetime.timedelta(hours=options.past)
+    maxtime = time_to_find + datetime.timedelta(hours=options.future)
+
+    # The predictor works out for itself where the balloon bursts, so the
+    # scenario's burst altitude cannot be relied on to bound the flight; a
+    # max-altitude given explicitly is used if there is one, and otherwise
+    # the ceiling of the station keeping balloon.
+    if options.max_altitude is None:
+        options.max_altitude = scenario.getfloat('predictor', 'max-altitude',
+                                                 fallback=STATION_KEEP_CEILING)
+
+    # The predictor reads the wind files straight out of the cache entry for
+    # this cycle and window.
+    gfs_dir = fill_gfs_cache_entry(dataset, dataset_url, window, \
+            mintime, maxtime, options)
+
+    prune_gfs_cache(options.gfs_cache_size * 1024 * 1024, keep=gfs_dir)
+    prune_response_cache(options.response_cache_size * 1024 * 1024)
 
     #purge_cache()
     
@@ -330,14 +815,359 @@ def main():
     else:
         alarm_flags = []
 
-    command = [pred_binary, '-i', gfs_dir, '-vv', '-o', uuid_path+'flight_path.csv', uuid_path+'scenario.ini']
+    exit_code, pred_output, missing_times = run_predictor(uuid_path, gfs_dir, options)
+
+    # If the flight outlasted the winds downloaded, download more and run the
+    # predictor again rather than give up, as long as the dataset goes on.
+    extensions = 0
+    while extend_window and missing_times and extensions < WIND_WINDOW_EXTENSIONS:
+        last_time = select_times(dataset['hgtprs'], mintime, maxtime)[-1][1]
+        if min(missing_times) < last_time or last_time >= dataset_timestamps[-1]:
+            break
+        extensions += 1
+        options.future *= 2
+        maxtime = time_to_find + datetime.timedelta(hours=options.future)
+        log.info('The flight ran off the end of the winds; extending them to %s hours after the launch.' % \
+            options.future)
+        statsd.increment('wind_window_extended')
+        with timed('extend_window', future=options.future):
+            gfs_dir = fill_gfs_cache_entry(dataset, dataset_url, window, \
+                    mintime, maxtime, options)
+        exit_code, pred_output, missing_times = run_predictor(uuid_path, gfs_dir, options)
+
+    if options.ensemble > 0:
+        run_ensemble(uuid_path, gfs_dir, options)
+    
+    if exit_code == 1:
+        # Hard error from the predictor. Tell the javascript it completed, so that it will show the trace,
+        # but pop up a 'warnings' window with the error messages
+        update_progress(pred_running=False, pred_complete=True, warnings=True, pred_output=pred_output)
+        statsd.increment('success_serious_warnings')
+    elif pred_output:
+        # Soft error (altitude too low error, typically): pred_output being set forces the debug
+        # window open with the messages in
+        update_progress(pred_running=False, pred_complete=True, pred_output=pred_output)
+        statsd.increment('success_minor_warnings')
+    else:
+        log.info('The predictor pred.exe executable exit_code = %s' % exit_code )
+        assert exit_code == 0
+        update_progress(pred_running=False, pred_complete=True)
+        statsd.increment('success')  
+
+    # Mark the cache entry as used again now that the predictor is done.
+    os.utime(gfs_dir)
+
+def run_predictor(uuid_path, gfs_dir, options):
+    """
+    Run the predictor on the scenario in uuid_path with the wind files in
+    gfs_dir, writing its flight path to flight_path.csv as it goes. Returns
+    its exit code, the messages to show the user and the POSIX timestamps
+    at which it found it had no wind data.
+    """
+
+    # With no -o the predictor writes the flight path to its stdout, which we
+    # copy into flight_path.csv as it arrives so that the track so far can be
+    # shown while it runs. Its messages come separately on stderr.
+    command = [pred_binary, '-i', gfs_dir, '-vv', uuid_path+'scenario.ini']
     log.info('The command is:')
     log.info(command)
-    pred_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    pred_output = []
+    with timed('predictor') as timing:
+        pred_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # Killing the predictor at the deadline closes its output, and so
+        # ends the reading below.
+        deadline = job_deadline()
+        killer = None
+        if deadline is not None:
+            killer = threading.Timer(time_left(deadline), pred_process.kill)
+            killer.start()
+
+        pred_output = []
+        missing_times = []
+
+        messages = threading.Thread(target=scan_predictor_messages,
+                                    args=(pred_process.stderr, pred_output, options,
+                                          missing_times))
+        messages.start()
+        stream_flight_path(pred_process.stdout, uuid_path, options.timestamp,
+                           options.timestamp + options.future * 3600,
+                           options.progress_interval)
+        messages.join()
+
+        exit_code = pred_process.wait()
+        timing['exit_code'] = exit_code
+        if killer is not None:
+            killer.cancel()
+            time_left(deadline)
+
+    return exit_code, pred_output, missing_times
+
+def scenario_time_window(scenario, ensemble=0):
+    """
+    Return how many hours of winds, before and after the launch, the flight
+    described by the ConfigParser scenario needs. The station keeping
+    balloon floats until the winds run out, so the flight lasts as long as
+    the time-delta hours in the scenario's predictor section, which the web
+    front end writes from the form, or DEFAULT_FUTURE hours if there are
+    none. It is never taken to be shorter than the climb from the launch
+    altitude to STATION_KEEP_CEILING, plus FLIGHT_TIME_MARGIN. Ensemble
+    members, whose launch times vary, are allowed for if ensemble is
+    non-zero. Returns (DEFAULT_PAST, DEFAULT_FUTURE) if the scenario cannot
+    be read.
+    """
+    try:
+        launch_altitude = scenario.getfloat('launch-site', 'altitude', fallback=0)
+        hours = scenario.getfloat('predictor', 'time-delta', fallback=DEFAULT_FUTURE)
+    except (ValueError, TypeError, configparser.Error):
+        return DEFAULT_PAST, DEFAULT_FUTURE
+
+    climb = max(0, STATION_KEEP_CEILING - launch_altitude) / STATION_KEEP_ASCENT_RATE
+    before = 0
+    duration = max(hours * 3600, climb + FLIGHT_TIME_MARGIN)
+    if ensemble > 0:
+        before = 4 * ENSEMBLE_SPREAD['launch-time']
+        duration += before
+
+    return (int(math.ceil(before / 3600.0)),
+            int(math.ceil(duration / 3600.0)))
+
+def run_ensemble(uuid_path, gfs_dir, options):
+    """
+    Run options.ensemble perturbed copies of the scenario in uuid_path against
+    the wind data already in gfs_dir, options.ensemble_workers at a time, and
+    summarise where they land in ensemble.json.
+
+    Each member gets its own directory below ensemble/ holding its
+    scenario.ini and flight_path.csv. The number of members finished so far
+    is reported as ensemble_complete in progress.json.
+    """
+
+    scenario = configparser.ConfigParser()
+    with open(os.path.join(uuid_path, 'scenario.ini')) as f:
+        scenario_text = f.read()
+    scenario.read_string(scenario_text)
+
+    # The same scenario always gives the same ensemble.
+    rng = numpy.random.RandomState(zlib.crc32(scenario_text.encode('utf-8')))
+
+    member_paths = []
+    for member in range(options.ensemble):
+        member_path = os.path.join(uuid_path, 'ensemble', 'member%03i' % member)
+        if not os.path.isdir(member_path):
+            os.makedirs(member_path, 0o770)
+        with open(os.path.join(member_path, 'scenario.ini'), 'w') as f:
+            perturb_scenario(scenario, rng).write(f)
+        member_paths.append(member_path)
+
+    update_progress(ensemble_members=options.ensemble, ensemble_complete=0)
+    log.info('Running an ensemble of %i members.' % options.ensemble)
+
+    # The members all use the same winds, which the predictor library need
+    # only read once. It runs one member at a time, but is still much
+    # quicker than starting the predictor for each.
+    wind_cache = None
+    if options.in_process:
+        if predictor.available():
+            wind_cache = in_process_wind_cache(gfs_dir)
+        else:
+            log.warning('The predictor library has not been built; '
+                        'starting the predictor for each ensemble member.')
+
+    landings = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, options.ensemble_workers)) as pool:
+        members = [pool.submit(run_ensemble_member, member_path, gfs_dir,
+                               job_timings(), wind_cache, job_deadline())
+                   for member_path in member_paths]
+        for complete, member in enumerate(
+                concurrent.futures.as_completed(members), 1):
+            landing = member.result()
+            if landing is not None:
+                landings.append(landing)
+            update_progress(ensemble_complete=complete)
+
+    summary = summarise_landings(landings)
+    summary['members'] = options.ensemble
+    replace_file(os.path.join(uuid_path, 'ensemble.json'), json.dumps(summary))
+    statsd.increment('ensemble')
+
+def perturb_scenario(scenario, rng):
+    """
+    Return a copy of the ConfigParser scenario with its launch time and
+    launch site drawn at random about their original values, with the spreads
+    given in ENSEMBLE_SPREAD, and a wind error of at least ENSEMBLE_WIND_ERROR.
+    """
+
+    member = configparser.ConfigParser()
+    member.read_dict(scenario)
+
+    launch_time = scenario['launch-time']
+    timestamp = calendar.timegm((
+        launch_time.getint('year'), launch_time.getint('month'),
+        launch_time.getint('day'), launch_time.getint('hour'),
+        launch_time.getint('minute'), launch_time.getint('second')))
+    timestamp += int(round(rng.normal(0, ENSEMBLE_SPREAD['launch-time'])))
+    time = datetime.datetime.utcfromtimestamp(timestamp)
+    for key in ('year', 'month', 'day', 'hour', 'minute', 'second'):
+        member['launch-time'][key] = str(getattr(time, key))
+
+    launch_site = scenario['launch-site']
+    latitude = launch_site.getfloat('latitude')
+    latitude += rng.normal(0, ENSEMBLE_SPREAD['latitude'])
+    member['launch-site']['latitude'] = '%g' % min(90, max(-90, latitude))
+    longitude = launch_site.getfloat('longitude')
+    longitude += rng.normal(0, ENSEMBLE_SPREAD['longitude'])
+    member['launch-site']['longitude'] = '%g' % (longitude % 360)
+    altitude = launch_site.getfloat('altitude', fallback=0)
+    altitude += rng.normal(0, ENSEMBLE_SPREAD['altitude'])
+    member['launch-site']['altitude'] = '%g' % max(0, altitude)
+
+    wind_error = scenario.getfloat('atmosphere', 'wind-error', fallback=0)
+    if not member.has_section('atmosphere'):
+        member.add_section('atmosphere')
+    member['atmosphere']['wind-error'] = '%g' % max(wind_error, ENSEMBLE_WIND_ERROR)
+
+    return member
+
+def run_ensemble_member(member_path, gfs_dir, timings=None, wind_cache=None,
+                        deadline=None):
+    """
+    Run the predictor on the scenario in member_path and return where it
+    lands as [timestamp, latitude, longitude, altitude], or None if it
+    failed. The run is made in this process with wind_cache, the
+    predictor.WindCache for gfs_dir, if one is given. The run is recorded in
+    timings, as for timed. JobTimeout is raised if the run would go on past
+    deadline, as job_deadline returns it.
+    """
+
+    csv_filename = os.path.join(member_path, 'flight_path.csv')
+    scenario_filename = os.path.join(member_path, 'scenario.ini')
+    with timed('ensemble_member', timings,
+               member=os.path.basename(member_path)) as timing:
+        timeout = time_left(deadline)
+        if wind_cache is not None:
+            timing['in_process'] = True
+            scenario = configparser.ConfigParser()
+            scenario.read(scenario_filename)
+            ok, track = wind_cache.run(*scenario_launch(scenario))
+            with open(csv_filename, 'w') as f:
+                predictor.write_track(f, track)
+            exit_code = 0 if ok else 1
+        else:
+            command = [pred_binary, '-i', gfs_dir, '-o', csv_filename,
+                       scenario_filename]
+            try:
+                exit_code = subprocess.call(command, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                raise JobTimeout('The prediction ran past its deadline.')
+        timing['exit_code'] = exit_code
+    if exit_code != 0:
+        log.warning('Ensemble member in %s failed with exit code %s.' % \
+                (member_path, exit_code))
+        return None
+
+    landing = None
+    with open(csv_filename) as f:
+        for line in f:
+            fields = line.split(',', 4)
+            if len(fields) >= 4:
+                landing = fields
+    if landing is None:
+        return None
+    return [int(landing[0]), float(landing[1]), float(landing[2]),
+            float(landing[3])]
+
+def scenario_launch(scenario):
+    """
+    Return the launch latitude, longitude, altitude, POSIX time and RMS wind
+    error of the ConfigParser scenario, read as the predictor reads them: a
+    missing value is taken as 0, and an incomplete launch time as now.
+    """
+
+    def value(section, key):
+        try:
+            return scenario.getfloat(section, key, fallback=0.)
+        except ValueError:
+            return 0.
+
+    try:
+        launch_time = scenario['launch-time']
+        timestamp = calendar.timegm(tuple(launch_time.getint(key)
+            for key in ('year', 'month', 'day', 'hour', 'minute', 'second')))
+    except (KeyError, TypeError, ValueError):
+        timestamp = int(timelib.time())
+
+    return (value('launch-site', 'latitude'), value('launch-site', 'longitude'),
+            value('launch-site', 'altitude'), timestamp,
+            value('atmosphere', 'wind-error'))
+
+def in_process_wind_cache(gfs_dir):
+    """
+    Return a predictor.WindCache for the wind files in gfs_dir, reusing the
+    one from an earlier run in this process if the files are the same.
+    """
+
+    listing = tuple(sorted(os.listdir(gfs_dir)))
+    with in_process_wind_caches_lock:
+        entry = in_process_wind_caches.pop(gfs_dir, None)
+        if entry is None or entry[0] != listing:
+            entry = (listing, predictor.WindCache(gfs_dir))
+        in_process_wind_caches[gfs_dir] = entry
+        # Caches dropped here are freed once no run is using them.
+        while len(in_process_wind_caches) > IN_PROCESS_WIND_CACHES:
+            del in_process_wind_caches[next(iter(in_process_wind_caches))]
+        return entry[1]
+
+def summarise_landings(landings):
+    """
+    Summarise the ensemble landing points in landings: their mean, the radii
+    about it within which 50, 90 and 95 percent of them fall, and their
+    density on an ENSEMBLE_DENSITY_BINS square grid of latitude and
+    longitude.
+    """
+
+    summary = {'landed': len(landings), 'landings': landings}
+    if not landings:
+        return summary
+
+    points = numpy.array(landings, dtype=float)
+    lat = points[:, 1]
+    # Unwrap longitudes about the first landing so that an ensemble which
+    # straddles the antimeridian is not torn in two.
+    lon = points[0, 2] + (points[:, 2] - points[0, 2] + 180) % 360 - 180
+
+    mean_lat = lat.mean()
+    mean_lon = lon.mean()
+    km_per_degree = 2 * math.pi * 6371.009 / 360
+    distances = numpy.hypot((lat - mean_lat) * km_per_degree,
+        (lon - mean_lon) * km_per_degree * math.cos(math.radians(mean_lat)))
+
+    counts, lat_edges, lon_edges = numpy.histogram2d(lat, lon,
+        bins=ENSEMBLE_DENSITY_BINS)
+
+    summary.update({
+        'mean': [mean_lat, (mean_lon + 180) % 360 - 180],
+        'radius_km': dict((str(q), float(numpy.percentile(distances, q)))
+                          for q in (50, 90, 95)),
+        'density': {
+            'lat_edges': lat_edges.tolist(),
+            'lon_edges': [(edge + 180) % 360 - 180 for edge in lon_edges],
+            'counts': counts.astype(int).tolist(),
+            },
+        })
+    return summary
+
+def scan_predictor_messages(stream, pred_output, options, missing_times):
+    """
+    Pass the predictor's messages from stream through to our stdout,
+    collecting any warnings and errors to show to the user in pred_output
+    and the POSIX timestamps of any points it had no wind data for in
+    missing_times.
+    """
 
     while True:
-        line = pred_process.stdout.readline()
+        line = stream.readline()
         if line == b'':
             break
 
@@ -349,67 +1179,1031 @@ def main():
         # if "ERROR: Do not have wind data" in line:
         # more required Python 3 obfuscation ...
         if b'ERROR: Do not have wind data' in line:
-            pred_output = ["One of the latitude, longitude or time deltas ({0}, {1}, {2}) was too small."
+            # ... = (lat, lon, alt, timestamp).
+            try:
+                missing_times.append(int(line.rstrip().rstrip(b').').rsplit(b',', 1)[1]))
+            except (IndexError, ValueError):
+                pass
+            pred_output[:0] = ["One of the latitude, longitude or time deltas ({0}, {1}, {2}) was too small."
                            .format(options.latdelta, options.londelta, options.future),
                            "Please adjust the settings accordingly and re-run your prediction.",
-                           ""] + pred_output
+                           ""]
 
         # if ("WARN" in line or "ERROR" in line) and len(pred_output) < 10:
         # more required Python 3 obfuscation ...
         if (b'WARN' in line or b'ERROR' in line) and len(pred_output) < 10:
             pred_output.append(line.strip())
 
-    exit_code = pred_process.wait()
-    
+def stream_flight_path(stream, uuid_path, start_time, end_time, interval):
+    """
+    Copy the flight path CSV the predictor writes to stream into
+    flight_path.csv in uuid_path.
+
+    Every interval seconds while it does so, the track so far, thinned to at
+    most PARTIAL_TRACK_POINTS points, is published in flight_path_partial.json
+    and pred_percent in progress.json is set to how far through the window
+    from start_time to end_time (as POSIX timestamps) the flight has got.
+    Once it has finished, the compact forms of the whole flight path are
+    written by write_flight_path_summary.
+    """
+
+    partial_filename = os.path.join(uuid_path, 'flight_path_partial.json')
+    track = []
+    positions = array.array('d')
+    stride = 1
+    count = 0
+    published = timelib.time()
+
+    with open(os.path.join(uuid_path, 'flight_path.csv'), 'wb') as csv_file:
+        while True:
+            line = stream.readline()
+            if line == b'':
+                break
+            csv_file.write(line)
+
+            # timestamp, latitude, longitude, altitude, ...
+            try:
+                fields = line.split(b',', 4)
+                point = [int(fields[0]), float(fields[1]), float(fields[2]),
+                         float(fields[3])]
+            except (IndexError, ValueError):
+                continue
+            positions.extend(point)
+
+            # Keep every stride-th point, halving the points kept and
+            # doubling the stride whenever there get to be too many.
+            if count % stride == 0:
+                track.append(point)
+                if len(track) > PARTIAL_TRACK_POINTS:
+                    track = track[::2]
+                    stride *= 2
+            count += 1
+
+            if timelib.time() - published >= interval:
+                published = timelib.time()
+                replace_file(partial_filename,
+                             json.dumps({'complete': False,
+                                         'points': track_to(track, point)}))
+                percent = 100 * (point[0] - start_time) / max(1, end_time - start_time)
+                update_progress(pred_percent=int(min(99, max(0, percent))))
+
+    if track:
+        replace_file(partial_filename,
+                     json.dumps({'complete': True,
+                                 'points': track_to(track, point)}))
+        write_flight_path_summary(uuid_path,
+                                  numpy.frombuffer(positions).reshape(-1, 4))
+    update_progress(pred_percent=100)
+
+def track_to(track, point):
+    """
+    Return the thinned track, ending at the latest point.
+    """
+    if track[-1] is point:
+        return track
+    return track + [point]
+
+def write_flight_path_summary(uuid_path, track):
+    """
+    Write the compact forms of the flight path in uuid_path, which the map
+    fetches rather than the whole of flight_path.csv. track is a (position, 4)
+    array of POSIX timestamp, latitude, longitude and altitude.
+
+    flight_path_summary.json holds the launch, the burst (the highest point)
+    and the landing, and the track simplified to within
+    SIMPLIFIED_TRACK_TOLERANCE as points like those in
+    flight_path_partial.json. flight_path.geojson.gz is the whole track as
+    gzipped GeoJSON, with the same three events marked.
+    """
+
+    events = [('launch', 0), ('burst', int(track[:, 3].argmax())),
+              ('landing', len(track) - 1)]
+    keep = simplify_track(track[:, 1], track[:, 2], SIMPLIFIED_TRACK_TOLERANCE)
+    keep[events[1][1]] = True
+
+    def point(i):
+        return [int(track[i, 0])] + track[i, 1:].tolist()
+
+    summary = dict((name, point(i)) for name, i in events)
+    summary.update({
+        'positions': len(track),
+        'tolerance_km': SIMPLIFIED_TRACK_TOLERANCE,
+        'points': [point(i) for i in numpy.flatnonzero(keep)],
+        })
+    replace_file(os.path.join(uuid_path, 'flight_path_summary.json'),
+                 json.dumps(summary))
+
+    # GeoJSON positions are longitude, latitude and altitude.
+    coordinates = track[:, [2, 1, 3]]
+    coordinates[:, 0] = (coordinates[:, 0] + 180) % 360 - 180
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': coordinates.tolist()},
+        'properties': {'times': track[:, 0].astype(int).tolist()},
+        }]
+    for name, i in events:
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': coordinates[i].tolist()},
+            'properties': {'event': name, 'time': int(track[i, 0])},
+            })
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': features})
+    replace_file(os.path.join(uuid_path, 'flight_path.geojson.gz'),
+                 gzip.compress(geojson.encode('utf-8'), mtime=0))
+
+def simplify_track(lat, lon, tolerance):
+    """
+    Return which of the points of the track through lat and lon (arrays, in
+    degrees) the Douglas-Peucker algorithm keeps to stay within tolerance
+    kilometres of it, as a boolean array.
+    """
+
+    # Flatten the track onto a plane about its start, unwrapping longitudes
+    # so that a flight over the antimeridian is not torn in two.
+    km_per_degree = 2 * math.pi * 6371.009 / 360
+    x = (lon - lon[0] + 180) % 360 - 180
+    x *= km_per_degree * math.cos(math.radians(lat.mean()))
+    y = (lat - lat[0]) * km_per_degree
+
+    keep = numpy.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+    segments = [(0, len(x) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+
+        # The distance of each point between first and last from the segment
+        # joining them, not just the line through it, since a balloon keeping
+        # station doubles back on itself.
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        along = (px * dx + py * dy) / max(dx * dx + dy * dy, 1e-12)
+        along = numpy.clip(along, 0, 1)
+        distances = numpy.hypot(px - along * dx, py - along * dy)
+
+        furthest = int(distances.argmax())
+        if distances[furthest] > tolerance:
+            middle = first + 1 + furthest
+            keep[middle] = True
+            segments.append((first, middle))
+            segments.append((middle, last))
+    return keep
+
+def read_job(uuid_path):
+    """
+    Return the job registry entry for the prediction in uuid_path, a dict
+    with its 'state' ('running', 'done' or 'error'), the 'pid' of the process
+    running it and the POSIX time 'since' it entered that state, or None if
+    it has never been run.
+    """
+    return read_job_file(os.path.join(uuid_path, JOB_LOCK_FILE))
+
+def read_job_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def job_is_active(entry):
+    """
+    Return whether the job registry entry is for a prediction which is still
+    running, rather than one which finished or whose process died.
+    """
+    if entry is None or entry.get('state') != 'running':
+        return False
+
     if OS_IS_WINDOWS:
-        copy_path = os.path.join(ROOT_DIR, "predict")
+        # os.kill cannot be used to probe a process on Windows, but nothing
+        # outlives the alarm.
+        return timelib.time() - entry.get('since', 0) < 600
+
+    try:
+        os.kill(entry['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def write_job(uuid_path, state):
+    """
+    Write a job registry entry for this process to a temporary file in
+    uuid_path and return its name.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=uuid_path, prefix='.job')
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps({'state': state, 'pid': os.getpid(),
+                            'since': int(timelib.time())}))
+    os.chmod(temp_path, 0o664)
+    return temp_path
+
+def claim_job(uuid_path):
+    """
+    Atomically mark the prediction in uuid_path as being run by this process.
+    Return False, leaving it alone, if another process is already running it.
+
+    The entry is linked into place complete, so it is never seen half
+    written. An entry for a prediction which finished, or whose process
+    died, is moved aside before being replaced, so that of several processes
+    trying to take over the same stale entry only one succeeds.
+    """
+    path = os.path.join(uuid_path, JOB_LOCK_FILE)
+    temp_path = write_job(uuid_path, 'running')
+    try:
+        for attempt in range(3):
+            try:
+                os.link(temp_path, path)
+                return True
+            except FileExistsError:
+                pass
+
+            if job_is_active(read_job(uuid_path)):
+                return False
+
+            aside_path = '%s.%i.%i' % (path, os.getpid(), threading.get_ident())
+            try:
+                os.rename(path, aside_path)
+            except OSError:
+                continue
+            if job_is_active(read_job_file(aside_path)):
+                # Somebody else claimed it in the meantime; put it back.
+                try:
+                    os.link(aside_path, path)
+                except OSError:
+                    pass
+                os.remove(aside_path)
+                return False
+            os.remove(aside_path)
+        return False
+    finally:
+        os.remove(temp_path)
+
+def finish_job(uuid_path, state):
+    """
+    Record that this process has finished running the prediction in
+    uuid_path, with the final state 'done' or 'error'.
+    """
+    try:
+        os.replace(write_job(uuid_path, state),
+                   os.path.join(uuid_path, JOB_LOCK_FILE))
+    except (IOError, OSError) as e:
+        log.error('Could not update job registry in %s: %s' % (uuid_path, e))
+
+def run_daemon(options):
+    """
+    Stay resident, running the predictions queued in options.queue_path.
+
+    The web front end queues a prediction by creating an empty file named
+    after its UUID in the queue directory, once the scenario.ini for it is in
+    place. Up to options.workers predictions run at once, each in a thread of
+    this process, so the imports, HTTP session and discovery state are all
+    kept warm between predictions. Progress is reported in progress.json
+    exactly as for a standalone run.
+
+    A queued UUID is claimed by moving it into the working directory below
+    the queue, and removed from there once its prediction is done; anything
+    left there by a daemon which died is queued again on startup.
+
+    With options.prewarm the GFS cache is also kept warm for the launch
+    sites in the background; see prewarm.
+    """
+
+    queue_path = options.queue_path
+    working_path = os.path.join(queue_path, 'working')
+    if not os.path.isdir(working_path):
+        os.makedirs(working_path, 0o770)
+
+    for uuid in os.listdir(working_path):
+        os.replace(os.path.join(working_path, uuid),
+                   os.path.join(queue_path, uuid))
+
+    log.info('Running up to %i predictions at once from %s.' % \
+            (options.workers, queue_path))
+
+    if options.prewarm:
+        threading.Thread(target=prewarm_forever, args=(options,),
+                         daemon=True).start()
+
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, options.workers))
+    running = {}
+    while True:
+        for uuid, future in list(running.items()):
+            if future.done():
+                del running[uuid]
+                os.remove(os.path.join(working_path, uuid))
+
+        for uuid in queued_uuids(queue_path):
+            if uuid in running:
+                continue
+            if len(running) >= max(1, options.workers):
+                break
+            try:
+                os.replace(os.path.join(queue_path, uuid),
+                           os.path.join(working_path, uuid))
+            except OSError:
+                # Claimed by another daemon.
+                continue
+            log.info('Starting prediction %s.' % uuid)
+            running[uuid] = pool.submit(run_job, uuid, options)
+
+        timelib.sleep(DAEMON_POLL_INTERVAL)
+
+def queued_uuids(queue_path):
+    """
+    Return the UUIDs queued in queue_path, oldest first.
+
+    UUIDs are SHA1 hashes, so anything else in the queue directory, such as
+    a file the front end is still writing or the daemon's own working
+    directory, is left alone.
+    """
+    queued = []
+    for uuid in os.listdir(queue_path):
+        path = os.path.join(queue_path, uuid)
+        if len(uuid) != 40 or uuid.strip('0123456789abcdef') or \
+                not os.path.isfile(path):
+            continue
+        try:
+            queued.append((os.path.getmtime(path), uuid))
+        except OSError:
+            pass
+    queued.sort()
+    return [uuid for mtime, uuid in queued]
+
+def run_job(uuid, options):
+    """
+    Run the prediction with the given UUID for the worker daemon, reporting
+    any failure in its progress.json as a standalone run would. A prediction
+    still running after options.job_timeout seconds is given up, as --alarm
+    gives up a standalone run.
+    """
+
+    start_deadline(options.job_timeout)
+    try:
+        options = job_options(uuid, options)
+        check_options(options)
+        run_prediction(uuid, options)
+    except JobTimeout:
+        statsd.increment("job_timeout")
+        log.error("Prediction %s took longer than %g seconds; giving up." % \
+                (uuid, options.job_timeout))
+        update_progress(error="The prediction took longer than %g seconds and was stopped." % \
+                options.job_timeout)
+    except SystemExit as e:
+        log.debug("Exit: " + repr(e))
+        if e.code != 0:
+            update_progress(error="Unknown error exit")
+            statsd.increment("unknown_error_exit")
+    except Exception as e:
+        statsd.increment("uncaught_exception")
+        log.exception("Uncaught exception in prediction %s" % uuid)
+        info = traceback.format_exc()
+        update_progress(error="Unhandled exception: " + info)
+    finally:
+        start_deadline(None)
+        close_progress()
+        log.info('Finished prediction %s.' % uuid)
+
+def job_options(uuid, options):
+    """
+    Return a copy of the daemon's options with the settings which the web
+    front end would have passed on the command line of a standalone run
+    filled in from the prediction's scenario.ini.
+    """
+
+    scenario = configparser.ConfigParser()
+    scenario_filename = os.path.join(options.preds_path, uuid, 'scenario.ini')
+    if not scenario.read(scenario_filename):
+        raise IOError('Could not read %s' % scenario_filename)
+
+    launch_time = scenario['launch-time']
+    predictor_section = scenario['predictor']
+
+    options = copy.copy(options)
+    options.timestamp = calendar.timegm((
+        launch_time.getint('year'), launch_time.getint('month'),
+        launch_time.getint('day'), launch_time.getint('hour'),
+        launch_time.getint('minute'), launch_time.getint('second')))
+    for name, key in (('lat', 'latitude'), ('lon', 'longitude')):
+        setattr(options, name,
+                round_site_coordinate(scenario['launch-site'].getfloat(key)))
+    options.latdelta = predictor_section.getfloat('lat-delta')
+    options.londelta = predictor_section.getfloat('lon-delta')
+    options.hd = predictor_section.get('software') == 'gfs_hd'
+    options.ensemble = predictor_section.getint('ensemble', fallback=options.ensemble)
+    return options
+
+
+
+def round_site_coordinate(value):
+    """
+    Round a launch site latitude or longitude to the centre of its download
+    window as the web front end does: to whole degrees, half away from zero
+    as PHP's number_format does.
+    """
+    return math.copysign(math.floor(abs(value) + 0.5), value)
+
+def prewarm_forever(options):
+    """
+    Prewarm the GFS cache for the launch sites every options.prewarm_interval
+    seconds, picking up each new GFS cycle as it is published.
+    """
+    while True:
+        try:
+            prewarm(options)
+        except Exception:
+            log.exception('Prewarming the GFS cache failed.')
+            statsd.increment('prewarm_error')
+        timelib.sleep(options.prewarm_interval)
+
+def prewarm(options):
+    """
+    Download the winds from the newest GFS cycle for the window around each
+    launch site in options.sites_path into the GFS cache, so that
+    predictions from those sites find them there and skip the download.
+
+    The windows are centred and sized as the web front end's would be, given
+    the same --latdelta, --londelta, --past and --future. Time steps already
+    in the cache are not downloaded again, so this is cheap to repeat until
+    a new cycle appears. With --hd the higher definition data is warmed as
+    well as the standard data.
+    """
+
+    with open(options.sites_path) as f:
+        sites = json.load(f)
+
+    if options.prewarm_bandwidth > 0:
+        throttle = BandwidthLimit(options.prewarm_bandwidth * 1024)
     else:
-        copy_path = '/tmp'            
-            
-    if exit_code == 1:
-        # Hard error from the predictor. Tell the javascript it completed, so that it will show the trace,
-        # but pop up a 'warnings' window with the error messages
-        update_progress(pred_running=False, pred_complete=True, warnings=True, pred_output=pred_output)
-        statsd.increment('success_serious_warnings')
-    elif pred_output:
-        # Soft error (altitude too low error, typically): pred_output being set forces the debug
-        # window open with the messages in
-        update_progress(pred_running=False, pred_complete=True, pred_output=pred_output)
-        statsd.increment('success_minor_warnings')
+        throttle = None
+
+    now = datetime.datetime.utcnow()
+    mintime = now - datetime.timedelta(hours=
+            DEFAULT_PAST if options.past is None else options.past)
+    maxtime = now + datetime.timedelta(hours=
+            DEFAULT_FUTURE if options.future is None else options.future)
+
+    # Nearby sites often share a window.
+    windows = {}
+    for name in sorted(sites):
+        window = ( \
+                round_site_coordinate(sites[name]['latitude']), options.latdelta, \
+                canonicalise_longitude(round_site_coordinate(sites[name]['longitude'])), \
+                options.londelta)
+        windows.setdefault(window, name)
+
+    statsd.increment('prewarm')
+    for hd in ([False, True] if options.hd else [False]):
+        try:
+            dataset, dataset_url = dataset_for_time(now, hd, \
+                    options.discovery_workers)
+        except RuntimeError:
+            log.warning('No GFS dataset covers %s yet.' % now.ctime())
+            continue
+
+        def warm(window, name):
+            with timed('prewarm_site', site=name, hd=hd):
+                gfs_dir = fill_gfs_cache_entry(dataset, dataset_url, window, \
+                        mintime, maxtime, options, throttle)
+            log.info('Prewarmed %s for %s.' % (gfs_dir, name))
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, options.prewarm_workers)) as pool:
+            futures = [pool.submit(warm, window, name)
+                       for window, name in sorted(windows.items())]
+        for future in futures:
+            # Raise the first failure now that the rest have been tried.
+            future.result()
+
+    prune_gfs_cache(options.gfs_cache_size * 1024 * 1024)
+    prune_response_cache(options.response_cache_size * 1024 * 1024)
+
+def purge_cache():
+    """
+    Purge the DAP response cache (if set).
+    """
+
+    if GFS_RESPONSE_CACHE_DIR is None or not os.path.isdir(GFS_RESPONSE_CACHE_DIR):
+        return
+
+    log.info('Purging DAP response cache.')
+
+    for cycle in os.listdir(GFS_RESPONSE_CACHE_DIR):
+        log.debug('   Deleting %s.' % cycle)
+        shutil.rmtree(os.path.join(GFS_RESPONSE_CACHE_DIR, cycle), ignore_errors=True)
+
+def dataset_cycle_id(url):
+    """
+    Return an identifier for the GFS cycle served at url, e.g.
+    'gfs20240101_gfs_1p00_06z', which is safe to use as a directory name.
+    """
+    return '_'.join(url.rstrip('/').split('/')[-2:])
+
+def gfs_cache_entry_path(url, window, text=False, levels=0):
+    """
+    Return the directory which holds the wind files for the GFS cycle at url,
+    the download window (lat, latdelta, lon, londelta) and, unless levels is
+    0, only the first levels pressure levels.
+    """
+    window_id = '%s_%s_%s_%s' % window
+    if levels:
+        window_id += '_%ilev' % levels
+    if text:
+        window_id += '_dat'
     else:
-        log.info('The predictor pred.exe executable exit_code = %s' % exit_code )
-        assert exit_code == 0
-        update_progress(pred_running=False, pred_complete=True)
-        statsd.increment('success')  
- 
-    copy_path = os.path.join(copy_path, 'flight_path.csv')
+        window_id += '_bin'
 
-    log.info('Copying file:')
-    log.info(uuid_path+'flight_path.csv')
-    log.info('to file:')
-    log.info(copy_path)
+    return os.path.join(GFS_CACHE_DIR, dataset_cycle_id(url), window_id)
 
-    shutil.copyfile(uuid_path+'flight_path.csv',copy_path)
+def gfs_cache_entry(url, window, text=False, levels=0):
+    """
+    Return the directory which holds the wind files for the GFS cycle at url,
+    the download window and levels as for gfs_cache_entry_path, creating it
+    if needed and marking it as recently used.
+    """
+    entry = gfs_cache_entry_path(url, window, text, levels)
+    if not os.path.exists(entry):
+        os.makedirs(entry, 0o770)
+    os.utime(entry)
 
-    shutil.rmtree(gfs_dir)
+    return entry
 
+def fill_gfs_cache_entry(dataset, dataset_url, window, mintime, maxtime, options,
+                         throttle=None):
+    """
+    Make sure a GFS cache entry for the dataset at dataset_url and window
+    holds wind files for every time step needed to cover mintime to maxtime,
+    and every pressure level needed up to options.max_altitude, downloading
+    any which are missing, and return its directory.
+    """
+    if options.text_wind:
+        filename_format = "gfs_%(time)_%(lat)_%(lon)_%(latdelta)_%(londelta).dat"
+    else:
+        filename_format = "gfs_%(time)_%(lat)_%(lon)_%(latdelta)_%(londelta).bin"
+
+    timestamps = [timestamp for timeidx, timestamp in
+                  select_times(dataset['hgtprs'], mintime, maxtime)]
+
+    def cached_times(entry):
+        return [os.path.exists(os.path.join(entry,
+                    wind_file_name(filename_format, timestamp, window)))
+                for timestamp in timestamps]
+
+    all_levels = len(dataset['hgtprs'].maps['lev'].data)
+    levels = levels_needed(dataset['hgtprs'].maps['lev'].data, options.max_altitude)
+    if levels >= all_levels:
+        levels = 0
+
+    # An entry with more levels, such as one prewarmed with all of them,
+    # will do just as well as long as it has every time step.
+    if levels:
+        for wider in [0] + list(range(all_levels - 1, levels, -1)):
+            entry = gfs_cache_entry_path(dataset_url, window, options.text_wind, wider)
+            if os.path.isdir(entry) and all(cached_times(entry)):
+                log.info('Using cached wind data in %s.' % entry)
+                statsd.increment('gfs_cache_hit')
+                os.utime(entry)
+                return entry
+
+    gfs_dir = gfs_cache_entry(dataset_url, window, options.text_wind, levels)
+    cached = cached_times(gfs_dir)
+
+    if all(cached):
+        log.info('Using cached wind data in %s.' % gfs_dir)
+        statsd.increment('gfs_cache_hit')
+    else:
+        # Only the time steps not already in the cache entry, say because an
+        # earlier run launched a little earlier or looked less far ahead,
+        # are downloaded.
+        skip_times = set(timestamp for timestamp, is_cached in
+                         zip(timestamps, cached) if is_cached)
+        if skip_times:
+            log.info('Reusing %s of %s time steps from %s.' % \
+                (len(skip_times), len(timestamps), gfs_dir))
+            statsd.increment('gfs_cache_partial')
+            statsd.increment('gfs_cache_reused_times', len(skip_times))
+        else:
+            statsd.increment('gfs_cache_miss')
+
+        # Write into a staging directory and move the finished files into
+        # the cache entry, so that a predictor scanning the entry at the same
+        # time never sees a half-written file.
+        staging_dir = tempfile.mkdtemp(dir=GFS_CACHE_DIR)
+        output_format = os.path.join(staging_dir, filename_format)
 
+        try:
+            write_file(output_format, dataset, \
+                    window, mintime, maxtime, \
+                    text=options.text_wind, \
+                    workers=options.fetch_workers, \
+                    time_chunk=options.fetch_time_chunk, \
+                    retries=options.fetch_retries, \
+                    memory=options.fetch_memory * 1024 * 1024, \
+                    skip_times=skip_times, \
+                    throttle=throttle, \
+                    levels=levels)
+
+            for filename in os.listdir(staging_dir):
+                os.replace(os.path.join(staging_dir, filename),
+                           os.path.join(gfs_dir, filename))
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return gfs_dir
+
+def levels_needed(levels, max_altitude):
+    """
+    Return how many of the pressure levels, in hPa and listed from the
+    surface up as GFS lists them, are needed to cover altitudes up to
+    max_altitude metres: those up to PRESSURE_LEVEL_MARGIN metres above it
+    in the standard atmosphere, and then one more. If max_altitude is None
+    or 0 all of the levels are needed.
+    """
+    if not max_altitude:
+        return len(levels)
+
+    pressure = standard_pressure(max_altitude + PRESSURE_LEVEL_MARGIN)
+    count = 0
+    for level in levels:
+        count += 1
+        if level < pressure:
+            break
+    return count
 
-def purge_cache():
+def standard_pressure(altitude):
+    """
+    Return the pressure in hPa at altitude metres in the International
+    Standard Atmosphere.
     """
-    Purge the pydap cache (if set).
+    if altitude <= 11000:
+        return 1013.25 * (1 - 2.25577e-5 * altitude) ** 5.25588
+    if altitude <= 20000:
+        return 226.3206 * math.exp(-1.576885e-4 * (altitude - 11000))
+    if altitude <= 32000:
+        return 54.74889 * (1 + 4.615740e-6 * (altitude - 20000)) ** -34.16319
+    if altitude <= 47000:
+        return 8.680187 * (1 + 1.224646e-5 * (altitude - 32000)) ** -12.20114
+    return 1.109063 * math.exp(-1.262266e-4 * (altitude - 47000))
+
+def prune_gfs_cache(max_bytes, keep=None):
     """
+    Evict the least recently used GFS cache entries until the cache holds at
+    most max_bytes of wind files. The entry keep, and any entry used in the
+    last GFS_CACHE_MIN_AGE seconds, is left alone.
+    """
+    if not os.path.isdir(GFS_CACHE_DIR):
+        return
 
-    if pydap.lib.CACHE is None:
+    entries = []
+    total = 0
+    for cycle in os.listdir(GFS_CACHE_DIR):
+        cycle_dir = os.path.join(GFS_CACHE_DIR, cycle)
+        if not os.path.isdir(cycle_dir):
+            continue
+        for window_id in os.listdir(cycle_dir):
+            entry = os.path.join(cycle_dir, window_id)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f))
+                           for f in os.listdir(entry))
+                last_used = os.path.getmtime(entry)
+            except OSError:
+                # Evicted by someone else in the meantime.
+                continue
+            entries.append((last_used, size, entry))
+            total += size
+
+    entries.sort()
+    now = timelib.time()
+    for last_used, size, entry in entries:
+        if total <= max_bytes:
+            break
+        if entry == keep or now - last_used < GFS_CACHE_MIN_AGE:
+            continue
+        log.info('Evicting GFS cache entry %s.' % entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+        # Tidy up the cycle directory once its last window has gone.
+        try:
+            os.rmdir(os.path.dirname(entry))
+        except OSError:
+            pass
+
+def prune_response_cache(max_bytes):
+    """
+    Drop the cached DAP responses for GFS cycles older than
+    GFS_RESPONSE_CACHE_MAX_CYCLE_AGE, then evict the least recently used
+    responses until the cache holds at most max_bytes.
+    """
+    if GFS_RESPONSE_CACHE_DIR is None or not os.path.isdir(GFS_RESPONSE_CACHE_DIR):
         return
 
-    log.info('Purging PyDAP cache.')
+    responses = []
+    total = 0
+    now = timelib.time()
+    for cycle in os.listdir(GFS_RESPONSE_CACHE_DIR):
+        cycle_dir = os.path.join(GFS_RESPONSE_CACHE_DIR, cycle)
+        time = cycle_time(cycle)
+        if time is not None and \
+                now - datetime_to_posix(time) > GFS_RESPONSE_CACHE_MAX_CYCLE_AGE:
+            log.info('Dropping cached responses for %s.' % cycle)
+            statsd.increment('response_cache_expired')
+            shutil.rmtree(cycle_dir, ignore_errors=True)
+            continue
+        try:
+            names = os.listdir(cycle_dir)
+        except OSError:
+            continue
+        for name in names:
+            response = os.path.join(cycle_dir, name)
+            try:
+                size = os.path.getsize(response)
+                last_used = os.path.getmtime(response)
+            except OSError:
+                # Evicted by someone else in the meantime.
+                continue
+            responses.append((last_used, size, response))
+            total += size
+
+    responses.sort()
+    for last_used, size, response in responses:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(response)
+        except OSError:
+            pass
+        statsd.increment('response_cache_evicted')
+        total -= size
+
+    with response_cache_lock:
+        hits, misses = response_cache_stats['hits'], response_cache_stats['misses']
+    if hits + misses:
+        log.info('DAP response cache: %i hits, %i misses (%.0f%% hits), %i bytes kept.' % \
+            (hits, misses, 100.0 * hits / (hits + misses), total))
 
-    for file in os.listdir(pydap.lib.CACHE):
-        log.debug('   Deleting %s.' % file)
-        os.remove(pydap.lib.CACHE + file)
+def cycle_time(cycle_id):
+    """
+    Return the datetime of the GFS cycle with the given dataset_cycle_id,
+    e.g. 'gfs20240101_gfs_1p00_06z', or None if it is not one.
+    """
+    try:
+        return datetime.datetime.strptime(
+            cycle_id.split('_')[0][-8:] + cycle_id[-3:-1], '%Y%m%d%H')
+    except ValueError:
+        return None
 
-def write_file(output_format, thedata, window, mintime, maxtime):
+def wind_file_name(output_format, timestamp, window):
+    """
+    Expand the %(time), %(lat), %(latdelta), %(lon) and %(londelta) fields of
+    a wind file name format.
+    """
+    output_filename = output_format
+    output_filename = output_filename.replace('%(time)', str(timestamp))
+    output_filename = output_filename.replace('%(lat)', str(window[0]))
+    output_filename = output_filename.replace('%(latdelta)', str(window[1]))
+    output_filename = output_filename.replace('%(lon)', str(window[2]))
+    output_filename = output_filename.replace('%(londelta)', str(window[3]))
+    return output_filename
+
+def select_times(hgtprs_global, mintime, maxtime):
+    """
+    Return a list of (time index, POSIX timestamp) pairs for the GFS time
+    steps needed to cover mintime to maxtime, including the steps either
+    side of the window.
+    """
+    times = sorted(map(timestamp_to_datetime, hgtprs_global.maps['time']))
+    times_first = max(0, bisect.bisect_right(times, mintime) - 1)
+    times_last = min(len(times), bisect.bisect_left(times, maxtime) + 1)
+    times = times[times_first:times_last]
+
+    start_timestamp = datetime_to_posix(min(times))
+    end_timestamp = datetime_to_posix(max(times))
+
+    selected = []
+    for timeidx, time in enumerate(hgtprs_global.maps['time']):
+        timestamp = datetime_to_posix(timestamp_to_datetime(time))
+        if start_timestamp <= timestamp <= end_timestamp:
+            selected.append((timeidx, timestamp))
+    return selected
+
+def index_runs(indices):
+    """
+    Group indices into a list of (first, last + 1) ranges of consecutive
+    indices, in order.
+    """
+    runs = []
+    for index in sorted(indices):
+        if runs and runs[-1][1] == index:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+    return [tuple(run) for run in runs]
+
+class BandwidthLimit(object):
+    """
+    Paces the downloads of every thread sharing it so that, on average, at
+    most rate bytes a second are fetched.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_start = timelib.time()
+
+    def consume(self, nbytes):
+        """
+        Account for nbytes just downloaded, sleeping until the average rate
+        is back within the limit.
+        """
+        # The size of a response is only known once it has arrived, so the
+        # pause comes after each download rather than before it.
+        with self.lock:
+            now = timelib.time()
+            self.next_start = max(self.next_start, now) + nbytes / float(self.rate)
+            delay = self.next_start - now
+        if delay > 0:
+            timelib.sleep(delay)
+
+def fetch_grids(thedata, time_ranges, window_slices, workers=5, time_chunk=0,
+                throttle=None, retries=0):
+    """
+    Download the time indices in each of time_ranges, a list of
+    (first, last + 1) pairs, of each of the WIND_VARIABLES over
+    window_slices = (lev slice, lat slice, list of lon slices).
+
+    There is more than one lon slice when the window wraps around the 0/360
+    degree seam; each is requested separately and the pieces are joined up
+    again in the order given. The slices are requested concurrently from a
+    pool of at most workers threads. If time_chunk is non-zero each range is
+    further split into requests of at most time_chunk time steps. If throttle, a BandwidthLimit,
+    is given the downloads are paced by it. A request failing with a server or
+    network error is retried up to retries times, backing off between tries.
+    Returns a dictionary mapping each variable to a list of
+    (first time index, grid) chunks in time order.
+    """
+    chunks = []
+    for mintimeidx, maxtimeidx in sorted(time_ranges):
+        if time_chunk > 0:
+            # Chunks start at multiples of time_chunk whatever the window, so
+            # that a job asking for a slightly different window, or run again
+            # after failing part way, makes the same requests as before and
+            # finds the ones already finished in the response cache.
+            aligned = mintimeidx - mintimeidx % time_chunk
+            chunks.extend((max(first, mintimeidx), min(first + time_chunk, maxtimeidx))
+                          for first in range(aligned, maxtimeidx, time_chunk))
+        else:
+            chunks.append((mintimeidx, maxtimeidx))
+
+    timings = job_timings()
+    deadline = job_deadline()
+
+    lev_slice, lat_slice, lon_slices = window_slices
+
+    def fetch(var, first, last, lon_slice):
+        log.debug('Fetching %s for time indices %s to %s and longitude indices %s to %s.' % \
+            (var, first, last, lon_slice.start, lon_slice.stop))
+        for attempt in range(retries + 1):
+            time_left(deadline)
+            try:
+                with timed('fetch', timings, variable=var, times=[first, last], \
+                        lons=[lon_slice.start, lon_slice.stop]) as timing:
+                    if attempt:
+                        timing['attempt'] = attempt + 1
+                    grid = thedata[var][first:last, lev_slice, lat_slice, lon_slice]
+                    timing['bytes'] = sum(getattr(child.data, 'nbytes', 0)
+                                          for child in grid.children())
+                break
+            except Exception as e:
+                if attempt == retries or not transient_fetch_error(e):
+                    raise
+                delay = FETCH_RETRY_DELAY * 2 ** attempt
+                log.warning('Fetching %s for time indices %s to %s failed (%s); retrying in %s seconds.' % \
+                    (var, first, last, str(e).split('\n')[0], delay))
+                statsd.increment('fetch_retry')
+                timelib.sleep(delay)
+        if throttle is not None:
+            throttle.consume(timing['bytes'])
+        return grid
+
+    dgrids = dict((var, []) for var in WIND_VARIABLES)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [(var, first, [pool.submit(fetch, var, first, last, lon_slice)
+                                 for lon_slice in lon_slices])
+                   for var in WIND_VARIABLES for first, last in chunks]
+        try:
+            for var, first, pieces in futures:
+                dgrids[var].append((first, join_longitudes(
+                    [result_by(piece, deadline) for piece in pieces])))
+        except:
+            # Once one request has failed for good, the rest need not be
+            # started.
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    return dgrids
+
+def transient_fetch_error(e):
+    """
+    Return whether the exception e, raised while downloading from NOMADS, is
+    worth retrying: a network error, a timeout, or a server error or
+    overload rather than, say, a request for something which is not there.
+    """
+    if isinstance(e, (requests.RequestException, socket.error)):
+        return True
+    if isinstance(e, pydap.net.HTTPError):
+        # pydap raises these with the response status at the start of the
+        # detail, or just 'Timeout'.
+        try:
+            status = int(str(e.detail).split()[0])
+        except (IndexError, ValueError):
+            return True
+        return status >= 500 or status in (408, 429)
+    return False
+
+def join_longitudes(grids):
+    """
+    Join a list of grids holding neighbouring runs of longitudes, and
+    otherwise the same coordinates, into a single grid, in list order.
+    """
+    if len(grids) == 1:
+        return grids[0]
+
+    first = grids[0]
+    joined = pydap.model.GridType(first.name, attributes=first.attributes)
+    joined[first.array.name] = pydap.model.BaseType(first.array.name,
+            numpy.concatenate([grid.array.data for grid in grids], axis=-1),
+            attributes=first.array.attributes, dimensions=first.array.dimensions)
+    for name, axis in first.maps.items():
+        if name == 'lon':
+            data = numpy.concatenate([grid.maps[name].data for grid in grids])
+        else:
+            data = axis.data
+        joined[name] = pydap.model.BaseType(name, data,
+                attributes=axis.attributes, dimensions=axis.dimensions)
+    return joined
+
+def grid_at_time(chunks, timeidx):
+    """
+    Return the (lev, lat, lon) grid for time index timeidx from a list of
+    (first time index, grid) chunks as returned by fetch_grids.
+    """
+    for first, grid in reversed(chunks):
+        if first <= timeidx < first + grid.shape[0]:
+            return grid[timeidx - first, :, :, :]
+    raise IndexError('Time index %s was not downloaded.' % timeidx)
+
+def batch_times(selected_times, step_bytes, memory, time_chunk=0):
+    """
+    Split selected_times, a list of (time index, timestamp) pairs in order,
+    into batches small enough that the downloaded grids for each, at
+    step_bytes a time step, fit into memory bytes, or into a single batch if
+    memory is 0.
+
+    A batch always holds at least one time step, and when the requests are
+    split into chunks of time_chunk time steps the batches are whole chunks,
+    so that batching does not change the requests made.
+    """
+    if memory <= 0:
+        return [selected_times]
+
+    steps = max(1, memory // max(1, step_bytes))
+    if time_chunk > 0:
+        steps = max(1, steps // time_chunk) * time_chunk
+
+    batches = []
+    for timeidx, timestamp in selected_times:
+        if batches and batches[-1][0][0] // steps == timeidx // steps:
+            batches[-1].append((timeidx, timestamp))
+        else:
+            batches.append([(timeidx, timestamp)])
+    return batches
+
+def stream_time_steps(thedata, batches, window_slices, workers=5, time_chunk=0,
+                      throttle=None, retries=0):
+    """
+    Download the grids for each batch of (time index, timestamp) pairs in
+    turn, as for fetch_grids, and yield (time index, timestamp,
+    downloaded_data) for every time step, downloaded_data mapping each of
+    the WIND_VARIABLES to its (lev, lat, lon) grid. Only one batch is held
+    in memory at a time.
+    """
+    for batch in batches:
+        dgrids = fetch_grids(thedata,
+                index_runs(timeidx for timeidx, timestamp in batch),
+                window_slices, workers, time_chunk, throttle, retries)
+        for timeidx, timestamp in batch:
+            yield timeidx, timestamp, dict((var, grid_at_time(dgrids[var], timeidx))
+                                           for var in WIND_VARIABLES)
+        del dgrids
+
+def write_file(output_format, thedata, window, mintime, maxtime, text=False,
+               workers=5, time_chunk=0, skip_times=(), throttle=None, levels=0,
+               retries=0, memory=0):
     log.info('Downloading data in window (lat, lon) = (%s +/- %s, %s +/- %s).' % window)
 
     # Firstly, get the hgtprs variable to extract the times we're going to use.
@@ -418,17 +2212,20 @@ def write_file(output_format, thedata, window, mintime, maxtime):
     # Check the dimensions are what we expect.
     assert(hgtprs_global.dimensions == ('time', 'lev', 'lat', 'lon'))
 
-    # Work out what times we want to download
-    times = sorted(map(timestamp_to_datetime, hgtprs_global.maps['time']))
-    times_first = max(0, bisect.bisect_right(times, mintime) - 1)
-    times_last = min(len(times), bisect.bisect_left(times, maxtime) + 1)
-    times = times[times_first:times_last]
+    # Work out what times we want to download, leaving out any we have
+    # already written for this cycle and window.
+    selected_times = [(timeidx, timestamp) for timeidx, timestamp in
+                      select_times(hgtprs_global, mintime, maxtime)
+                      if timestamp not in skip_times]
+    if not selected_times:
+        log.info('All of the wind data needed has already been written.')
+        return
 
-    num_times = len(times)
+    num_times = len(selected_times)
     current_time = 0
 
-    start_time = min(times)
-    end_time = max(times)
+    start_time = datetime.datetime.utcfromtimestamp(selected_times[0][1])
+    end_time = datetime.datetime.utcfromtimestamp(selected_times[-1][1])
     log.info('Downloading from %s to %s.' % (start_time.ctime(), end_time.ctime()))
     # print('Downloading from: ', start_time.ctime(), ' to: ', end_time.ctime()) 
     # print('num_times = ', num_times)
@@ -466,25 +2263,12 @@ def write_file(output_format, thedata, window, mintime, maxtime):
     # bighgtprs = hgtprs_grid[:,:,:,:]
     # print('made it past big grid')
  
-    mintimeidx = 1000
-    maxtimeidx = 0
-    for timeidx, time in list(enumerate(hgtprs_global.maps['time'])):
-
-        timestamp = datetime_to_posix(timestamp_to_datetime(time))
-        if (timestamp < datetime_to_posix(start_time)) | (timestamp > datetime_to_posix(end_time)):
-            continue
-
-        if (timeidx < mintimeidx):
-            mintimeidx = timeidx
-
-        if (timeidx > maxtimeidx):
-            maxtimeidx = timeidx
-
-    maxtimeidx += 1
     minlat = latitudes[0][0]
     maxlat = latitudes[-1][0] + 1
-    minlon = longitudes[0][0]
-    maxlon = longitudes[-1][0] + 1
+    # A window which wraps around the 0/360 degree seam is fetched as two
+    # pieces, either side of it, rather than as everything in between.
+    lon_slices = [slice(first, last) for first, last in
+                  index_runs(count for count, ele in longitudes)]
     # print('minlat = ', minlat)
     # print('maxlat = ', maxlat)
     # print('minlon = ', minlon)
@@ -492,58 +2276,32 @@ def write_file(output_format, thedata, window, mintime, maxtime):
     # print('mintimeidx = ', mintimeidx)
     # print('maxtimeidx = ', maxtimeidx)
 
-    # print('get hgtprs grid')
-    hgtprs_grid = thedata['hgtprs']
-    dgridhgtprs = hgtprs_grid[mintimeidx:maxtimeidx,:,minlat:maxlat,minlon:maxlon]
-    # print('made it past hgtprs grid')
-
-    # print('get ugrdprs grid')
-    ugrdprs_grid = thedata['ugrdprs']
-    dgridugrdprs = ugrdprs_grid[mintimeidx:maxtimeidx,:,minlat:maxlat,minlon:maxlon]
-    # print('made it past ugrdprs grid')
-
-    # print('get vgrdprs grid')
-    vgrdprs_grid = thedata['vgrdprs']
-    dgridvgrdprs = vgrdprs_grid[mintimeidx:maxtimeidx,:,minlat:maxlat,minlon:maxlon]
-    # print('made it past vgrdprs grid')
-
-    # print('get tmpprs grid')
-    tmpprs_grid = thedata['tmpprs']
-    dgridtmpprs = tmpprs_grid[mintimeidx:maxtimeidx,:,minlat:maxlat,minlon:maxlon]
-    # print('made it past tmpprs grid')
-
-    # print('get vvelprs grid')
-    vvelprs_grid = thedata['vvelprs']
-    dgridvvelprs = vvelprs_grid[mintimeidx:maxtimeidx,:,minlat:maxlat,minlon:maxlon]
-    # print('made it past vvelprs grid')
-
-
+    # Fetch all five variables at once, a batch of time steps at a time so
+    # that no more than memory bytes of grids are held however long the
+    # window is.
+    num_levels = len(hgtprs_global.maps['lev'].data)
+    if levels:
+        num_levels = min(levels, num_levels)
+    step_bytes = len(WIND_VARIABLES) * num_levels * (maxlat - minlat) * \
+        len(longitudes) * numpy.dtype(hgtprs_global.array.dtype).itemsize
+    batches = batch_times(selected_times, step_bytes, memory, time_chunk)
+    if len(batches) > 1:
+        log.debug('Downloading %s time steps of %s bytes in %s batches.' % \
+            (num_times, step_bytes, len(batches)))
+    time_steps = stream_time_steps(thedata, batches, \
+            (slice(0, levels or None), slice(minlat, maxlat), lon_slices), \
+            workers, time_chunk, throttle, retries)
 
     # Write one file for each time index.
-    # for timeidx, time in enumerate(hgtprs_global.maps['time']):
-    for timeidx, time in list(enumerate(hgtprs_global.maps['time'])):
-
-        timestamp = datetime_to_posix(timestamp_to_datetime(time))
-        if (timestamp < datetime_to_posix(start_time)) | (timestamp > datetime_to_posix(end_time)):
-            continue
+    for timeidx, timestamp, downloaded_data in time_steps:
 
         current_time += 1
         
-        log.info('Downloading data for %s.' % (timestamp_to_datetime(time).ctime()))
-
-        # print('transferring data to downloaded_data for timeidx: ', timeidx, ' at time: ', timestamp_to_datetime(time).ctime())
-        dgridtidx = timeidx - mintimeidx
-        downloaded_data = { }
-        downloaded_data['hgtprs']  = dgridhgtprs[dgridtidx,:,:,:]
-        downloaded_data['ugrdprs'] = dgridugrdprs[dgridtidx,:,:,:]
-        downloaded_data['vgrdprs'] = dgridvgrdprs[dgridtidx,:,:,:]
-        downloaded_data['tmpprs']  = dgridtmpprs[dgridtidx,:,:,:]
-        downloaded_data['vvelprs'] = dgridvvelprs[dgridtidx,:,:,:]
-        # print('done transferring data to downloaded_data for timeidx: ', timeidx)
+        log.info('Downloading data for %s.' % (datetime.datetime.utcfromtimestamp(timestamp).ctime()))
 
         current_var = 0
         time_per_var = datetime.timedelta()
-        for var in ('hgtprs', 'ugrdprs', 'vgrdprs', 'tmpprs', 'vvelprs'):
+        for var in WIND_VARIABLES:
             current_var += 1
             # doubvar = '%s.%s' % (var, var)
             #k grid = thedata['hgtprs.hgtprs']
@@ -658,91 +2416,141 @@ def write_file(output_format, thedata, window, mintime, maxtime):
 
         log.info('Writing output...')
 
-        hgtprs = downloaded_data['hgtprs']
-        ugrdprs = downloaded_data['ugrdprs']
-        vgrdprs = downloaded_data['vgrdprs']
-        tmpprs = downloaded_data['tmpprs']
-        vvelprs = downloaded_data['vvelprs']
-
         # log.debug('Using longitudes: %s' % (map(lambda x: x[1], longitudes),))
         # update the above for Python 3
         log.debug('Using longitudes: %s to %s' % (longitudes[0][0], (longitudes[-1][0]+1)))
 
-        output_filename = output_format
-        output_filename = output_filename.replace('%(time)', str(timestamp))
-        output_filename = output_filename.replace('%(lat)', str(window[0]))
-        output_filename = output_filename.replace('%(latdelta)', str(window[1]))
-        output_filename = output_filename.replace('%(lon)', str(window[2]))
-        output_filename = output_filename.replace('%(londelta)', str(window[3]))
+        output_filename = wind_file_name(output_format, timestamp, window)
 
         log.info('   Writing \'%s\'...' % output_filename)
-        output = open(output_filename, 'w')
-
-        # Write the header.
-        output.write('# window centre latitude, window latitude radius, window centre longitude, window longitude radius, POSIX timestamp\n')
-        header = window + (timestamp,)
-        output.write(','.join(map(str,header)) + '\n')
-
-        # Write the axis count.
-        output.write('# num_axes\n')
-        output.write('3\n') # FIXME: HARDCODED!
-
-        # Write each axis, a record showing the size and then one with the values.
-        output.write('# axis 1: pressures\n')
-        output.write(str(hgtprs.maps['lev'].shape[0]) + '\n')
-        #l output.write(str(len(hgtprs.dimensions)) + '\n')
-        output.write(','.join(map(str,hgtprs.maps['lev'][:])) + '\n')
-        output.write('# axis 2: latitudes\n')
-        output.write(str(len(latitudes)) + '\n')
-        output.write(','.join(map(lambda x: str(x[1]), latitudes)) + '\n')
-        output.write('# axis 3: longitudes\n')
-        output.write(str(len(longitudes)) + '\n')
-        output.write(','.join(map(lambda x: str(x[1]), longitudes)) + '\n')
-
-        # Write the number of lines of data.
-        output.write('# number of lines of data\n')                                  #j
-        #l output.write('%s\n' % (hgtprs.shape[1] * len(latitudes) * len(longitudes)))  #j
-        output.write('%s\n' % (hgtprs.maps['lev'].shape[0] * len(latitudes) * len(longitudes)))  #j
-        #l output.write('%s\n' % (len(hgtprs.dimensions) * len(latitudes) * len(longitudes)))  #j
-
-        # Write the number of components in each data line.
-        output.write('# data line component count\n')
-        output.write('5\n') # FIXME: HARDCODED!
-
-        # Write the data itself.
-        output.write('# now the data in axis 3 major order\n')
-        output.write('# data is: '
-                     'geopotential height [gpm], u-component wind [m/s], '
-                     'v-component wind [m/s], temperature [K], '
-                     'vertical velocity (pressure) [Pa/s]\n')
-        for pressureidx, pressure in enumerate(hgtprs.maps['lev']):
-            for latidx, latitude in enumerate(hgtprs.maps['lat']):
-                for lonidx, longitude in enumerate(hgtprs.maps['lon']):
-                    if longitude_distance(longitude, window[2]) > window[3]:
-                        continue
-                    # record = ( hgtprs.array[pressureidx,latidx,lonidx], \
-                    #            ugrdprs.array[pressureidx,latidx,lonidx], \
-                    #            vgrdprs.array[pressureidx,latidx,lonidx], \
-                    #            tmpprs.array[pressureidx,latidx,lonidx], \
-                    #            vvelprs.array[pressureidx,latidx,lonidx] )
-                    record = ( hgtprs.array[pressureidx,latidx,lonidx].data, \
-                               ugrdprs.array[pressureidx,latidx,lonidx].data, \
-                               vgrdprs.array[pressureidx,latidx,lonidx].data, \
-                               tmpprs.array[pressureidx,latidx,lonidx].data, \
-                               vvelprs.array[pressureidx,latidx,lonidx].data )
-                    # record = ( hgtprs.array[0,pressureidx,latidx,lonidx].data, \
-                    #            ugrdprs.array[0,pressureidx,latidx,lonidx].data, \
-                    #            vgrdprs.array[0,pressureidx,latidx,lonidx].data, \
-                    #            tmpprs.array[0,pressureidx,latidx,lonidx].data, \
-                    #            vvelprs.array[0,pressureidx,latidx,lonidx].data )
-                    output.write(','.join(map(str,record)) + '\n')
+        with timed('write_wind_file', time=timestamp) as timing:
+            if text:
+                write_text_wind_file(output_filename, window, timestamp,
+                                     downloaded_data, latitudes, longitudes)
+            else:
+                write_binary_wind_file(output_filename, window, timestamp,
+                                       downloaded_data, latitudes, longitudes)
+            timing['bytes'] = os.path.getsize(output_filename)
+
+        # These hold views of the whole batch, which must go before the next
+        # batch is downloaded.
+        del downloaded_data, target_shape
+
+def write_binary_wind_file(output_filename, window, timestamp, downloaded_data,
+                           latitudes, longitudes):
+    """
+    Write a single time step of downloaded data to a binary wind file which
+    wind_file_new() in pred_src/wind/wind_file.c memory maps instead of
+    parsing. The layout is described in pred_src/wind/wind_file_binary.h.
+    """
+    axes = (
+        numpy.asarray(downloaded_data['hgtprs'].maps['lev'][:].data),
+        [x[1] for x in latitudes],
+        [x[1] for x in longitudes],
+        )
+    block = stack_wind_block(downloaded_data, window)
+    assert block.shape == tuple(map(len, axes)) + (5,)
+
+    output = open(output_filename, 'wb')
+
+    header = WIND_FILE_BINARY_HEADER.pack(WIND_FILE_BINARY_MAGIC,
+            WIND_FILE_BINARY_VERSION, len(axes), 5, 0,
+            window[0], window[1], window[2], window[3], timestamp)
+    output.write(header)
+    output.write(struct.pack('<%iI' % len(axes), *map(len, axes)))
+
+    for axis in axes:
+        output.write(numpy.asarray(axis, dtype='<f4').tobytes())
+
+    # GFS data is already float32 so this is normally a no-copy view.
+    block = numpy.ascontiguousarray(block, dtype='<f4')
+    output.flush()
+    block.tofile(output)
+
+    output.close()
+
+def write_text_wind_file(output_filename, window, timestamp, downloaded_data,
+                         latitudes, longitudes):
+    """
+    Write a single time step of downloaded data to a text wind file which can
+    be read by wind_file_new() in pred_src/wind/wind_file.c.
+
+    The five variables are stacked into one (lev, lat, lon, 5) array and
+    formatted in bulk rather than cell by cell.
+    """
+    hgtprs = downloaded_data['hgtprs']
+
+    output = open(output_filename, 'w')
+
+    # Write the header.
+    output.write('# window centre latitude, window latitude radius, window centre longitude, window longitude radius, POSIX timestamp\n')
+    header = window + (timestamp,)
+    output.write(','.join(map(str,header)) + '\n')
+
+    # Write the axis count.
+    output.write('# num_axes\n')
+    output.write('3\n') # FIXME: HARDCODED!
+
+    # Write each axis, a record showing the size and then one with the values.
+    output.write('# axis 1: pressures\n')
+    output.write(str(hgtprs.maps['lev'].shape[0]) + '\n')
+    output.write(','.join(map(str,hgtprs.maps['lev'][:])) + '\n')
+    output.write('# axis 2: latitudes\n')
+    output.write(str(len(latitudes)) + '\n')
+    output.write(','.join(map(lambda x: str(x[1]), latitudes)) + '\n')
+    output.write('# axis 3: longitudes\n')
+    output.write(str(len(longitudes)) + '\n')
+    output.write(','.join(map(lambda x: str(x[1]), longitudes)) + '\n')
+
+    # Write the number of lines of data.
+    output.write('# number of lines of data\n')
+    output.write('%s\n' % (hgtprs.maps['lev'].shape[0] * len(latitudes) * len(longitudes)))
+
+    # Write the number of components in each data line.
+    output.write('# data line component count\n')
+    output.write('5\n') # FIXME: HARDCODED!
+
+    # Write the data itself.
+    output.write('# now the data in axis 3 major order\n')
+    output.write('# data is: '
+                 'geopotential height [gpm], u-component wind [m/s], '
+                 'v-component wind [m/s], temperature [K], '
+                 'vertical velocity (pressure) [Pa/s]\n')
+
+    block = stack_wind_block(downloaded_data, window)
+
+    # numpy's str() conversion of each element is the same shortest
+    # round-trip representation that str() gives a single numpy scalar, so
+    # the output is byte-for-byte what the old per-cell loop produced.
+    records = block.reshape(-1, 5).astype(str).tolist()
+    if records:
+        output.write('\n'.join(map(','.join, records)) + '\n')
+
+    output.close()
+
+def stack_wind_block(downloaded_data, window):
+    """
+    Stack the hgtprs, ugrdprs, vgrdprs, tmpprs and vvelprs grids for one
+    time step into a single (lev, lat, lon, 5) array, dropping any longitudes
+    which fall outside of the window.
+    """
+    block = numpy.stack([numpy.asarray(downloaded_data[var].array[:].data)
+                         for var in WIND_VARIABLES], axis=-1)
+
+    lons = numpy.asarray(downloaded_data['hgtprs'].maps['lon'][:].data,
+                         dtype=numpy.float64)
+    distances = numpy.fabs(lons - window[2])
+    distances = numpy.minimum(distances, 360 - distances)
+
+    return block[:, :, distances <= window[3], :]
 
 def canonicalise_longitude(lon):
     """
     The GFS model has all longitudes in the range 0.0 -> 359.5. Canonicalise
     a longitude so that it fits in this range and return it.
     """
-    lon = math.fmod(lon, 360)
+    # Adding 0.0 turns -0.0 into 0.0, so that both name the same cache entry.
+    lon = math.fmod(lon, 360) + 0.0
     if lon < 0.0:
         lon += 360.0
     assert((lon >= 0.0) & (lon < 360.0))
@@ -823,8 +2631,8 @@ def possible_urls(time, hd):
     # thinks it's OK to use a recent one, and then by chance we end up talking
     # to a server on a later request that doesn't have it.
     # print('url_format =', url_format)
-    selected_ip = socket.gethostbyname("nomads.ncep.noaa.gov")
-    log.info("Picked IP: {0}".format(selected_ip))
+    # selected_ip = socket.gethostbyname("nomads.ncep.noaa.gov")
+    # log.info("Picked IP: {0}".format(selected_ip))
     # url_format = url_format.format(host=selected_ip)
     url_format = url_format.format(host='nomads.ncep.noaa.gov')
     # print('url_format including host =', url_format)
@@ -845,58 +2653,387 @@ def possible_urls(time, hd):
 
     return possible_urls
 
-def dataset_for_time(time, hd):
+# Every DAP request goes through this session, so that connections to NOMADS
+# are reused between requests and, in the worker daemon, between predictions.
+# See dap_session.
+http_session_lock = threading.Lock()
+http_session = None
+
+# How many DAP requests this process has answered from, and had to add to,
+# the response cache.
+response_cache_lock = threading.Lock()
+response_cache_stats = {'hits': 0, 'misses': 0}
+
+# Discovery entries already read or written by this process, by URL.
+discovery_entries = {}
+
+# The (wind file names, predictor.WindCache) last used for each GFS cache
+# entry by this process, least recently used first.
+in_process_wind_caches_lock = threading.Lock()
+in_process_wind_caches = {}
+
+# If set, a WSGI application which answers every DAP request in place of
+# NOMADS. The offline benchmarks point this at a synthetic dataset.
+dap_application = None
+
+# The RecordingDAPHandler class, once recording_dap_handler has defined it.
+RecordingDAPHandler = None
+
+def dap_session():
     """
-    Given a datetime object, attempt to find the latest dataset which covers that 
-    time and return pydap dataset object for it.
+    Return http_session, creating it the first time.
     """
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests.Session()
+        return http_session
 
-    print('start dataset_for_time at time =', time)
-    url_list = possible_urls(time, hd)
-    print('the dataset_for_time url_list = ', url_list)
+def recording_dap_handler(url, dds=None, das=None, application=None):
+    """
+    Return a RecordingDAPHandler for the dataset at url. The class derives
+    from pydap's DAPHandler, so it is only defined once it is first needed,
+    leaving pydap unimported until then.
+    """
+    global RecordingDAPHandler
+    if RecordingDAPHandler is None:
+        RecordingDAPHandler = define_recording_dap_handler()
+    return RecordingDAPHandler(url, dds, das, application)
+
+def define_recording_dap_handler():
+
+    class RecordingDAPHandler(pydap.handlers.dap.DAPHandler):
+        """
+        A pydap DAP handler which remembers the DDS and DAS text it downloads, and
+        which builds the dataset from DDS and DAS text handed to it instead of
+        downloading them when it can.
+        """
+
+        def __init__(self, url, dds=None, das=None, application=None):
+            self.dds = dds
+            self.das = das
+            application = application or dap_application
+            if GFS_RESPONSE_CACHE_DIR is not None:
+                application = ResponseCache(url, application)
+            pydap.handlers.dap.DAPHandler.__init__(self, url,
+                    application, dap_session())
+
+        def dataset_from_dap2(self):
+            if self.dds is None:
+                self.dds = self.get_text('.dds')
+            self.dataset = pydap.parsers.dds.dds_to_dataset(self.dds)
+
+        def attach_das(self):
+            if self.das is None:
+                self.das = self.get_text('.das')
+            pydap.parsers.das.add_attributes(self.dataset,
+                    pydap.parsers.das.parse_das(self.das))
+
+        def get_text(self, extension):
+            url = urlunsplit((self.scheme, self.netloc, self.path + extension,
+                              self.query, self.fragment))
+            r = pydap.net.GET(url, self.application, self.session,
+                              timeout=self.timeout, verify=self.verify)
+            pydap.net.raise_for_status(r)
+            return pydap.handlers.dap.safe_charset_text(r, self.user_charset)
+
+    return RecordingDAPHandler
+
+class ResponseCache(object):
+    """
+    A WSGI application which answers the DAP requests for the dataset at url
+    from GFS_RESPONSE_CACHE_DIR where it can. Anything else is passed on to
+    application if given, or otherwise fetched from the server through
+    dap_session, and kept if it succeeds.
+    """
+
+    def __init__(self, url, application=None):
+        scheme, netloc = urlsplit(url)[:2]
+        self.server = urlunsplit((scheme, netloc, '', '', ''))
+        self.cycle_dir = os.path.join(GFS_RESPONSE_CACHE_DIR, dataset_cycle_id(url))
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        url = self.server + environ['PATH_INFO']
+        if environ.get('QUERY_STRING'):
+            url += '?' + environ['QUERY_STRING']
+        filename = os.path.join(self.cycle_dir,
+                                hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+        try:
+            with open(filename, 'rb') as f:
+                content_type, body = zlib.decompress(f.read()).split(b'\n', 1)
+            os.utime(filename)
+        except (IOError, OSError, ValueError, zlib.error):
+            content_type = None
+
+        with response_cache_lock:
+            response_cache_stats['hits' if content_type else 'misses'] += 1
+        if content_type:
+            statsd.increment('response_cache_hit')
+            statsd.increment('response_cache_hit_bytes', len(body))
+            status, content_type = '200 OK', content_type.decode('utf-8')
+        else:
+            statsd.increment('response_cache_miss')
+            status, content_type, body = self.forward(environ, url)
+            if status.startswith('200'):
+                self.keep(filename, content_type, body)
+
+        start_response(status, [('Content-Type', content_type),
+                                ('Content-Length', str(len(body)))])
+        return [body]
+
+    def forward(self, environ, url):
+        """
+        Return the status, content type and body of the response to the
+        request in environ for url.
+        """
+        if self.application is not None:
+            response = {}
+            def capture(status, headers, exc_info=None):
+                response['status'] = status
+                response['headers'] = dict(headers)
+            body = b''.join(self.application(environ, capture))
+            return response['status'], \
+                response['headers'].get('Content-Type', 'application/octet-stream'), body
+
+        try:
+            r = dap_session().get(url,
+                    timeout=environ.get('webob.client.timeout', pydap.lib.DEFAULT_TIMEOUT))
+        except requests.RequestException as e:
+            # As pydap's own client would have it.
+            return '502 Bad Gateway', 'text/plain', str(e).encode('utf-8')
+        return '%i %s' % (r.status_code, r.reason), \
+            r.headers.get('Content-Type', 'application/octet-stream'), r.content
+
+    def keep(self, filename, content_type, body):
+        """
+        Atomically add a response to the cache, compressed.
+        """
+        try:
+            if not os.path.isdir(self.cycle_dir):
+                os.makedirs(self.cycle_dir, 0o770)
+            fd, temp_path = tempfile.mkstemp(dir=self.cycle_dir, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(content_type.encode('utf-8') + b'\n' + body, 1))
+            os.replace(temp_path, filename)
+        except (IOError, OSError) as e:
+            log.warning('Could not keep DAP response in %s: %s' % (filename, e))
+
+def discovery_entry_path(url):
+    """
+    Return the path of the file in which discovery results for the dataset at
+    url are kept.
+    """
+    return os.path.join(GFS_DISCOVERY_DIR, dataset_cycle_id(url) + '.json')
+
+def load_discovery_entry(url):
+    """
+    Return what was last learnt about the dataset at url, or None if nothing
+    was or it is too old to be trusted.
+    """
+    entry = discovery_entries.get(url)
+    if entry is None:
+        try:
+            with open(discovery_entry_path(url)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        discovery_entries[url] = entry
+
+    if entry.get('available'):
+        ttl = GFS_DISCOVERY_AVAILABLE_TTL
+    else:
+        ttl = GFS_DISCOVERY_MISSING_TTL
+    if timelib.time() - entry.get('checked', 0) > ttl:
+        return None
+    return entry
+
+def save_discovery_entry(url, entry):
+    """
+    Atomically replace the discovery entry kept for the dataset at url.
+    """
+    discovery_entries[url] = entry
+    try:
+        if not os.path.isdir(GFS_DISCOVERY_DIR):
+            os.makedirs(GFS_DISCOVERY_DIR, 0o770)
+        fd, temp_path = tempfile.mkstemp(dir=GFS_DISCOVERY_DIR)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(entry))
+        os.replace(temp_path, discovery_entry_path(url))
+    except (IOError, OSError) as e:
+        log.warning('Could not save discovery entry for %s: %s' % (url, e))
+
+def discovery_entry_covers(entry, time):
+    """
+    Return whether the discovery entry is for an available dataset whose
+    forecast times cover the datetime time.
+    """
+    if not entry.get('available'):
+        return False
+    times = entry['coordinates']['time']
+    return timestamp_to_datetime(times[0]) <= time <= timestamp_to_datetime(times[-1])
 
-    for url in url_list:
+def probe_dataset(url, time, timings=None, stop=None):
+    """
+    Open the dataset at url and return the pydap dataset object for it if it
+    covers the datetime time, otherwise return None.
+
+    Discovery entries kept from earlier runs are used where they are still
+    fresh, in which case the dataset is built without talking to NOMADS at
+    all: its DDS, DAS and coordinate values all come from the entry. The
+    probe is recorded in timings, as for timed.
+
+    If stop, a threading.Event, is set before the probe has finished asking
+    NOMADS about the dataset, it returns None rather than make its next
+    request.
+    """
+    with timed('discovery_probe', timings, dataset=dataset_cycle_id(url)) \
+            as timing:
+        return probe_dataset_timed(url, time, timing, stop)
+
+def probe_dataset_timed(url, time, timing, stop=None):
+
+    entry = load_discovery_entry(url)
+    timing['cached'] = entry is not None
+    if entry is not None:
+        statsd.increment('discovery_cache_hit')
+        if not entry['available']:
+            log.debug('Dataset at %s was not available at last check.' % url)
+            return None
+        handler = recording_dap_handler(url, entry['dds'], entry['das'])
+    else:
+        statsd.increment('discovery_cache_miss')
         try:
+            if stop is not None and stop.is_set():
+                timing['stopped'] = True
+                return None
             log.debug('Trying dataset at %s.' % url)
-            print('Trying dataset at : ', url)
-            from pydap.client import open_url
-            print('made it past pydap.client import open_url, now opening dataset url')
-            dataset = open_url(url)
-            # dataset = open_url(url, output_grid=False)
-            print('opened datset url')
-            print('dataset_for_time dataset returned by pydap = ', dataset)
-            # print('with time = ', dataset.time)
-            # print('and location = ', dataset.location)
-            # print('and another time = ', dataset['time'][:])
-            # print('and start time = ', dataset['time'][0])
-            # print('and end time = ', dataset['time'][-1])
-            ## print('and start time data = ', dataset['time'][0].data)
-            ## print('and end time data = ', dataset['time'][-1].data)
-            # print('and sub-time = ', dataset.time.data)
-
-            # start_time = timestamp_to_datetime(dataset.time[0])
-            # end_time = timestamp_to_datetime(dataset.time[-1])
-            start_time = timestamp_to_datetime(dataset['time'][0].data)  #j
-            end_time = timestamp_to_datetime(dataset['time'][-1].data)   #j
-
-            print('start time = ', start_time)
-            print('end time = ', end_time)
-            print('time = ', time)
-            if start_time <= time and end_time >= time:
-                log.info('Found good dataset at %s.' % url)
-                dataset_id = url.split("/")[5] + "_" + url.split("/")[6].split("_")[1]
-                update_progress(gfs_timestamp=dataset_id)
-                return dataset
-#        except:
-#            raise Exception()
-        except pydap.exceptions.ServerError as e:
+            handler = recording_dap_handler(url)
+            if stop is not None and stop.is_set():
+                timing['stopped'] = True
+                return None
+            times = handler.dataset['time'][:].data
+        except (pydap.exceptions.ServerError, pydap.net.HTTPError) as e:
             log.debug('Server error in dataset at %s from %s' % (url, e) )
+            save_discovery_entry(url,
+                    {'checked': timelib.time(), 'available': False})
             # Skip server error.
-            pass
+            return None
+        entry = {
+            'checked': timelib.time(),
+            'available': True,
+            'dds': handler.dds,
+            'das': handler.das,
+            'coordinates': {'time': numpy.asarray(times).tolist()},
+            }
+        timing['bytes'] = len(handler.dds) + len(handler.das) + \
+            numpy.asarray(times).nbytes
+
+    start_time = timestamp_to_datetime(entry['coordinates']['time'][0])
+    end_time = timestamp_to_datetime(entry['coordinates']['time'][-1])
+    log.debug('Dataset at %s covers %s to %s.' % (url, start_time, end_time))
+    if start_time > time or end_time < time:
+        if len(entry['coordinates']) == 1:
+            save_discovery_entry(url, entry)
+        return None
+
+    # Only the dataset actually used needs the remaining coordinates, which
+    # are fetched the first time it is found and remembered from then on.
+    dataset = handler.dataset
+    missing = [name for name in COORDINATE_VARIABLES
+               if name not in entry['coordinates']]
+    for name in missing:
+        values = numpy.asarray(dataset[name][:].data)
+        timing['bytes'] = timing.get('bytes', 0) + values.nbytes
+        entry['coordinates'][name] = values.tolist()
+    if missing:
+        save_discovery_entry(url, entry)
+
+    for var in pydap.lib.walk(dataset, pydap.model.BaseType):
+        if var.name in entry['coordinates']:
+            var.data = numpy.asarray(entry['coordinates'][var.name])
+    return dataset
+
+def dataset_for_time(time, hd, workers=8):
+    """
+    Given a datetime object, attempt to find the latest dataset which covers that 
+    time and return pydap dataset object for it along with its URL.
+
+    Candidate datasets are probed newest first, in waves of up to workers at
+    once, so the first covering dataset found is the newest one. Once it has
+    been, any probes of older datasets in its wave are stopped before their
+    next request, and no more waves are started. Datasets which fresh
+    discovery entries already settle are not probed at all, so discovery
+    which finds them all in the discovery cache asks NOMADS nothing.
+    """
+
+    print('start dataset_for_time at time =', time)
+    url_list = possible_urls(time, hd)
+
+    with timed('discovery'):
+        return find_dataset(url_list, time, workers)
+
+def find_dataset(url_list, time, workers):
+    timings = job_timings()
+
+    # Discovery entries settle the newest datasets without asking NOMADS
+    # anything: go down the list while they say a dataset is missing or does
+    # not cover time, and use the first one they say does. Only if a dataset
+    # with no fresh entry comes first need anything be probed, from there on.
+    for first, url in enumerate(url_list):
+        entry = load_discovery_entry(url)
+        if entry is None:
+            break
+        if discovery_entry_covers(entry, time):
+            dataset = probe_dataset(url, time, timings)
+            if dataset is not None:
+                return found_dataset(dataset, url)
+    else:
+        first = len(url_list)
+    url_list = url_list[first:]
+
+    # Only timed, so that a slow resolver shows up in timings.json; the
+    # probes do their own lookups.
+    if dap_application is None and url_list:
+        host = urlsplit(url_list[0]).hostname
+        with timed('dns', host=host) as timing:
+            try:
+                socket.getaddrinfo(host, 443)
+            except socket.gaierror as e:
+                timing['error'] = str(e)
+
+    workers = max(1, workers)
+    stop = threading.Event()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for first in range(0, len(url_list), workers):
+            time_left(job_deadline())
+            wave = url_list[first:first + workers]
+            probes = [pool.submit(probe_dataset, url, time, timings, stop)
+                      for url in wave]
+            for url, probe in zip(wave, probes):
+                dataset = probe.result()
+                if dataset is not None:
+                    return found_dataset(dataset, url)
+    finally:
+        # Waiting costs at most the request each outstanding probe has in
+        # flight, and leaves no thread behind to keep asking NOMADS.
+        stop.set()
+        pool.shutdown(wait=True)
 
     print('RuntimeError of Could not find appropriate dataset.')
     raise RuntimeError('Could not find appropriate dataset.')
 
+def found_dataset(dataset, url):
+    """
+    Report that the dataset at url is the one to use, and return it and url.
+    """
+    log.info('Found good dataset at %s.' % url)
+    dataset_id = url.split("/")[5] + "_" + url.split("/")[6].split("_")[1]
+    update_progress(gfs_timestamp=dataset_id)
+    return dataset, url
+
 def detach_process(redirect):
     # Fork
     if os.fork() > 0:
@@ -941,7 +3078,7 @@ if __name__ == '__main__':
         main()
     except SystemExit as e:
         log.debug("Exit: " + repr(e))
-        if e.code != 0 and progress_f:
+        if e.code != 0 and progress_open():
             update_progress(error="Unknown error exit")
             statsd.increment("unknown_error_exit")
         raise
@@ -949,6 +3086,6 @@ if __name__ == '__main__':
         statsd.increment("uncaught_exception")
         log.exception("Uncaught exception")
         info = traceback.format_exc()
-        if progress_f:
+        if progress_open():
             update_progress(error="Unhandled exception: " + info)
         raise
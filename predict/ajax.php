@@ -42,8 +42,11 @@ case "submitForm":
             break;
         }
 
-        // If all of the above worked, let's run the prediction
-        runPred($pred_model);
+        // If all of the above worked, let's run the prediction, unless it
+        // is already on its way
+        $state = getJobState($pred_model['uuid']);
+        if ( $state != "queued" && $state != "running" )
+            runPred($pred_model);
         $json_return['valid'] = "true";
         $json_return['uuid'] = $pred_model['uuid'];
         $json_return['timestamp'] = $pred_model['timestamp'];
@@ -52,6 +55,18 @@ case "submitForm":
     echo json_encode($json_return);
     break;
 
+case "getJobState":
+    $uuid = $_GET['uuid'];
+    $json_return = array();
+    if ( !ctype_xdigit($uuid) ) {
+        $json_return['error'] = "Invalid UUID";
+    } else {
+        $json_return['uuid'] = $uuid;
+        $json_return['state'] = getJobState($uuid);
+    }
+    echo json_encode($json_return);
+    break;
+
 default:
     echo "Couldn't interpret 'action' variable";
     break;
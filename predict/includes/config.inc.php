@@ -16,10 +16,18 @@ define("LOCATION_SAVE_ENABLE", true);
 // Path to prediction data dir from predict/
 define("PREDS_PATH", "preds/");
 
+// Set to true if a resident `predict.py --daemon` is running, in which case
+// predictions are queued for it rather than each starting a new predict.py
+define("PREDICTOR_DAEMON", false);
+
+// Path to the daemon's queue dir from predict/
+define("QUEUE_PATH", "queue/");
+
 // Filenames used by the predictor
 define("SCENARIO_FILE", "scenario.ini");
 define("FLIGHT_CSV", "flight_path.csv");
 define("PROGRESS_JSON", "progress.json");
 define("LOG_FILE", "py_log");
+define("JOB_LOCK_FILE", "job.lock");
 
 ?>
@@ -137,6 +137,13 @@ function runPred($pred_model) {
         makeINI($pred_model);
     }
 
+    // Hand the prediction to the worker daemon if there is one. It reads
+    // everything it needs from the scenario file.
+    if ( defined("PREDICTOR_DAEMON") && PREDICTOR_DAEMON ) {
+        queuePred($pred_model);
+        return;
+    }
+
     // If using GFS HD, then append --hd to the exec string
     if ( $pred_model['software'] == "gfs_hd" ) $use_hd ="--hd ";
     else $use_hd = "";
@@ -151,6 +158,9 @@ function runPred($pred_model) {
     // $sh = "ls /";
     // $sh = ROOT . "predict.py --cd=" . ROOT . " --fork --alarm --redirect=" . ROOT . "$bog -v --latdelta="
     
+    // predict.py reads delta_time, the hours of winds to download after the
+    // launch, from the time-delta makeINI writes to the scenario, and
+    // lengthens it if the climb or an ensemble needs longer.
     $sh_start = "";
     $sh_fork = " --fork";
     if(strtolower(substr(PHP_OS, 0, 3)) == 'win'){
@@ -159,7 +169,7 @@ function runPred($pred_model) {
     }
     $sh = $sh_start . PYTHON_PATH . " " . ROOT_DIR . "predict.py --cd=" . ROOT_DIR . $sh_fork . " --alarm --redirect=" . ROOT_DIR . "$bog -vv --latdelta="
         .$pred_model['delta_lat']." --londelta=".$pred_model['delta_lon']
-        ." -p1 -f".$pred_model['delta_time']." -t ".$pred_model['timestamp']
+        ." -p1 -t ".$pred_model['timestamp']
         ." --lat=".$predictor_lat." --lon=".$predictor_lon." " . $use_hd
         . $pred_model['uuid'] . " 2>&1";
     if (defined("PYTHON"))
@@ -172,6 +182,19 @@ function runPred($pred_model) {
     file_put_contents($log, "Output: " . $commout . "\n", FILE_APPEND);
 }
 
+// Queue a prediction for the worker daemon by creating a file named after
+// its UUID in the queue dir. The file is written under a temporary name and
+// renamed so that the daemon never sees a half-created entry.
+function queuePred($pred_model) {
+    $log = PREDS_PATH . $pred_model['uuid'] . "/" . LOG_FILE;
+    $tmp = QUEUE_PATH . "." . $pred_model['uuid'];
+    touch($tmp) or die ("Couldn't queue the prediction");
+    chmod( $tmp, 0666 );
+    rename($tmp, QUEUE_PATH . $pred_model['uuid']);
+    file_put_contents($log, "Queued for the predictor daemon\n");
+    chmod( $log , 0666 );
+}
+
 // Use PHP's mkdir() to create a directory for the prediction data using
 // the UUID for the scenario
 function makePredDir($pred_model) {
@@ -211,6 +234,31 @@ function makeINI($pred_model) { // makes an ini file
     fclose($fh);
 }
 
+// Given a UUID, return the state of its prediction: "queued" if it is
+// waiting for the predictor daemon, otherwise "running", "done" or "error"
+// from the job registry entry predict.py keeps, or "unknown" if it has never
+// been run. A "running" entry whose process has died reads as "error".
+// Once the daemon has taken the UUID into QUEUE_PATH/working/ it is
+// "running", even before the registry says so: until the daemon claims the
+// job, the entry there is missing or no newer than the queued file.
+function getJobState($uuid) {
+    if ( file_exists(QUEUE_PATH . $uuid) ) return "queued";
+
+    $working = QUEUE_PATH . "working/" . $uuid;
+    $lock = PREDS_PATH . $uuid . "/" . JOB_LOCK_FILE;
+    $job = file_exists($lock) ? json_decode(file_get_contents($lock), true) : null;
+    if ( file_exists($working)
+        && ( !$job || $job['since'] <= @filemtime($working) ) ) return "running";
+    if ( !$job ) return "unknown";
+
+    if ( $job['state'] == "running" && function_exists("posix_kill")
+        && !posix_kill($job['pid'], 0) && posix_get_last_error() == 3 ) {
+        // ESRCH: no such process
+        return "error";
+    }
+    return $job['state'];
+}
+
 // Given a UUID, return the prediction scenario model
 function getModelByUUID($uuid) {
     if ( file_exists( PREDS_PATH . $uuid . "/" . SCENARIO_FILE ) ) {
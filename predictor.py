@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+Run the predictor's model in this process, through the shared library
+pred_src builds alongside pred_StationKeep, rather than starting the
+predictor and reading its output:
+
+    import predictor
+    with predictor.WindCache('gfs/cache/<cycle>/<window>') as winds:
+        ok, track = winds.run(lat, lon, altitude, timestamp)
+
+A WindCache scans its directory of wind files once and keeps the files it
+reads, so every run after the first against the same winds is spared both
+starting a process and parsing the wind files again. Each track is a
+(position, column) array with the TRACK_COLUMNS of the predictor's CSV
+output.
+
+The model keeps its state in globals, so runs are made one at a time
+whichever thread asks for them.
+"""
+
+import os
+import ctypes
+import threading
+
+import numpy
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Where CMake leaves the library on each platform.
+LIBRARY_PATHS = [os.path.join(ROOT, 'pred_src', name) for name in (
+    'libpred_StationKeep.so', 'libpred_StationKeep.dylib',
+    'pred_StationKeep.dll', 'libpred_StationKeep.dll', 'cygpred_StationKeep.dll')]
+
+# The columns of a track, as in the predictor's CSV output.
+TRACK_COLUMNS = ('timestamp', 'latitude', 'longitude', 'altitude', 'battery',
+                 'prop_u', 'prop_v', 'prop_z', 'rpm1', 'rpm2', 'rpm3', 'rpm4')
+
+# The predictor's CSV output format, for write_track.
+TRACK_FORMAT = '%11d,%4.4f,%4.4f,%7.1f,%6.0f,%6.3f,%6.3f,%6.3f,%4d,%4d,%4d,%4d\n'
+
+# Held for the whole of each run, and whenever the library is loaded.
+lock = threading.Lock()
+library = None
+
+class PredictorError(Exception):
+    pass
+
+def load_library():
+    """
+    Return the predictor library, loading it the first time, or None if it
+    has not been built.
+    """
+    global library
+    with lock:
+        if library is None:
+            for path in LIBRARY_PATHS:
+                if os.path.exists(path):
+                    library = bind(ctypes.CDLL(path))
+                    break
+        return library
+
+def available():
+    """
+    Return whether the predictor library has been built.
+    """
+    return load_library() is not None
+
+def bind(lib):
+    """
+    Declare the argument and result types of the functions in the library
+    lib, as in pred_StationKeep_lib.h, and return it.
+    """
+    lib.pred_wind_cache_new.argtypes = [ctypes.c_char_p]
+    lib.pred_wind_cache_new.restype = ctypes.c_void_p
+    lib.pred_wind_cache_free.argtypes = [ctypes.c_void_p]
+    lib.pred_wind_cache_free.restype = None
+    lib.pred_run.argtypes = [ctypes.c_void_p, ctypes.c_float, ctypes.c_float,
+                             ctypes.c_float, ctypes.c_long, ctypes.c_float,
+                             ctypes.c_int, ctypes.POINTER(ctypes.POINTER(ctypes.c_double)),
+                             ctypes.POINTER(ctypes.c_uint)]
+    lib.pred_run.restype = ctypes.c_int
+    lib.pred_get_wind.argtypes = [ctypes.c_void_p, ctypes.c_float, ctypes.c_float,
+                                  ctypes.c_float, ctypes.c_long,
+                                  ctypes.POINTER(ctypes.c_float),
+                                  ctypes.POINTER(ctypes.c_float),
+                                  ctypes.POINTER(ctypes.c_float)]
+    lib.pred_get_wind.restype = ctypes.c_int
+    lib.pred_track_free.argtypes = [ctypes.POINTER(ctypes.c_double)]
+    lib.pred_track_free.restype = None
+    lib.pred_position_columns.argtypes = []
+    lib.pred_position_columns.restype = ctypes.c_int
+
+    if lib.pred_position_columns() != len(TRACK_COLUMNS):
+        raise PredictorError('The predictor library writes %i columns, not %i.' % \
+            (lib.pred_position_columns(), len(TRACK_COLUMNS)))
+    return lib
+
+class WindCache(object):
+    """
+    The wind files in directory, as the predictor's -i option finds them,
+    ready for any number of runs.
+    """
+
+    def __init__(self, directory):
+        self.lib = load_library()
+        if self.lib is None:
+            raise PredictorError('The predictor library has not been built.')
+        self.directory = directory
+        with lock:
+            self.cache = self.lib.pred_wind_cache_new(os.fsencode(directory))
+        if not self.cache:
+            raise PredictorError('Could not read the wind files in %s.' % directory)
+
+    def run(self, lat, lon, alt, timestamp, wind_error=0., verbose=0):
+        """
+        Run the model for a launch at lat and lon in degrees and alt metres
+        above sea level at the POSIX time timestamp, with an RMS wind error
+        of wind_error m/s. Returns whether it ran to the end, as the
+        predictor's exit code would say, and the flight path so far as an
+        array with the TRACK_COLUMNS.
+        """
+        track = ctypes.POINTER(ctypes.c_double)()
+        n_positions = ctypes.c_uint()
+        with lock:
+            if not self.cache:
+                raise PredictorError('Wind cache for %s already closed.' % self.directory)
+            ok = self.lib.pred_run(self.cache, lat, lon, alt, int(timestamp), wind_error,
+                                   verbose, ctypes.byref(track), ctypes.byref(n_positions))
+        try:
+            shape = (n_positions.value, len(TRACK_COLUMNS))
+            if n_positions.value:
+                positions = numpy.ctypeslib.as_array(track, shape=shape).copy()
+            else:
+                positions = numpy.zeros(shape)
+        finally:
+            self.lib.pred_track_free(track)
+        return bool(ok), positions
+
+    def wind(self, lat, lon, alt, timestamp):
+        """
+        Return the wind the model would find at lat and lon in degrees and
+        alt metres above sea level at the POSIX time timestamp, as
+        (u, v, variance) in m/s and (m/s)^2, or None if there are no winds
+        there. wind_field gives the same for many points at once.
+        """
+        u, v, variance = ctypes.c_float(), ctypes.c_float(), ctypes.c_float()
+        with lock:
+            if not self.cache:
+                raise PredictorError('Wind cache for %s already closed.' % self.directory)
+            found = self.lib.pred_get_wind(self.cache, lat, lon, alt, int(timestamp),
+                                           ctypes.byref(u), ctypes.byref(v),
+                                           ctypes.byref(variance))
+        if not found:
+            return None
+        return u.value, v.value, variance.value
+
+    def close(self):
+        with lock:
+            if self.cache:
+                self.lib.pred_wind_cache_free(self.cache)
+                self.cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, 'cache', None):
+            self.close()
+
+def write_track(f, track):
+    """
+    Write track, as WindCache.run returns it, to the text file f as the
+    predictor writes its CSV output.
+    """
+    for position in track:
+        f.write(TRACK_FORMAT % tuple(position))
@@ -0,0 +1,12 @@
+"""
+The tests import predict.py and the modules beside it from the top of the
+tree, as the benchmarks do. Run them from there with
+
+    $ python -m pytest tests
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,108 @@
+"""
+Tests for splitting a wind download into requests and memory-bounded batches:
+index_runs, batch_times and stream_time_steps.
+"""
+
+import numpy
+import pydap.model
+
+import predict
+
+SHAPE = (8, 3, 4, 8)
+
+def grid(name, shape=SHAPE):
+    """
+    Return a (time, lev, lat, lon) grid whose values count up from 0.
+    """
+    grid = pydap.model.GridType(name)
+    data = numpy.arange(numpy.prod(shape), dtype='f4').reshape(shape)
+    grid[name] = pydap.model.BaseType(name, data,
+                                      dimensions=('time', 'lev', 'lat', 'lon'))
+    for axis, length in zip(('time', 'lev', 'lat', 'lon'), shape):
+        grid[axis] = pydap.model.BaseType(axis, numpy.arange(length, dtype='f8'),
+                                          dimensions=(axis,))
+    return grid
+
+class RecordingGrid(object):
+    """
+    Wraps a grid, recording the time indices of every request made of it.
+    """
+
+    def __init__(self, grid, requests):
+        self.grid = grid
+        self.requests = requests
+
+    def __getitem__(self, key):
+        self.requests.append((key[0].start, key[0].stop))
+        return self.grid[key]
+
+def dataset(requests=None):
+    if requests is None:
+        requests = []
+    return dict((var, RecordingGrid(grid(var), requests))
+                for var in predict.WIND_VARIABLES)
+
+def test_index_runs():
+    assert predict.index_runs([]) == []
+    assert predict.index_runs([3]) == [(3, 4)]
+    assert predict.index_runs([5, 3, 4, 8]) == [(3, 6), (8, 9)]
+
+def test_index_runs_across_the_seam():
+    # A window around 0 degrees takes the first and last longitudes.
+    assert predict.index_runs([0, 1, 2, 717, 718, 719]) == [(0, 3), (717, 720)]
+
+def test_batch_times_without_a_budget():
+    times = [(index, index * 10800) for index in range(10)]
+    assert predict.batch_times(times, 1000, 0) == [times]
+
+def test_batch_times_keeps_to_the_budget():
+    times = [(index, index * 10800) for index in range(3, 17)]
+    batches = predict.batch_times(times, 1000, 4500)
+    assert [step for batch in batches for step in batch] == times
+    for batch in batches:
+        assert 0 < len(batch) * 1000 <= 4500
+
+def test_batch_times_takes_a_step_over_budget():
+    times = [(index, index * 10800) for index in range(4)]
+    assert predict.batch_times(times, 1000, 10) == [[step] for step in times]
+
+def test_batch_times_keeps_chunks_whole():
+    times = [(index, index * 10800) for index in range(1, 20)]
+    batches = predict.batch_times(times, 1000, 7000, time_chunk=3)
+    assert [step for batch in batches for step in batch] == times
+    for batch in batches:
+        assert len(batch) * 1000 <= 7000
+        # Each batch starts and ends on a chunk boundary, unless it is the
+        # first or last.
+        if batch is not batches[0]:
+            assert batch[0][0] % 3 == 0
+        if batch is not batches[-1]:
+            assert (batch[-1][0] + 1) % 3 == 0
+
+def test_stream_time_steps_across_the_seam():
+    times = [(index, index * 10800) for index in range(1, 7)]
+    batches = predict.batch_times(times, 1000, 2000)
+    window_slices = (slice(0, None), slice(1, 3), [slice(6, 8), slice(0, 2)])
+    expected = grid('hgtprs').array.data[:, :, 1:3, [6, 7, 0, 1]]
+
+    steps = list(predict.stream_time_steps(dataset(), batches, window_slices,
+                                           workers=2))
+    assert [(timeidx, timestamp) for timeidx, timestamp, data in steps] == times
+    for timeidx, timestamp, data in steps:
+        assert sorted(data) == sorted(predict.WIND_VARIABLES)
+        numpy.testing.assert_array_equal(
+            numpy.asarray(data['hgtprs'].array.data), expected[timeidx])
+
+def test_stream_time_steps_fetches_a_batch_at_a_time():
+    times = [(index, index * 10800) for index in range(0, 6)]
+    batches = predict.batch_times(times, 1000, 2000)
+    requests = []
+    steps = predict.stream_time_steps(dataset(requests), batches,
+                                      (slice(0, None), slice(0, 4), [slice(0, 8)]),
+                                      workers=1)
+    for batch in batches:
+        for step in batch:
+            timeidx, timestamp, data = next(steps)
+            # Nothing past the batch being yielded has been requested.
+            assert max(stop for start, stop in requests) == batch[-1][0] + 1
+    assert len(requests) == len(predict.WIND_VARIABLES) * len(batches)
@@ -0,0 +1,100 @@
+"""
+Tests for the ensemble mode's scenario perturbation and time window.
+"""
+
+import configparser
+
+import numpy
+
+import predict
+
+SCENARIO = """\
+[launch-site]
+latitude = 52.2135
+altitude = 0
+longitude = 359.9
+[atmosphere]
+wind-error = 0
+[altitude-model]
+ascent-rate = 5
+descent-rate  = 5
+burst-altitude = 30000
+[launch-time]
+hour = 12
+month = 6
+second = 0
+year = 2024
+day = 1
+minute = 0
+[predictor]
+lat-delta = 3
+time-delta = 12
+lon-delta = 3
+software = gfs
+"""
+
+def scenario():
+    scenario = configparser.ConfigParser()
+    scenario.read_string(SCENARIO)
+    return scenario
+
+def members(n=50, seed=0):
+    rng = numpy.random.RandomState(seed)
+    return [predict.perturb_scenario(scenario(), rng) for member in range(n)]
+
+def test_perturb_scenario_is_repeatable():
+    first = [{section: dict(member[section]) for section in member.sections()}
+             for member in members(seed=1)]
+    second = [{section: dict(member[section]) for section in member.sections()}
+              for member in members(seed=1)]
+    assert first == second
+
+def test_perturb_scenario_varies_what_the_predictor_reads():
+    original = scenario()
+    perturbed = members()
+    for key in ('latitude', 'longitude', 'altitude'):
+        values = set(member['launch-site'][key] for member in perturbed)
+        assert len(values) > 1, key
+    assert len(set(member['launch-time']['minute'] for member in perturbed)) > 1
+
+    for member in perturbed:
+        assert -90 <= member.getfloat('launch-site', 'latitude') <= 90
+        # The launch is just west of the seam, and stays in [0, 360).
+        assert 0 <= member.getfloat('launch-site', 'longitude') < 360
+        assert member.getfloat('launch-site', 'altitude') >= 0
+        assert member.getfloat('atmosphere', 'wind-error') == predict.ENSEMBLE_WIND_ERROR
+        # The altitude model is left as it was.
+        assert dict(member['altitude-model']) == dict(original['altitude-model'])
+
+def test_perturb_scenario_keeps_larger_wind_error():
+    original = scenario()
+    original['atmosphere']['wind-error'] = '5'
+    member = predict.perturb_scenario(original, numpy.random.RandomState(0))
+    assert member.getfloat('atmosphere', 'wind-error') == 5
+
+def test_time_window_follows_time_delta():
+    assert predict.scenario_time_window(scenario()) == (0, 12)
+
+def test_time_window_without_time_delta():
+    original = scenario()
+    original.remove_option('predictor', 'time-delta')
+    assert predict.scenario_time_window(original) == (0, predict.DEFAULT_FUTURE)
+
+def test_time_window_covers_the_climb():
+    original = scenario()
+    original['predictor']['time-delta'] = '1'
+    climb = predict.STATION_KEEP_CEILING / predict.STATION_KEEP_ASCENT_RATE
+    past, future = predict.scenario_time_window(original)
+    assert future * 3600 >= climb + predict.FLIGHT_TIME_MARGIN
+
+def test_time_window_allows_for_the_ensemble():
+    past, future = predict.scenario_time_window(scenario(), ensemble=10)
+    spread = 4 * predict.ENSEMBLE_SPREAD['launch-time']
+    assert past * 3600 >= spread
+    assert future * 3600 >= 12 * 3600 + spread
+
+def test_time_window_of_unreadable_scenario():
+    original = scenario()
+    original['predictor']['time-delta'] = 'soon'
+    assert predict.scenario_time_window(original) == \
+        (predict.DEFAULT_PAST, predict.DEFAULT_FUTURE)
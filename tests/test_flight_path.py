@@ -0,0 +1,101 @@
+"""
+Tests for the compact forms of the flight path: simplify_track and
+write_flight_path_summary.
+"""
+
+import gzip
+import math
+import os
+
+import numpy
+import simplejson as json
+
+import predict
+
+KM_PER_DEGREE = 2 * math.pi * 6371.009 / 360
+
+def wandering_track(n=2000, seed=0):
+    """
+    Return the latitudes and longitudes of a track wandering east from just
+    west of the antimeridian, across it given 2000 points, doubling back on
+    itself now and then.
+    """
+    rng = numpy.random.RandomState(seed)
+    lat = 52 + numpy.cumsum(rng.normal(0, 0.0002, n))
+    lon = (179.9 + numpy.cumsum(rng.normal(0.0001, 0.0003, n))) % 360
+    return lat, lon
+
+def plane(lat, lon):
+    """
+    Return the track flattened onto the plane simplify_track uses, in km.
+    """
+    x = (lon - lon[0] + 180) % 360 - 180
+    x = x * KM_PER_DEGREE * math.cos(math.radians(lat.mean()))
+    return x, (lat - lat[0]) * KM_PER_DEGREE
+
+def distance_to_segment(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    along = numpy.clip(((px - ax) * dx + (py - ay) * dy) / max(dx * dx + dy * dy, 1e-12), 0, 1)
+    return numpy.hypot(px - ax - along * dx, py - ay - along * dy)
+
+def test_straight_track_keeps_its_ends():
+    lat = numpy.linspace(50, 51, 100)
+    lon = numpy.linspace(359.5, 360.5, 100) % 360
+    keep = predict.simplify_track(lat, lon, 0.05)
+    assert numpy.flatnonzero(keep).tolist() == [0, 99]
+
+def test_track_doubling_back_keeps_its_turn():
+    # Out and back along the same line: every point is on the line through
+    # the ends, but the turn is 10 km from the segment joining them.
+    lat = numpy.full(21, 52.0)
+    lon = numpy.concatenate([numpy.linspace(0, 0.15, 11), numpy.linspace(0.14, 0.01, 10)])
+    keep = predict.simplify_track(lat, lon, 0.05)
+    assert keep[10]
+
+def test_simplified_track_is_within_tolerance():
+    lat, lon = wandering_track()
+    tolerance = 0.05
+    keep = predict.simplify_track(lat, lon, tolerance)
+    kept = numpy.flatnonzero(keep)
+    assert kept[0] == 0 and kept[-1] == len(lat) - 1
+    assert 2 < len(kept) < len(lat) / 2
+
+    x, y = plane(lat, lon)
+    for first, last in zip(kept[:-1], kept[1:]):
+        between = slice(first + 1, last)
+        distances = distance_to_segment(x[between], y[between],
+                                        x[first], y[first], x[last], y[last])
+        assert (distances <= tolerance).all()
+
+def test_write_flight_path_summary(tmp_path):
+    lat, lon = wandering_track(500)
+    time = 1792108800 + 10 * numpy.arange(len(lat))
+    alt = 30000 * numpy.sin(numpy.linspace(0, math.pi, len(lat)))
+    track = numpy.stack([time, lat, lon, alt], axis=1)
+    burst = int(alt.argmax())
+
+    predict.write_flight_path_summary(str(tmp_path), track.copy())
+
+    with open(os.path.join(str(tmp_path), 'flight_path_summary.json')) as f:
+        summary = json.load(f)
+    assert summary['positions'] == len(track)
+    assert summary['tolerance_km'] == predict.SIMPLIFIED_TRACK_TOLERANCE
+    for name, i in (('launch', 0), ('burst', burst), ('landing', len(track) - 1)):
+        assert summary[name] == [int(time[i]), lat[i], lon[i], alt[i]]
+        assert summary[name] in summary['points']
+    assert len(summary['points']) < len(track)
+    assert [point[0] for point in summary['points']] == \
+        sorted(point[0] for point in summary['points'])
+
+    with gzip.open(os.path.join(str(tmp_path), 'flight_path.geojson.gz')) as f:
+        geojson = json.loads(f.read().decode('utf-8'))
+    line = geojson['features'][0]
+    assert line['properties']['times'] == time.tolist()
+    coordinates = numpy.array(line['geometry']['coordinates'])
+    # Longitude, latitude and altitude, with longitudes in [-180, 180).
+    assert ((coordinates[:, 0] >= -180) & (coordinates[:, 0] < 180)).all()
+    numpy.testing.assert_allclose(coordinates[:, 0] % 360, lon)
+    numpy.testing.assert_allclose(coordinates[:, 1:], numpy.stack([lat, alt], axis=1))
+    assert [(feature['properties']['event'], feature['properties']['time'])
+            for feature in geojson['features'][1:]] == \
+        [('launch', time[0]), ('burst', time[burst]), ('landing', time[-1])]
@@ -0,0 +1,41 @@
+"""
+Tests for evicting entries from the GFS cache with prune_gfs_cache.
+"""
+
+import os
+import time
+
+import predict
+
+def write_entry(cache_dir, cycle, window_id, size, age):
+    entry = os.path.join(cache_dir, cycle, window_id)
+    os.makedirs(entry)
+    with open(os.path.join(entry, 'gfs_1.bin'), 'wb') as f:
+        f.write(b'\0' * size)
+    used = time.time() - age
+    os.utime(entry, (used, used))
+    return entry
+
+def test_prune_missing_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'GFS_CACHE_DIR', str(tmp_path / 'cache'))
+    predict.prune_gfs_cache(0)
+    assert not os.path.exists(predict.GFS_CACHE_DIR)
+
+def test_prune_empty_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'GFS_CACHE_DIR', str(tmp_path))
+    predict.prune_gfs_cache(0)
+    assert os.listdir(str(tmp_path)) == []
+
+def test_prune_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'GFS_CACHE_DIR', str(tmp_path))
+    age = predict.GFS_CACHE_MIN_AGE + 100
+    oldest = write_entry(str(tmp_path), 'gfs20240101_gfs_0p50_00z', 'a', 1000, age + 20)
+    older = write_entry(str(tmp_path), 'gfs20240101_gfs_0p50_06z', 'a', 1000, age + 10)
+    kept = write_entry(str(tmp_path), 'gfs20240101_gfs_0p50_06z', 'b', 1000, age)
+    recent = write_entry(str(tmp_path), 'gfs20240101_gfs_0p50_12z', 'a', 1000, 0)
+
+    predict.prune_gfs_cache(1500, keep=kept)
+    assert [os.path.exists(entry) for entry in (oldest, older, kept, recent)] == \
+        [False, False, True, True]
+    # The cycle whose only entry went is tidied away too.
+    assert not os.path.exists(os.path.dirname(oldest))
@@ -0,0 +1,83 @@
+"""
+Tests for the job registry: claim_job, finish_job and job_is_active, and for
+the worker daemon's queue.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import simplejson as json
+
+import predict
+
+def dead_pid():
+    """
+    Return the process ID of a process which has exited.
+    """
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def write_lock(uuid_path, state, pid):
+    with open(os.path.join(uuid_path, predict.JOB_LOCK_FILE), 'w') as f:
+        f.write(json.dumps({'state': state, 'pid': pid, 'since': int(time.time())}))
+
+def test_claim_unclaimed_job(tmp_path):
+    uuid_path = str(tmp_path)
+    assert predict.claim_job(uuid_path)
+    entry = predict.read_job(uuid_path)
+    assert entry['state'] == 'running'
+    assert entry['pid'] == os.getpid()
+    # Only the lock itself is left behind.
+    assert os.listdir(uuid_path) == [predict.JOB_LOCK_FILE]
+
+def test_claim_running_job(tmp_path):
+    uuid_path = str(tmp_path)
+    assert predict.claim_job(uuid_path)
+    assert not predict.claim_job(uuid_path)
+    assert os.listdir(uuid_path) == [predict.JOB_LOCK_FILE]
+
+def test_claim_job_whose_process_died(tmp_path):
+    uuid_path = str(tmp_path)
+    write_lock(uuid_path, 'running', dead_pid())
+    assert predict.claim_job(uuid_path)
+    assert predict.read_job(uuid_path)['pid'] == os.getpid()
+    assert os.listdir(uuid_path) == [predict.JOB_LOCK_FILE]
+
+def test_claim_finished_job(tmp_path):
+    uuid_path = str(tmp_path)
+    assert predict.claim_job(uuid_path)
+    predict.finish_job(uuid_path, 'done')
+    assert predict.read_job(uuid_path)['state'] == 'done'
+    assert predict.claim_job(uuid_path)
+    assert predict.read_job(uuid_path)['state'] == 'running'
+
+def test_job_is_active():
+    assert not predict.job_is_active(None)
+    assert predict.job_is_active({'state': 'running', 'pid': os.getpid()})
+    assert not predict.job_is_active({'state': 'done', 'pid': os.getpid()})
+    assert not predict.job_is_active({'state': 'error', 'pid': os.getpid()})
+    assert not predict.job_is_active({'state': 'running', 'pid': dead_pid()})
+
+def test_read_job_ignores_damaged_lock(tmp_path):
+    uuid_path = str(tmp_path)
+    with open(os.path.join(uuid_path, predict.JOB_LOCK_FILE), 'w') as f:
+        f.write('{"state": "runn')
+    assert predict.read_job(uuid_path) is None
+    assert predict.claim_job(uuid_path)
+
+def test_queued_uuids(tmp_path):
+    queue_path = str(tmp_path)
+    older, newer = 'a' * 40, '0123456789abcdef' * 2 + '01234567'
+    for uuid, mtime in ((newer, 2000000), (older, 1000000)):
+        open(os.path.join(queue_path, uuid), 'w').close()
+        os.utime(os.path.join(queue_path, uuid), (mtime, mtime))
+    # The daemon's own working directory, a UUID still being written and
+    # anything else which is not a SHA1 hash are all left alone.
+    os.mkdir(os.path.join(queue_path, 'working'))
+    os.mkdir(os.path.join(queue_path, 'b' * 40))
+    for name in ('.' + 'c' * 40, 'A' * 40, 'd' * 39, 'README'):
+        open(os.path.join(queue_path, name), 'w').close()
+    assert predict.queued_uuids(queue_path) == [older, newer]
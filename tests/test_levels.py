@@ -0,0 +1,35 @@
+"""
+Tests for choosing the GFS pressure levels a flight needs.
+"""
+
+import predict
+
+# The pressure levels of the 0.5 degree GFS, in hPa, from the surface up.
+GFS_LEVELS = [1000, 975, 950, 925, 900, 850, 800, 750, 700, 650, 600, 550,
+              500, 450, 400, 350, 300, 250, 200, 150, 100, 70, 50, 40, 30, 20,
+              15, 10, 7, 5, 3, 2, 1, 0.7, 0.4, 0.2, 0.1, 0.07, 0.04, 0.02,
+              0.01]
+
+def test_standard_pressure():
+    assert abs(predict.standard_pressure(0) - 1013.25) < 0.01
+    assert abs(predict.standard_pressure(11000) - 226.32) < 0.1
+    assert abs(predict.standard_pressure(20000) - 54.75) < 0.1
+    assert abs(predict.standard_pressure(32000) - 8.68) < 0.01
+
+def test_all_levels_without_a_ceiling():
+    assert predict.levels_needed(GFS_LEVELS, None) == len(GFS_LEVELS)
+    assert predict.levels_needed(GFS_LEVELS, 0) == len(GFS_LEVELS)
+
+def test_levels_cover_the_ceiling_and_margin():
+    for altitude in (1000, 10000, 20000, 30000):
+        count = predict.levels_needed(GFS_LEVELS, altitude)
+        pressure = predict.standard_pressure(altitude + predict.PRESSURE_LEVEL_MARGIN)
+        # The top level is above the margin, and the one below it is not.
+        assert GFS_LEVELS[count - 1] < pressure
+        assert GFS_LEVELS[count - 2] >= pressure
+
+def test_station_keep_ceiling_covers_the_burst():
+    # pred_StationKeep's balloon bursts at about 33.5km.
+    count = predict.levels_needed(GFS_LEVELS, predict.STATION_KEEP_CEILING)
+    assert GFS_LEVELS[count - 1] < predict.standard_pressure(33500)
+    assert count < len(GFS_LEVELS)
@@ -0,0 +1,81 @@
+"""
+Tests for the progress.json writer: open_progress, update_progress and
+close_progress.
+"""
+
+import os
+
+import pytest
+import simplejson as json
+
+import predict
+
+class Clock(object):
+    """
+    Stands in for time.time, only moving on when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000000.
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def progress(tmp_path, monkeypatch):
+    """
+    Open progress.json in tmp_path, held back for 10 seconds at a time, and
+    return a function reading it back.
+    """
+    clock = Clock()
+    monkeypatch.setattr(predict.timelib, 'time', clock)
+    filename = str(tmp_path / 'progress.json')
+    predict.open_progress(filename, min_interval=10)
+
+    def read():
+        with open(filename) as f:
+            return json.load(f)
+    read.clock = clock
+    yield read
+    predict.close_progress()
+    # Only progress.json itself, with no temporary files left behind.
+    assert os.listdir(str(tmp_path)) == ['progress.json']
+
+def test_open_progress_writes_the_defaults(progress):
+    assert progress() == predict.PROGRESS_DEFAULTS
+
+def test_coalesced_updates_are_held_back(progress):
+    progress.clock.now += 1
+    predict.update_progress(gfs_percent=10, gfs_timeremaining='1 minute')
+    predict.update_progress(gfs_percent=20)
+    assert progress()['gfs_percent'] == 0
+
+    # Once min_interval has passed the next update is written.
+    progress.clock.now += 10
+    predict.update_progress(gfs_percent=30)
+    assert progress()['gfs_percent'] == 30
+    assert progress()['gfs_timeremaining'] == '1 minute'
+
+def test_other_updates_flush_those_held_back(progress):
+    progress.clock.now += 1
+    predict.update_progress(gfs_percent=50)
+    predict.update_progress(gfs_complete=True, gfs_percent=100)
+    written = progress()
+    assert written['gfs_complete'] is True
+    assert written['gfs_percent'] == 100
+
+    progress.clock.now += 1
+    predict.update_progress(pred_percent=40)
+    predict.update_progress(pred_running=True)
+    assert progress()['pred_percent'] == 40
+
+def test_close_progress_writes_those_held_back(progress):
+    progress.clock.now += 1
+    predict.update_progress(pred_percent=99)
+    assert progress()['pred_percent'] == 0
+    predict.close_progress()
+    assert progress()['pred_percent'] == 99
+    assert not predict.progress_open()
+    # Nothing is written once closed.
+    predict.update_progress(pred_percent=100)
+    assert progress()['pred_percent'] == 99
@@ -0,0 +1,21 @@
+"""
+Tests that predict.py imports quickly, leaving its slow dependencies to be
+imported when they are first used; see benchmarks/startup.py.
+"""
+
+import statistics
+
+from benchmarks import startup
+
+# Imported by predict.py only when they are first used.
+LAZY_MODULES = ('simplejson', 'requests', 'numpy', 'predictor', 'statsd',
+                'pydap.client')
+
+def test_slow_modules_are_not_imported():
+    times = startup.import_times()
+    for name in LAZY_MODULES:
+        assert name not in times, name
+
+def test_import_is_within_budget():
+    runs = [startup.import_times() for run in range(3)]
+    assert statistics.median(times['predict'] for times in runs) / 1000. <= startup.BUDGET
@@ -0,0 +1,120 @@
+"""
+Tests for wind_field, checked against the predictor's own wind lookup on a
+small set of wind files.
+"""
+
+import math
+import struct
+
+import numpy
+import pytest
+
+import predict
+import predictor
+import wind_field
+
+# A window across the 0/360 degree seam, written as predict.py writes one:
+# the longitudes in index order, so those just east of the seam come first.
+WINDOW = (52.0, 4.0, 359.0, 4.0)
+PRESSURES = [1000, 925, 850, 700, 500, 300, 200, 100, 50, 20, 10]
+LATITUDES = numpy.arange(48, 56.5, 0.5)
+LONGITUDES = numpy.concatenate([numpy.arange(0, 3.5, 0.5), numpy.arange(355, 360, 0.5)])
+TIMESTAMPS = [1792108800 + 3 * 3600 * i for i in range(3)]
+
+def wind_grid(rng, step):
+    """
+    Return a (pressure, latitude, longitude, component) grid of made up but
+    plausible winds.
+
+    The heights are all in order and the winds all sane. Where they are
+    not, the predictor can keep the levels it found for the last point, or
+    in the other wind file, while they still bracket the next point, so its
+    winds depend on what it was asked before.
+    """
+    pressure = numpy.array(PRESSURES, dtype=float)[:, None, None]
+    lat = LATITUDES[None, :, None]
+    lon = numpy.radians(LONGITUDES)[None, None, :]
+    shape = (len(PRESSURES), len(LATITUDES), len(LONGITUDES))
+
+    height = -7000 * numpy.log(pressure / 1013.25) + \
+        50 * numpy.sin(lat / 3 + step) + 30 * numpy.cos(3 * lon) + \
+        rng.normal(0, 5, shape)
+    u = 20 * numpy.sin(lat / 5 + lon * 4 + step) * numpy.log(1100 / pressure) + \
+        rng.normal(0, 2, shape)
+    v = 15 * numpy.cos(lat / 4 - lon * 3 + step) + rng.normal(0, 2, shape)
+    temperature = 288 - 6.5 * numpy.minimum(height, 11000) / 1000 + 0 * lon
+    vvel = rng.normal(0, 0.1, shape)
+    return numpy.stack([height, u, v, temperature, vvel], axis=-1).astype('<f4')
+
+def write_wind_file(path, timestamp, grid):
+    axes = (PRESSURES, LATITUDES, LONGITUDES)
+    with open(path, 'wb') as f:
+        f.write(predict.WIND_FILE_BINARY_HEADER.pack(predict.WIND_FILE_BINARY_MAGIC,
+                predict.WIND_FILE_BINARY_VERSION, len(axes), len(wind_field.COMPONENTS),
+                0, WINDOW[0], WINDOW[1], WINDOW[2], WINDOW[3], timestamp))
+        f.write(struct.pack('<%iI' % len(axes), *map(len, axes)))
+        for axis in axes:
+            f.write(numpy.asarray(axis, dtype='<f4').tobytes())
+        f.write(grid.tobytes())
+
+@pytest.fixture
+def wind_dir(tmp_path):
+    rng = numpy.random.RandomState(22)
+    for step, timestamp in enumerate(TIMESTAMPS):
+        name = predict.wind_file_name(
+            'gfs_%(time)_%(lat)_%(lon)_%(latdelta)_%(londelta).bin', timestamp, WINDOW)
+        write_wind_file(str(tmp_path / name), timestamp, wind_grid(rng, step))
+    return str(tmp_path)
+
+def points(n=3000):
+    """
+    Return n points in and around the window and times of the wind files,
+    as single precision values, as the predictor has them.
+    """
+    rng = numpy.random.RandomState(1)
+    lat = rng.uniform(47, 57, n)
+    lon = rng.uniform(-6, 5, n) % 360
+    alt = rng.uniform(-500, 33000, n)
+    on_grid = rng.rand(n) < 0.3
+    time = numpy.where(on_grid, numpy.array(TIMESTAMPS)[rng.randint(0, 3, n)],
+                       rng.uniform(TIMESTAMPS[0] - 3600, TIMESTAMPS[-1] + 3600, n))
+    return [x.astype(numpy.float32).astype(float) for x in (lat, lon, alt)] + \
+        [time.astype(numpy.int64)]
+
+def test_from_directory(wind_dir):
+    field = wind_field.WindField.from_directory(wind_dir)
+    assert list(field.timestamps) == TIMESTAMPS
+    assert field.window == WINDOW
+    numpy.testing.assert_array_equal(field.longitudes, LONGITUDES)
+
+def test_points_outside_are_nan(wind_dir):
+    field = wind_field.WindField.from_directory(wind_dir)
+    winds = field.query([52, 60, 52, 52], [359, 359, 10, 359], [5000] * 4,
+                        [TIMESTAMPS[0] + 60, TIMESTAMPS[0], TIMESTAMPS[0],
+                         TIMESTAMPS[-1] + 60])
+    assert numpy.isfinite(winds['u'][0])
+    assert numpy.isnan(winds['u'][1:]).all()
+
+@pytest.mark.skipif(not predictor.available(),
+                    reason='the predictor library has not been built')
+def test_query_matches_predictor(wind_dir):
+    field = wind_field.WindField.from_directory(wind_dir)
+    lat, lon, alt, time = points()
+    winds = field.query(lat, lon, alt, time)
+
+    with predictor.WindCache(wind_dir) as cache:
+        expected = numpy.array([cache.wind(*point) or (math.nan,) * 3
+                                for point in zip(lat, lon, alt, time)])
+
+    found = numpy.isfinite(expected[:, 0])
+    # Some of the points are outside the window and times, most are not.
+    assert 0.2 < found.mean() < 0.95
+    numpy.testing.assert_array_equal(numpy.isfinite(winds['u']), found)
+    # Off the bottom or top of the data the predictor's variance, unlike
+    # its winds, depends on which levels it found for the last point.
+    inside = found & (alt > 500) & (alt < 32000)
+    for column, name, which in ((0, 'u', found), (1, 'v', found),
+                                (2, 'variance', inside)):
+        scale = numpy.abs(expected[which, column]).max()
+        numpy.testing.assert_allclose(winds[name][which], expected[which, column],
+                                      rtol=1e-4, atol=1e-4 * scale, err_msg=name)
@@ -0,0 +1,542 @@
+#!/usr/bin/env python
+
+"""
+Query the winds in a directory of GFS wind files, or in the grids predict.py
+has just downloaded, from Python rather than through the predictor.
+
+The winds are interpolated just as wind_file_get_wind() and get_wind() in
+pred_src do it, but for many points at once with NumPy:
+
+    import wind_field
+    field = wind_field.WindField.from_directory('gfs/cache/<cycle>/<window>')
+    winds = field.query(lats, lons, altitudes, timestamps)
+    winds['u'], winds['v']
+
+For each point the pressure level either side of its altitude is found by
+interpolating the geopotential heights of the surrounding grid cell, the
+five variables are interpolated bilinearly in latitude and longitude on
+both levels and linearly in altitude between them, and the results from the
+wind files either side of its time are interpolated linearly in time.
+Points the predictor would have no winds for come back as NaN.
+
+Where the heights in a grid cell are out of order or its winds insane, and
+above and below the data, the predictor keeps the levels it found for the
+point before while they still bracket the next, so its answer depends on
+what it was asked before; the answer here is the one it gives when asked
+afresh. A million points take about 1.2 seconds on one core of a slow
+machine, or 0.85 seconds when half of them are outside the window.
+"""
+
+import os
+import math
+import struct
+
+import numpy
+
+# Binary wind file header; see pred_src/wind/wind_file_binary.h. As in
+# predict.py.
+WIND_FILE_BINARY_MAGIC = b'CUSFWIND'
+WIND_FILE_BINARY_HEADER = struct.Struct('<8sIIIIffffq')
+
+# Components of each record in a wind file, in order.
+COMPONENTS = ('height', 'u', 'v', 'temperature', 'vvel')
+HEIGHT, U, V, TEMPERATURE, VVEL = range(len(COMPONENTS))
+
+# Levels whose wind has a component at least this large, in m/s, are taken
+# to be bad data and skipped when looking for the levels around a point.
+MAX_SANE_WIND = 500.
+
+# Points are interpolated this many at a time, which keeps the working
+# arrays for even a very large query to a few tens of megabytes.
+QUERY_BATCH_SIZE = 65536
+
+# The heights of the pressure levels are tabulated in steps of this many
+# metres; see LevelBracket.
+LEVEL_BRACKET_STEP = 100.
+
+class WindField(object):
+    """
+    The winds over one download window at a series of times.
+
+    window is (lat, latdelta, lon, londelta) as in the wind file headers;
+    pressures, latitudes and longitudes are the axes of every grid;
+    timestamps are the POSIX times of the grids, and grids the matching
+    (pressure, latitude, longitude, component) arrays of the COMPONENTS, as
+    stack_wind_block in predict.py returns them and as the wind files hold
+    them.
+    """
+
+    def __init__(self, window, pressures, latitudes, longitudes, timestamps, grids):
+        self.window = tuple(float(x) for x in window)
+        self.pressures = numpy.asarray(pressures, dtype=numpy.float64)
+        self.latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        self.longitudes = numpy.asarray(longitudes, dtype=numpy.float64) % 360.
+
+        order = numpy.argsort(timestamps, kind='stable')
+        self.timestamps = numpy.asarray(timestamps, dtype=numpy.int64)[order]
+        # Memory maps of binary wind files are used as plain arrays, since
+        # indexing a numpy.memmap is slower.
+        self.grids = [numpy.asarray(grids[i]) for i in order]
+
+        shape = (len(self.pressures), len(self.latitudes), len(self.longitudes),
+                 len(COMPONENTS))
+        for grid in self.grids:
+            if grid.shape != shape:
+                raise ValueError('Grid of shape %s where %s expected.' % \
+                    (grid.shape, shape))
+
+        # The geopotential height columns and which levels have sane winds
+        # are needed for every point, so are laid out per grid cell once.
+        self.columns = [None] * len(self.grids)
+
+    @classmethod
+    def from_directory(cls, directory):
+        """
+        Load every wind file in directory, binary or text, as the predictor
+        would. The files must all cover the same window on the same axes.
+        """
+        files = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                wind_file = read_wind_file(path)
+                if wind_file is not None:
+                    files.append(wind_file)
+        if not files:
+            raise ValueError('No wind files in %s.' % directory)
+
+        window, timestamp, axes, grid = files[0]
+        for other in files[1:]:
+            if other[0] != window or \
+                    any(not numpy.array_equal(a, b) for a, b in zip(other[2], axes)):
+                raise ValueError('Wind files in %s cover different windows.' % directory)
+
+        return cls(window, axes[0], axes[1], axes[2],
+                   [f[1] for f in files], [f[3] for f in files])
+
+    def query(self, lat, lon, alt, time):
+        """
+        Return the winds at the points given by the arrays (or scalars) lat
+        and lon in degrees, alt in metres and time as POSIX timestamps, as
+        a dictionary of arrays:
+
+            u, v: wind components in m/s,
+            variance: the neighbourhood variance of the wind speed, as the
+                predictor uses for its wind error,
+            temperature: in K,
+            vvel: vertical velocity in Pa/s,
+            pressure: in the units of the pressure axis, interpolated
+                geometrically between the levels.
+
+        Every entry is NaN for points outside the window or the times
+        covered.
+        """
+        lat, lon, alt, time = numpy.broadcast_arrays(
+            *[numpy.asarray(x, dtype=numpy.float64) for x in (lat, lon, alt, time)])
+        shape = lat.shape
+        lat, lon, alt, time = [x.ravel() for x in (lat, lon, alt, time)]
+
+        results = dict((name, numpy.full(lat.size, numpy.nan))
+                       for name in ('u', 'v', 'variance', 'temperature', 'vvel',
+                                    'pressure'))
+        for start in range(0, lat.size, QUERY_BATCH_SIZE):
+            batch = slice(start, start + QUERY_BATCH_SIZE)
+            for name, values in self._query_batch(
+                    lat[batch], lon[batch], alt[batch], time[batch]).items():
+                results[name][batch] = values
+
+        return dict((name, values.reshape(shape)) for name, values in results.items())
+
+    def _query_batch(self, lat, lon, alt, time):
+        wlat, wlatdelta, wlon, wlondelta = self.window
+        ok = (numpy.fabs(lat - wlat) <= wlatdelta) & \
+             (longitude_distance(lon, wlon) <= wlondelta)
+
+        # The grids either side of each time; a time on a grid counts as
+        # after it, as in wind_file_cache_find_entry.
+        earlier = numpy.searchsorted(self.timestamps, time, side='right') - 1
+        later = earlier + 1
+        ok &= (earlier >= 0) & (later < len(self.timestamps))
+
+        lat0, lat1, lat_lambda, lat_ok = axis_cells(self.latitudes, lat)
+        lon0, lon1, lon_lambda, lon_ok = longitude_cells(self.longitudes, lon)
+        ok &= lat_ok & lon_ok
+
+        points = numpy.flatnonzero(ok)
+        earlier, later = earlier[points], later[points]
+        nlon = len(self.longitudes)
+        lat0, lat1, lon0, lon1 = lat0[points], lat1[points], lon0[points], lon1[points]
+        corners = (lat0 * nlon + lon0, lat0 * nlon + lon1,
+                   lat1 * nlon + lon0, lat1 * nlon + lon1)
+        weights = cell_weights(lat_lambda[points].astype(numpy.float32),
+                               lon_lambda[points].astype(numpy.float32))
+        # As the predictor, in single precision.
+        alt = alt[points].astype(numpy.float32)
+
+        # In single precision, as the predictor does, which rounds times now
+        # to multiples of 128 seconds.
+        ts = self.timestamps.astype(numpy.float32)
+        time = time[points].astype(numpy.float32)
+        time_lambda = (time - ts[earlier]) / (ts[later] - ts[earlier])
+
+        low = self._sample(earlier, corners, weights, alt)
+        high = self._sample(later, corners, weights, alt)
+
+        results = dict((name, numpy.full(lat.size, numpy.nan))
+                       for name in ('u', 'v', 'variance', 'temperature', 'vvel',
+                                    'pressure'))
+        found = low['found'] & high['found']
+        for name in ('u', 'v', 'temperature', 'vvel', 'pressure'):
+            values = lerp(low[name], high[name], time_lambda)
+            results[name][points[found]] = values[found]
+        variance = 0.5 * (low['uvar'] + high['uvar'] + low['vvar'] + high['vvar'])
+        results['variance'][points[found]] = variance[found]
+        return results
+
+    def _sample(self, grid_indices, corners, weights, alt):
+        """
+        Interpolate in space, as wind_file_get_wind does, each point within
+        the grid given by grid_indices.
+        """
+        n = len(alt)
+        sample = dict((name, numpy.full(n, numpy.nan, dtype=numpy.float32))
+                      for name in ('u', 'v', 'uvar', 'vvar', 'temperature', 'vvel',
+                                   'pressure'))
+        sample['found'] = numpy.zeros(n, dtype=bool)
+
+        # A stable sort of small integers is a radix sort, and much quicker.
+        order = numpy.argsort(grid_indices.astype(numpy.int16)
+                              if len(self.grids) < 2 ** 15 else grid_indices,
+                              kind='stable')
+        bounds = numpy.searchsorted(grid_indices[order],
+                                    numpy.arange(len(self.grids) + 1))
+        for index in range(len(self.grids)):
+            points = order[bounds[index]:bounds[index + 1]]
+            if len(points):
+                found, values = self._sample_grid(index,
+                        [corner[points] for corner in corners],
+                        [weight[points] for weight in weights], alt[points])
+                sample['found'][points] = found
+                for name, value in values.items():
+                    sample[name][points] = value
+        return sample
+
+    def _sample_grid(self, index, corners, weights, alt):
+        lev0, lev1, height0, height1, found = self._levels(index, corners,
+                weights, alt)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            pr_lambda = numpy.where(lev0 != lev1,
+                (alt - height0) / (height1 - height0), numpy.float32(0.5))
+        pr_lambda = numpy.clip(pr_lambda, 0., 1.)[:, None]
+
+        # The records at the four corners of the cell on the level below,
+        # then on the level above.
+        cells = len(self.latitudes) * len(self.longitudes)
+        records = self.grids[index].reshape(-1, len(COMPONENTS)).take(
+            numpy.concatenate([lev * cells + corner
+                               for lev in (lev0, lev1) for corner in corners]),
+            axis=0).reshape(8, len(alt), len(COMPONENTS))
+
+        # Bilinear interpolation, as bilinear() but in one pass with einsum.
+        weights = numpy.stack(weights)
+        low = numpy.einsum('ijk,ij->jk', records[:4], weights)
+        value = low + (numpy.einsum('ijk,ij->jk', records[4:], weights) - low) * pr_lambda
+
+        # The neighbourhood variance over the eight corners of the cell,
+        # summed with einsum, which is several times quicker than mean()
+        # across the records.
+        winds = records[:, :, U:V + 1]
+        mean = numpy.einsum('ijk->jk', winds) * numpy.float32(0.125)
+        variance = numpy.einsum('ijk,ijk->jk', winds, winds) * numpy.float32(0.125) - \
+            mean * mean
+
+        pressure0 = self.pressures[lev0]
+        pressure1 = self.pressures[lev1]
+        values = {
+            'u': value[:, U],
+            'v': value[:, V],
+            'uvar': variance[:, 0],
+            'vvar': variance[:, 1],
+            'temperature': value[:, TEMPERATURE],
+            'vvel': value[:, VVEL],
+            'pressure': pressure0 * (pressure1 / pressure0) ** pr_lambda[:, 0],
+            }
+        return found, values
+
+    def _levels(self, index, corners, weights, alt):
+        """
+        Return the pressure levels below and above each point in the grid at
+        index, their heights there, and whether either was found.
+
+        The level below is the highest whose height, interpolated within the
+        cell, is at or below the point and whose wind is sane at the lower
+        corner of the cell; the level above is the lowest at or above the
+        point whose wind is sane at the upper corner. If there is only one
+        of them, it is used for both.
+        """
+        heights, sane, regular, bracket = self._columns(index)
+        nlev = heights.shape[1]
+        flat_heights = heights.ravel()
+
+        n = len(alt)
+        lev0 = numpy.zeros(n, dtype=numpy.intp)
+        lev1 = numpy.zeros(n, dtype=numpy.intp)
+        has_below = numpy.zeros(n, dtype=bool)
+        has_above = numpy.zeros(n, dtype=bool)
+
+        # Almost always the heights rise with every level and every wind is
+        # sane, and the levels can be found by bisection rather than by
+        # interpolating the height of every level. The bisection starts
+        # from the levels which are below, or above, the point everywhere
+        # in the grid, which leaves only a level or two to look at.
+        fast = regular[corners[0]] & regular[corners[1]] & \
+               regular[corners[2]] & regular[corners[3]]
+        points = numpy.flatnonzero(fast)
+        point_corners = [corner[points] * nlev for corner in corners]
+        point_weights = [weight[points] for weight in weights]
+        point_alt = alt[points]
+        def height_at(level):
+            return bilinear([flat_heights.take(corner + level) for corner in point_corners],
+                            point_weights)
+        lo, hi = bracket(point_alt)
+        for step in range(int((hi - lo).max()).bit_length() if len(points) else 0):
+            searching = lo < hi
+            mid = (lo + hi) // 2
+            below = height_at(numpy.minimum(mid, nlev - 1)) <= point_alt
+            lo = numpy.where(searching & below, mid + 1, lo)
+            hi = numpy.where(searching & ~below, mid, hi)
+        # lo levels are now at or below each point.
+        has_below[points] = lo > 0
+        lev0[points] = numpy.maximum(lo - 1, 0)
+        on_level = has_below[points] & (height_at(lev0[points]) == point_alt)
+        has_above[points] = on_level | (lo < nlev)
+        lev1[points] = numpy.where(on_level, lo - 1, numpy.minimum(lo, nlev - 1))
+
+        # Otherwise every level is looked at, as the predictor does.
+        points = numpy.flatnonzero(~fast)
+        if len(points):
+            height = bilinear([heights[corner[points]] for corner in corners],
+                              [weight[points, None] for weight in weights])
+            point_alt = alt[points, None]
+            below = numpy.where((height <= point_alt) & sane[corners[0][points]],
+                                height, -numpy.inf)[:, ::-1]
+            above = numpy.where((height >= point_alt) & sane[corners[3][points]],
+                                height, numpy.inf)[:, ::-1]
+            # The last level of any with the same height.
+            lev0[points] = nlev - 1 - numpy.argmax(below, axis=1)
+            lev1[points] = nlev - 1 - numpy.argmin(above, axis=1)
+            has_below[points] = numpy.isfinite(below.max(axis=1))
+            has_above[points] = numpy.isfinite(above.min(axis=1))
+
+        # Off the bottom or top of the data, the nearest level is used.
+        lev0 = numpy.where(has_below, lev0, lev1)
+        lev1 = numpy.where(has_above, lev1, lev0)
+        found = has_below | has_above
+        lev0[~found] = lev1[~found] = 0
+
+        corners = [corner * nlev for corner in corners]
+        return lev0, lev1, \
+            bilinear([flat_heights.take(corner + lev0) for corner in corners], weights), \
+            bilinear([flat_heights.take(corner + lev1) for corner in corners], weights), \
+            found
+
+    def _columns(self, index):
+        """
+        Return, for the grid at index, the (cell, level) arrays of
+        geopotential height and of whether the wind is sane, whether the
+        heights in each cell rise with every level and all its winds are
+        sane, and a LevelBracket for those cells.
+        """
+        if self.columns[index] is None:
+            grid = self.grids[index]
+            nlev = len(self.pressures)
+            heights = numpy.ascontiguousarray(grid[..., HEIGHT].reshape(nlev, -1).T)
+            winds = grid[..., U:V + 1].reshape(nlev, -1, 2)
+            sane = numpy.ascontiguousarray(
+                (numpy.fabs(winds) < MAX_SANE_WIND).all(axis=2).T)
+            regular = (numpy.diff(heights, axis=1) > 0).all(axis=1) & sane.all(axis=1)
+            self.columns[index] = (heights, sane, regular,
+                                   LevelBracket(heights[regular]))
+        return self.columns[index]
+
+class LevelBracket(object):
+    """
+    Narrows down how many of a grid's levels are at or below a height, given
+    the (cell, level) heights of its cells whose heights rise with every
+    level.
+
+    Called with an array of heights it returns arrays lo and hi such that,
+    wherever in those cells each height is, between lo and hi of the levels
+    are at or below it. The bounds come from a table of the lowest and
+    highest height of each level, looked up in steps of LEVEL_BRACKET_STEP
+    metres.
+    """
+
+    def __init__(self, heights):
+        nlev = heights.shape[1]
+        if not len(heights):
+            self.bottom, self.bins = 0., 1
+            self.lo = numpy.zeros(1, dtype=numpy.intp)
+            self.hi = numpy.full(1, nlev, dtype=numpy.intp)
+            return
+        lowest = heights.min(axis=0)
+        highest = heights.max(axis=0)
+        self.bottom = math.floor(lowest[0])
+        self.bins = int(math.ceil((highest[-1] - self.bottom) / LEVEL_BRACKET_STEP)) + 1
+        edges = self.bottom + numpy.arange(self.bins + 1) * LEVEL_BRACKET_STEP
+        self.lo = numpy.searchsorted(highest, edges[:-1], side='right')
+        self.hi = numpy.searchsorted(lowest, edges[1:], side='right')
+
+    def __call__(self, heights):
+        # Truncating is flooring once clipped, and much quicker than //.
+        bins = numpy.clip((heights.astype(numpy.float64) - self.bottom) / LEVEL_BRACKET_STEP,
+                          0, self.bins - 1).astype(numpy.intp)
+        return self.lo.take(bins), self.hi.take(bins)
+
+def read_wind_file(path):
+    """
+    Read the wind file at path, binary or text, and return its
+    (window, timestamp, (pressures, latitudes, longitudes), grid), or None if
+    it is not a wind file. Binary files are memory mapped rather than read.
+    """
+    with open(path, 'rb') as f:
+        start = f.read(WIND_FILE_BINARY_HEADER.size)
+    if start.startswith(WIND_FILE_BINARY_MAGIC):
+        return read_binary_wind_file(path)
+    try:
+        return read_text_wind_file(path)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+def read_binary_wind_file(path):
+    with open(path, 'rb') as f:
+        (magic, version, n_axes, n_components, reserved, lat, latdelta, lon, londelta,
+         timestamp) = WIND_FILE_BINARY_HEADER.unpack(f.read(WIND_FILE_BINARY_HEADER.size))
+        lengths = struct.unpack('<%iI' % n_axes, f.read(4 * n_axes))
+        axes = tuple(numpy.fromfile(f, dtype='<f4', count=n) for n in lengths)
+        offset = f.tell()
+    if n_components != len(COMPONENTS):
+        raise ValueError('%s has %s components per record.' % (path, n_components))
+    grid = numpy.memmap(path, dtype='<f4', mode='r', offset=offset,
+                        shape=tuple(lengths) + (n_components,))
+    return (lat, latdelta, lon, londelta), timestamp, axes, grid
+
+def read_text_wind_file(path):
+    with open(path) as f:
+        lines = [line for line in f if not line.startswith('#')]
+    header = lines[0].split(',')
+    window = tuple(float(x) for x in header[:4])
+    timestamp = int(header[4])
+    n_axes = int(lines[1])
+    axes = tuple(numpy.array(lines[3 + 2 * i].split(','), dtype=numpy.float32)
+                 for i in range(n_axes))
+    rest = 2 + 2 * n_axes
+    n_components = int(lines[rest + 1])
+    data = numpy.array(','.join(lines[rest + 2:]).replace('\n', '').split(','),
+                       dtype=numpy.float32)
+    grid = data.reshape(tuple(len(axis) for axis in axes) + (n_components,))
+    # The predictor reads the window into floats, as in the binary header.
+    window = tuple(numpy.float32(x).item() for x in window)
+    return window, timestamp, axes, grid
+
+def axis_cells(axis, values):
+    """
+    Return, for each of values, the indices into axis of the greatest value
+    at or below it and the least value at or above it, how far it is from
+    the first to the second from 0 to 1 (0.5 if they are the same), and
+    whether both exist.
+    """
+    order = numpy.argsort(axis, kind='stable')
+    left, right, ok = ordered_cells(axis[order], values)
+    left, right = order[left], order[right]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        fraction = numpy.where(left == right, 0.5,
+            (values - axis[left]) / (axis[right] - axis[left]))
+    return left, right, numpy.clip(fraction, 0., 1.), ok
+
+def longitude_cells(axis, values):
+    """
+    As axis_cells, for longitudes, where 'below' means less than 180 degrees
+    west, wrapping around the 0/360 degree seam.
+    """
+    # Measured eastwards from the longitude east of the widest gap between
+    # them, the longitudes of any window are in order and, for a window
+    # across the seam as much as any other, evenly spaced. Only a window
+    # reaching more than half way around needs its first longitude again at
+    # the end.
+    relative = (axis - axis[0]) % 360.
+    order = numpy.argsort(relative, kind='stable')
+    gaps = numpy.diff(numpy.append(relative[order], 360.))
+    order = numpy.roll(order, -((numpy.argmax(gaps) + 1) % len(order)))
+    origin = axis[order[0]]
+    ordered = (axis[order] - origin) % 360.
+    if 360. - ordered[-1] < 180.:
+        ordered = numpy.append(ordered, 360.)
+        order = numpy.append(order, order[0])
+    values = (values - origin) % 360.
+
+    left, right, ok = ordered_cells(ordered, values)
+    west = values - ordered[left]
+    east = ordered[right] - values
+    ok &= (west < 180.) & (east < 180.)
+    left, right = order[left], order[right]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        fraction = numpy.where(left == right, 0.5, west / (west + east))
+    return left, right, numpy.clip(fraction, 0., 1.), ok
+
+def ordered_cells(ordered, values):
+    """
+    Return, for each of values, the indices into the ascending array
+    ordered of the greatest value at or below it and the least value at or
+    above it, and whether both exist.
+    """
+    n = len(ordered)
+    step = (ordered[-1] - ordered[0]) / (n - 1) if n > 1 else 0.
+    if step > 0 and numpy.allclose(numpy.diff(ordered), step):
+        # The GFS grids are evenly spaced, which makes this a good deal
+        # quicker than a binary search.
+        position = numpy.clip((values - ordered[0]) / step, 0, n - 1)
+        left = numpy.floor(position).astype(numpy.intp)
+        right = numpy.ceil(position).astype(numpy.intp)
+        # Rounding may have put a value on or near a grid line in the
+        # cell beside it.
+        left -= (left > 0) & (ordered.take(left) > values)
+        left += (left < n - 1) & (ordered.take(numpy.minimum(left + 1, n - 1)) <= values)
+        right += (right < n - 1) & (ordered.take(right) < values)
+        right -= (right > 0) & (ordered.take(numpy.maximum(right - 1, 0)) >= values)
+    else:
+        left = numpy.clip(numpy.searchsorted(ordered, values, side='right') - 1, 0, n - 1)
+        right = numpy.clip(numpy.searchsorted(ordered, values, side='left'), 0, n - 1)
+    ok = (ordered.take(left) <= values) & (ordered.take(right) >= values)
+    return left, right, ok
+
+def longitude_distance(lona, lonb):
+    """
+    Return the distance in degrees between longitudes lona and lonb, which
+    is never more than 180.
+    """
+    distance = numpy.fabs(lona - lonb) % 360.
+    return numpy.minimum(distance, 360. - distance)
+
+def lerp(a, b, fraction):
+    return a * (1. - fraction) + b * fraction
+
+def cell_weights(lat_lambda, lon_lambda):
+    """
+    Return the weights of the values at the corners of a grid cell for
+    interpolating bilinearly to lat_lambda and lon_lambda within it, in the
+    order lower latitude and longitude, lower latitude and higher longitude,
+    higher latitude and lower longitude, and higher latitude and longitude.
+    """
+    return ((1. - lat_lambda) * (1. - lon_lambda), (1. - lat_lambda) * lon_lambda,
+            lat_lambda * (1. - lon_lambda), lat_lambda * lon_lambda)
+
+def bilinear(corners, weights):
+    """
+    Interpolate between the values at the corners of a grid cell with the
+    weights from cell_weights.
+    """
+    value = corners[0] * weights[0]
+    for corner, weight in zip(corners[1:], weights[1:]):
+        value += corner * weight
+    return value